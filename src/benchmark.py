@@ -0,0 +1,198 @@
+# Benchmarks of the book, run from the same folder as main.py: python benchmark.py
+import subprocess
+import sys
+from argparse import ArgumentParser
+from statistics import quantiles
+from threading import Event, Thread
+from time import perf_counter, sleep
+from typing import Callable, Dict, List, Optional
+
+BUTTON_POLL_INTERVAL = 0.01
+
+IMPORT_TIME_SCRIPT = '''
+from time import perf_counter
+start = perf_counter()
+import {module}
+print(perf_counter() - start)
+'''
+
+FIRST_FRAME_SCRIPT = '''
+from time import perf_counter
+start = perf_counter()
+from PIL import Image
+import content
+from constants import save_left_home_path
+# the pages in the order of the book, read only: load_existing_pages would delete and rename pages
+pages = content.sort_with_first_seen_time(content.get_all_saved_right_pages())
+for frame in [save_left_home_path] + pages[:1]:
+    if frame.exists():
+        with Image.open(frame) as img:
+            img.load()
+print(perf_counter() - start)
+'''
+
+
+def run_python(script: str) -> float:
+    """run a script in a fresh python process, so nothing is imported before
+
+    Args:
+        script (str): a script printing the measured seconds on the last line
+
+    Returns:
+        float: the seconds printed by the script
+    """
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def bench_import_time(repeat: int = 3) -> Dict[str, float]:
+    """time importing the modules loaded at startup, the best of the repeats
+
+    Returns:
+        Dict[str, float]: seconds to import each module
+    """
+    return {f'import {module}': min(run_python(IMPORT_TIME_SCRIPT.format(module=module)) for _ in range(repeat))
+            for module in ('constants', 'content')}
+
+
+def bench_first_frame(repeat: int = 3) -> Dict[str, float]:
+    """time from a fresh process to the last saved frames decoded and ready for the screens
+
+    Returns:
+        Dict[str, float]: seconds to the first frame
+    """
+    return {'time to first frame': min(run_python(FIRST_FRAME_SCRIPT) for _ in range(repeat))}
+
+
+def render_load() -> 'Image.Image':
+    """a left page like render: text drawn on a screen sized frame and python work like filling the templates
+    """
+    from PIL import Image, ImageDraw, ImageFont
+
+    from constants import EINK_SCREEN_SIZE
+    image = Image.new('L', EINK_SCREEN_SIZE, 0xFF)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    for line in range(60):
+        text = ' '.join(f'{word:>6}' for word in range(line, line + 40))
+        draw.text((20, 20 + line * 30), text, font=font, fill=0)
+    return image
+
+
+def measure_button_latency(seconds: float) -> List[float]:
+    """poll like the button thread and measure how late each poll wakes up
+
+    Returns:
+        List[float]: lateness of every poll in seconds
+    """
+    lateness = []
+    end_time = perf_counter() + seconds
+    while perf_counter() < end_time:
+        start = perf_counter()
+        sleep(BUTTON_POLL_INTERVAL)
+        lateness.append(perf_counter() - start - BUTTON_POLL_INTERVAL)
+    return lateness
+
+
+def bench_input_latency(seconds: float = 5) -> Dict[str, float]:
+    """the lateness of the button polls while idle, while rendering in a thread of the display process
+       and while rendering in the render process with the frames handed over in shared memory
+
+    Returns:
+        Dict[str, float]: median and 99th percentile of the lateness of each case
+    """
+    from frame_handoff import RenderProcess
+
+    def render_while(render: Optional[Callable[[], object]]) -> List[float]:
+        if render is None:
+            return measure_button_latency(seconds)
+        stop = Event()
+
+        def run() -> None:
+            while not stop.is_set():
+                render()
+
+        thread = Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            return measure_button_latency(seconds)
+        finally:
+            stop.set()
+            thread.join()
+
+    render_process = RenderProcess(renderers={'load': render_load})
+    render_process.start()
+    try:
+        render_process.render_frame('load')  # the worker imports its modules first
+        cases = {
+            'idle': None,
+            'render in process': render_load,
+            'render process': lambda: render_process.render_frame('load'),
+        }
+        results = {}
+        for name, render in cases.items():
+            percentiles = quantiles(render_while(render), n=100)
+            results[f'input latency p50 {name}'] = percentiles[49]
+            results[f'input latency p99 {name}'] = percentiles[98]
+        return results
+    finally:
+        render_process.stop()
+
+
+def bench_flip(num_pages: int = 10) -> Dict[str, float]:
+    """turn the pages of a book with fake displays, the two phases of each page turn are timed by the book.
+       The pages are written to a temporary folder, the pages of the book are not touched
+
+    Returns:
+        Dict[str, float]: mean seconds of the preview, the refinement and the whole page turn
+    """
+    import tempfile
+    from pathlib import Path
+
+    from PIL import Image, ImageDraw
+
+    import metrics
+    from constants import EINK_SCREEN_SIZE, FLIP_REFINE_DELAY
+    from trace_replay import ReplayBook
+
+    book = ReplayBook(fake_render=True)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pages = []
+        for number in range(num_pages):
+            image = Image.new('L', EINK_SCREEN_SIZE, 0xFF)
+            ImageDraw.Draw(image).text((100, 100 + number * 50), f'page {number}', fill=0)
+            pages.append(Path(temp_dir) / f'page_{number}.jpg')
+            image.save(pages[-1])
+        book.add_right_pages(pages)
+        for page in range(num_pages):
+            book.go_to_page(page)
+            # wait for the refinement, otherwise the next page turn cancels it
+            sleep(FLIP_REFINE_DELAY + 0.2)
+
+    timings = metrics.snapshot()['timings']
+    return {f'flip {phase} mean': timings[f'flip.{phase}_seconds']['total'] / timings[f'flip.{phase}_seconds']['count']
+            for phase in ('preview', 'refine', 'total') if f'flip.{phase}_seconds' in timings}
+
+
+BENCHMARKS: Dict[str, Callable[[], Dict[str, float]]] = {
+    'import': bench_import_time,
+    'first_frame': bench_first_frame,
+    'input_latency': bench_input_latency,
+    'flip': bench_flip,
+}
+
+
+def main(names: List[str]) -> None:
+    for name in names:
+        for label, seconds in BENCHMARKS[name]().items():
+            print(f'{label:<40} {seconds * 1000:10.1f} ms')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('benchmarks', nargs='*', default=list(BENCHMARKS), help=f'benchmarks to run: {", ".join(BENCHMARKS)}')
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'unknown benchmarks: {", ".join(unknown)}')
+    main(args.benchmarks)
@@ -0,0 +1,134 @@
+# Black and white versions of the pages for the fast preview of a page turn
+from collections import OrderedDict
+from logging import getLogger
+from pathlib import Path
+from queue import SimpleQueue
+from threading import Lock, Thread
+from typing import Iterable, List, Optional, Tuple
+
+from PIL import Image
+
+import memory
+import metrics
+from constants import *
+from native_frames import load_native_frame, prepare_native_frame
+
+logger = getLogger(__name__)
+
+
+def to_bilevel(frame: Frame, size: Tuple[int, int], profile: Optional[DisplayProfile] = None) -> Image.Image:
+    """make a dithered black and white copy of a frame, the only levels the fast waveforms can draw
+
+    Args:
+        frame (Frame): a frame in memory or a path to a image
+        size (Tuple[int, int]): size of the screen
+        profile (Optional[DisplayProfile], optional): make the copy in the native orientation of this display
+
+    Returns:
+        Image.Image: the frame in mode 1 within the size
+    """
+    if profile is not None:
+        return load_native_frame(frame, profile).convert('1')
+    if isinstance(frame, Image.Image):
+        img = frame.convert('L')
+    else:
+        with Image.open(frame) as opened:
+            opened.draft('L', size)
+            img = opened.convert('L')
+    img.thumbnail(size)
+    return img.convert('1')
+
+
+class BilevelCache:
+    """Keep the black and white previews of the latest pages, created in the background when pages are added
+    """
+    def __init__(self, size: Tuple[int, int] = EINK_SCREEN_SIZE, max_pages: int = BILEVEL_CACHE_MAX_PAGES,
+                 profile: Optional[DisplayProfile] = None) -> None:
+        self.size = size
+        self.profile = profile
+        self.max_pages = max_pages
+        self._previews: 'OrderedDict[str, Image.Image]' = OrderedDict()
+        self._lock = Lock()
+        # the new pages are created one batch after another by a single worker
+        self._pending: 'SimpleQueue[List[Path]]' = SimpleQueue()
+        self._worker: Optional[Thread] = None
+        memory.budget.register('bilevel_cache', self.evict_oldest)
+
+    @staticmethod
+    def _key(page: Path) -> str:
+        return f'{page}:{page.stat().st_mtime_ns}'
+
+    def get(self, frame: Frame) -> Image.Image:
+        """get the preview of a frame, created now if it is not cached
+
+        Args:
+            frame (Frame): a frame in memory or a path to a page
+
+        Returns:
+            Image.Image: the black and white preview
+        """
+        if isinstance(frame, Image.Image):
+            return to_bilevel(frame, self.size, self.profile)
+
+        key = self._key(frame)
+        with self._lock:
+            preview = self._previews.get(key)
+            if preview is not None:
+                self._previews.move_to_end(key)
+                metrics.inc('bilevel_cache.hits')
+                return preview
+
+        metrics.inc('bilevel_cache.misses')
+        return self._add(key, frame)
+
+    def _add(self, key: str, page: Path) -> Image.Image:
+        preview = to_bilevel(page, self.size, self.profile)
+        with self._lock:
+            old_preview = self._previews.pop(key, None)
+            if old_preview is not None:
+                memory.budget.release('bilevel_cache', memory.image_bytes(old_preview))
+            self._previews[key] = preview
+        memory.budget.charge('bilevel_cache', memory.image_bytes(preview))
+        while len(self._previews) > self.max_pages:
+            self.evict_oldest()
+        return preview
+
+    def evict_oldest(self) -> int:
+        """drop the least recently used preview, also called by the memory budget
+
+        Returns:
+            int: number of bytes freed
+        """
+        with self._lock:
+            if len(self._previews) == 0:
+                return 0
+            _, preview = self._previews.popitem(last=False)
+        num_bytes = memory.image_bytes(preview)
+        memory.budget.release('bilevel_cache', num_bytes)
+        return num_bytes
+
+    def precompute(self, pages: Iterable[Path]) -> None:
+        """create the previews of new pages in the worker thread of the cache, after the pages added before
+
+        Args:
+            pages (Iterable[Path]): the new pages
+        """
+        self._pending.put(list(pages))
+        with self._lock:
+            if self._worker is None:
+                self._worker = Thread(target=self._precompute, name='bilevel_cache', daemon=True)
+                self._worker.start()
+
+    def _precompute(self) -> None:
+        while True:
+            for page in self._pending.get():
+                try:
+                    if self.profile is not None:
+                        # pages downloaded from a render server are not rotated yet
+                        prepare_native_frame(page, self.profile)
+                    key = self._key(page)
+                    if key not in self._previews:
+                        self._add(key, page)
+                except Exception as e:
+                    logger.error(f'cannot create the preview of {page}: {e}')
+
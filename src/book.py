@@ -1,45 +1,98 @@
 import os
+from contextlib import contextmanager
 from logging import getLogger
 from multiprocessing import Queue
 from pathlib import Path
-from threading import Thread
+from queue import SimpleQueue
+from threading import RLock, Thread, Timer
 from time import monotonic, sleep, time
-from typing import List, Optional
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
-from PIL import Image
+from PIL import Image, ImageQt
 from PyQt5.QtCore import QThread, pyqtSignal
 from PyQt5.QtGui import QPixmap
 from PyQt5.QtWidgets import QMainWindow
 
 import content
+import memory
+import metrics
+import network
+import profiling
+import startup
+import trace_recorder
+import warm_restart
+from bilevel_cache import BilevelCache
 from constants import *
-from content import create_page_left_notify, create_pages
+from content import create_page_left_notify, iter_pages
 from flip_gui import Ui_MainWindow
+from memory import load_image
+from native_frames import load_native_frame, native_frame_path
+from navigation import Navigator
+from overview import ThumbnailCache, compose_overview, overview_first_page
+from page_list import PageList
 
 try:
     import RPi.GPIO as GPIO
     from IT8951 import constants
     from IT8951.display import AutoEPDDisplay
+    from IT8951.interface import EPD
 except ModuleNotFoundError as e:
     print('Ignore this if running virtually')
+    from fake_devices import it8951_constants as constants
     
 
+def native_display_profile(native_size: Tuple[int, int]) -> Optional[DisplayProfile]:
+    """the profile to pre-rotate the frames for a controller, the frames are only pre-rotated
+       when it is enabled and the frame buffer of the controller is the size of the profile
+
+    Args:
+        native_size (Tuple[int, int]): width and height of the frame buffer of the controller
+
+    Returns:
+        Optional[DisplayProfile]: DISPLAY_PROFILE, None if the controller rotates the pages
+    """
+    if PRE_ROTATE_FRAMES and native_size == DISPLAY_PROFILE.size:
+        return DISPLAY_PROFILE
+    return None
+
+
+def get_new_updates(social_media_scraper, photo_watcher=None) -> List[Update]:
+    """get the new photos from the photo watcher if it is running, otherwise ask the scraper to rescan its folders
+
+    Returns:
+        List[Update]: the new updates
+    """
+    if photo_watcher is not None:
+        return photo_watcher.get_updates()
+    return social_media_scraper.get_new_photos_from_followings()
+
+
+def to_qpixmap(frame: Frame) -> QPixmap:
+    """convert a frame in memory or a path to a image to a QPixmap for the virtual book
+    """
+    if isinstance(frame, Image.Image):
+        return ImageQt.toqpixmap(frame)
+    return QPixmap(str(frame))
+
+
 class GeneralBook:
     """This class contain the functions that are useful for both book and virtual book
     """     
     def __init__(self) -> None:
         self.current_page = HOME_PAGE_NUM
         self.left_page_list = [None, None]
-        self.right_page_list = []
+        self.right_page_list = PageList()
         self.showing_notification = False
+        # pages dropped by expire_pages since the start, the new pages are numbered after them
+        self.dropped_pages = 0
 
-    def add_left_home_page(self, left_page_path: Path) -> None:
+    def add_left_home_page(self, left_page: Frame) -> None:
         """add the page to the first page of the left screen
 
         Args:
-            left_page_path (Path): a path to the image of the left hoem page 
+            left_page (Frame): the frame or a path to the image of the left home page 
         """        
-        self.left_page_list[HOME_PAGE_NUM] = left_page_path
+        self.left_page_list[HOME_PAGE_NUM] = left_page
 
     def has_next_page(self) -> bool:
         """a helper function to check if there is a next page available
@@ -47,7 +100,8 @@ class GeneralBook:
         Returns:
             bool: is currently at the last page 
         """        
-        return self.current_page != len(self.right_page_list) - 1 and not len(self.right_page_list) == 0
+        pages = self.right_page_list.snapshot()
+        return self.current_page != len(pages) - 1 and not len(pages) == 0
 
     def has_previous_page(self) -> bool:
         """a helper function to check if there is a previous page available
@@ -64,21 +118,15 @@ class GeneralBook:
             page (List[Path]): a list of pages to add 
         """               
         if len(page) != 0:
-            self.right_page_list.extend(page)
-            self.logger.info(f'now have {len(self.right_page_list)} pages')
+            pages = self.right_page_list.extend(page)
+            self.logger.info(f'now have {len(pages)} pages')
 
     def next_page(self) -> None:
         """move to next page if there is next page
         """        
         self.logger.debug('Going to next page')
         if self.has_next_page():
-            self.current_page += 1
-            self.update_right_page()
-            if not self.has_next_page():
-                # check read all new pages
-                if self.showing_notification:
-                    self.showing_notification = False
-                    self.show_left_home_page()
+            self.go_to_page(self.current_page + 1)
 
         self.logger.debug(f'Now in page{self.current_page}')
 
@@ -87,15 +135,36 @@ class GeneralBook:
         """        
         self.logger.debug('Going to previous page')
         if self.has_previous_page():
-            self.current_page -= 1
-            self.update_right_page()
+            self.go_to_page(self.current_page - 1)
         self.logger.debug(f'Now in page{self.current_page}')
 
+    def go_to_page(self, page_num: int) -> None:
+        """show the given page of the right screen, the notification is cleared at the last page
+
+        Args:
+            page_num (int): index of the page in the right page list
+        """
+        self.current_page = page_num
+        self.update_right_page()
+        if not self.has_next_page():
+            # check read all new pages
+            if self.showing_notification:
+                self.showing_notification = False
+                self.show_left_home_page()
+
+    def load_last_frames(self) -> None:
+        """load the frames saved before the last shutdown, so something is shown before any page is created
+        """
+        if save_left_home_path.exists():
+            self.add_left_home_page(save_left_home_path)
+        self.add_right_pages(content.load_existing_pages())
+
     def load_demo_pages(self) -> None:
         """load the demo pages
         """        
         self.add_left_home_page(demo_left_page_path)
-        self.right_page_list = demo_right_pages_list
+        # a copy, the demo pages of the constants are never changed by the book
+        self.right_page_list.replace(demo_right_pages_list)
         self.show_home_page()
 
     def show_home_page(self) -> None:
@@ -108,14 +177,73 @@ class GeneralBook:
     def show_notify_page(self):
         """show the notify page on the left screen
         """        
-        self.left_page_list[NOTIFY_PAGE_NUM] = create_page_left_notify()
+        self.left_page_list[NOTIFY_PAGE_NUM] = self.create_notify_page()
         self._show_notify_page()
         self.showing_notification = True
 
+    def create_notify_page(self) -> Frame:
+        """create the notify page for the left screen
+
+        Returns:
+            Frame: the notify page
+        """
+        return create_page_left_notify()
+
+    def create_left_home_page(self, news) -> Frame:
+        """create the home page for the left screen
+
+        Args:
+            news: the news client
+
+        Returns:
+            Frame: the home page
+        """
+        return content.create_page_left_home(news)
+
+    def expire_pages(self) -> int:
+        """drop the oldest pages from the book once they are older than a day, like at startup, or the book
+           is longer than BOOK_MAX_PAGES. They are not protected anymore, so retention can delete them
+
+        Returns:
+            int: number of pages dropped
+        """
+        pages = self.right_page_list.snapshot()
+        count = 0
+        while count < len(pages) and (len(pages) - count > BOOK_MAX_PAGES or not self._is_page_alive(pages[count])):
+            count += 1
+        if count != 0:
+            self.right_page_list.drop_first(count)
+            self.dropped_pages += count
+            self.current_page = max(self.current_page - count, HOME_PAGE_NUM)
+            self.logger.info(f'{count} old pages dropped from the book')
+        return count
+
+    @staticmethod
+    def _is_page_alive(page: Path) -> bool:
+        if page.parent != saved_right_pages_path:
+            # e.g. the demo pages, which never expire
+            return True
+        try:
+            return content.is_create_within_24_hour(page)
+        except FileNotFoundError:
+            return False
+
+    def get_protected_pages(self) -> List[Path]:
+        """get the files that are in the book or on the screens, which should never be deleted
+
+        Returns:
+            List[Path]: pages of both screens and the photos of the news on the left page
+        """
+        pages = [page for page in self.left_page_list if isinstance(page, Path)]
+        pages.extend(self.right_page_list)
+        pages.extend(content.get_left_page_files())
+        return pages
+
 
 
 class Book(GeneralBook):
-    def __init__(self, queue: Queue, demo: bool, social_media_scraper, fetch: bool):
+    def __init__(self, queue: Queue, demo: bool, social_media_scraper, fetch: bool, render_client=None, photo_watcher=None,
+                 render_process=None, scrape_supervisor=None):
         super().__init__()
 
         self.demo = demo
@@ -123,8 +251,36 @@ class Book(GeneralBook):
         self.social_media_scraper = social_media_scraper
         self.logger = getLogger('Book')
         self.fetch = fetch
-
+        self.render_client = render_client
+        self.render_process = render_process
+        self.scrape_supervisor = scrape_supervisor
+        self.photo_watcher = photo_watcher
+        self.left_frame_shown: Optional[Frame] = None
+        self.stream_pages = True
+        self._page_batches = SimpleQueue()
+        self._page_thread = None
+        # held while drawing on the right display, the page turns, the overview and the restore come from different threads.
+        # The left display has its own lock, a page can be turned while the left page refreshes
+        self._flip_lock = RLock()
+        self._display_locks = {'left': RLock(), 'right': self._flip_lock}
+        self._flip_generation = 0
+        self._refine_timer = None
+        self.navigator = Navigator(lambda: len(self.right_page_list), self.go_to_page)
+        self.thumbnails = ThumbnailCache()
+        # the selected page while the overview is shown on the right screen, None when it is closed
+        self.overview_cursor: Optional[int] = None
+        self.overview_navigator = Navigator(lambda: len(self.right_page_list), self.show_overview)
+        self._overview_first_shown: Optional[int] = None
+        # the frame drawn on each panel, None when the panel shows something a restart cannot draw again
+        self.panel_frames: Dict[str, Optional[Frame]] = {'left': None, 'right': None}
+        # the keys of the frames on the panels from the snapshot, only while the last state is restored
+        self._restored_keys: Dict[str, Optional[str]] = {}
+        self.snapshot_writer = warm_restart.SnapshotWriter(self.get_snapshot_state)
+
+        # the profile of the pre-rotated frames, set by set_display when the displays draw them as they are
+        self.display_profile: Optional[DisplayProfile] = None
         self.set_display()
+        self.bilevel_cache = BilevelCache(profile=self.display_profile)
         self.set_gpio()
         self.check_user_option_thread = Thread(target=self.check_user_option, args=(self.queue,))
 
@@ -134,32 +290,94 @@ class Book(GeneralBook):
             self.load_demo_pages()
 
     def set_display(self) -> None:
-        """setup the eink displays using the 3rd party library
+        """setup the eink displays using the 3rd party library. The controllers are opened first,
+           so the displays are only left in their native orientation when the pre-rotated frames fit them
         """        
-        self.left_display = AutoEPDDisplay(vcom=-1.45,
-                                bus=0,
-                                device=0,
-                                rotate='CCW',
-                                spi_hz=24000000,
-                                reset_pin=spi0.RESET,
-                                cs_pin=spi0.CS,
-                                hrdy_pin=spi0.HRDY
-                                )  # Left screen
-    
-        self.right_display = AutoEPDDisplay(vcom=-1.55,
-                                            bus=1,
-                                            device=0,
-                                            rotate='CCW',
-                                            spi_hz=24000000,
-                                            reset_pin=spi1.RESET,
-                                            cs_pin=spi1.CS,
-                                            hrdy_pin=spi1.HRDY
-                                            )  # Right screen
+        left_epd = EPD(vcom=-1.45,
+                       bus=0,
+                       device=0,
+                       spi_hz=24000000,
+                       reset_pin=spi0.RESET,
+                       cs_pin=spi0.CS,
+                       hrdy_pin=spi0.HRDY
+                       )  # Left screen
+        right_epd = EPD(vcom=-1.55,
+                        bus=1,
+                        device=0,
+                        spi_hz=24000000,
+                        reset_pin=spi1.RESET,
+                        cs_pin=spi1.CS,
+                        hrdy_pin=spi1.HRDY
+                        )  # Right screen
+        self.display_profile = native_display_profile((right_epd.width, right_epd.height))
+        # the controller rotates the pages itself when the frames are not pre-rotated for it
+        rotate = None if self.display_profile is not None else DISPLAY_PROFILE.rotate
+        self.left_display = AutoEPDDisplay(epd=left_epd, rotate=rotate)
+        self.right_display = AutoEPDDisplay(epd=right_epd, rotate=rotate)
+        memory.budget.register('display_frame_buffers')
+        for display in (self.left_display, self.right_display):
+            memory.budget.charge('display_frame_buffers', memory.image_bytes(display.frame_buf))
+
+    def add_right_pages(self, page: List[Path]) -> None:
+        """add a list of pages to the right page list and prepare their fast previews
+
+        Args:
+            page (List[Path]): a list of pages to add 
+        """
+        super().add_right_pages(page)
+        if TWO_PHASE_FLIP:
+            self.bilevel_cache.precompute(page)
+        self.thumbnails.precompute(page)
 
     def update_right_page(self) -> None:
         """display the current page on the eink screen
         """        
-        self.display_image_8bpp(self.right_display, self.right_page_list[self.current_page])
+        if TWO_PHASE_FLIP:
+            self.flip_two_phase(self.right_display, self.right_page_list[self.current_page])
+        else:
+            self.display_image_8bpp(self.right_display, self.right_page_list[self.current_page])
+
+    def flip_two_phase(self, display, frame: Frame) -> None:
+        """show a black and white preview of the page with the fast A2 waveform at once,
+           then refine it with GC16 unless another page is turned before the refinement starts
+
+        Args:
+            display ([type]): a specified eink screen
+            frame (Frame): a frame in memory or a path to a image
+        """
+        start_time = monotonic()
+        with self._flip_lock:
+            self._flip_generation += 1
+            generation = self._flip_generation
+            if self._refine_timer is not None:
+                self._refine_timer.cancel()
+
+            preview = self.bilevel_cache.get(frame)
+            display.frame_buf.paste(0xFF, box=(0, 0, display.width, display.height))
+            display.frame_buf.paste(preview, [display.width - preview.size[0], display.height - preview.size[1]])
+            display.draw_full(constants.DisplayModes.A2)
+            self.panel_frames[self._panel_of(display)] = None
+            preview_seconds = monotonic() - start_time
+            metrics.observe('flip.preview_seconds', preview_seconds)
+            self.logger.debug(f'preview shown in {preview_seconds * 1000:.0f} ms')
+
+            self._refine_timer = Timer(FLIP_REFINE_DELAY, self._refine, args=(display, frame, generation, start_time))
+            self._refine_timer.start()
+
+    def _refine(self, display, frame: Frame, generation: int, start_time: float) -> None:
+        """the second phase of flip_two_phase, skipped if another page has been turned
+        """
+        with self._flip_lock:
+            if generation != self._flip_generation or self.navigator.is_moving() or self.overview_cursor is not None:
+                # another page is turned or is about to be turned
+                metrics.inc('flip.refine_cancelled')
+                return
+            refine_start = monotonic()
+            self.display_image_8bpp(display, frame)
+            refine_seconds, total_seconds = monotonic() - refine_start, monotonic() - start_time
+            metrics.observe('flip.refine_seconds', refine_seconds)
+            metrics.observe('flip.total_seconds', total_seconds)
+            self.logger.debug(f'page refined in {refine_seconds * 1000:.0f} ms, {total_seconds * 1000:.0f} ms after the press')
 
     def clear_display(self, display):
         """display a blank page on the specified eink screen
@@ -167,42 +385,84 @@ class Book(GeneralBook):
         Args:
             display ([type]): a specified eink screen
         """        
-        self.logger.info('Clearing display ....')
-        display.clear()
-
-    def display_image_8bpp(self, display, img_path: Path):
-        """display the image from the img_path on the specified eink screen
+        with self._drawing(display):
+            self.logger.info('Clearing display ....')
+            display.clear()
+            self.panel_frames[self._panel_of(display)] = None
+
+    def _panel_of(self, display) -> str:
+        return 'left' if display is self.left_display else 'right'
+
+    @contextmanager
+    def _drawing(self, display) -> Iterator[None]:
+        """hold the lock of a display while drawing on it, a frame drawn on the right display
+           replaces the page whose refinement is pending
+        """
+        panel = self._panel_of(display)
+        with self._display_locks[panel]:
+            if panel == 'right':
+                self._flip_generation += 1
+            yield
+
+    def display_image_8bpp(self, display, frame: Frame):
+        """display the frame on the specified eink screen
            Note: it is mainly from the open-source code from github
         Args:
             display ([type]): a specified eink screen
-            img_path (Path): a path to a image
+            frame (Frame): a frame in memory or a path to a image
         """        
-        self.logger.info('Displaying "{}"...'.format(img_path))
-        # todo hard code
-        # clearing image to white
-        display.frame_buf.paste(0xFF, box=(0, 0, display.width, display.height))
-
-        img = Image.open(img_path)
-
-        dims = (display.width, display.height)
-        # self.logger.debug(f'dims: {dims} img: {img.size}')
-        img.thumbnail(dims)
-        paste_coords = [dims[i] - img.size[i] for i in (0, 1)]  # align image with bottom of display
-        display.frame_buf.paste(img, paste_coords)
-
-        display.draw_full(constants.DisplayModes.GC16)
-
-    def partial_update(self, display, img_path: Path):
+        panel = self._panel_of(display)
+        with self._drawing(display):
+            restored_key = self._restored_keys.get(panel)
+            if restored_key is not None and restored_key == warm_restart.frame_key(frame):
+                # the panel still shows this frame from before the restart
+                self.logger.info(f'The {panel} screen already shows the frame')
+                metrics.inc('warm_restart.skipped_refreshes')
+                self.panel_frames[panel] = frame
+                return
+
+            self.logger.info('Displaying "{}"...'.format(frame if isinstance(frame, Path) else 'frame in memory'))
+            if self.display_profile is not None:
+                # already fitted and rotated, no transform before the refresh
+                display.frame_buf.paste(load_native_frame(frame, self.display_profile), (0, 0))
+                display.draw_full(constants.DisplayModes.GC16)
+                self.panel_frames[panel] = frame
+                return
+
+            # todo hard code
+            # clearing image to white
+            display.frame_buf.paste(0xFF, box=(0, 0, display.width, display.height))
+
+            img = frame if isinstance(frame, Image.Image) else load_image(frame)
+
+            dims = (display.width, display.height)
+            # self.logger.debug(f'dims: {dims} img: {img.size}')
+            if img.size[0] > dims[0] or img.size[1] > dims[1]:
+                # thumbnail works in place, keep the frame in memory untouched
+                img = img.copy()
+                img.thumbnail(dims)
+            paste_coords = [dims[i] - img.size[i] for i in (0, 1)]  # align image with bottom of display
+            display.frame_buf.paste(img, paste_coords)
+
+            display.draw_full(constants.DisplayModes.GC16)
+            self.panel_frames[panel] = frame
+
+    def partial_update(self, display, frame: Frame):
         """Partilly update the specified eink screen with a given image.
            However, acceptable size of image to this function has not yet been tested
 
         Args:
             display ([type]): a specified eink screen
-            img_path (Path): a path of the image want to partially update on the specified position
-        """        
-        img = Image.open(img_path)
-        display.frame_buf.paste(img, (0, 0))
-        display.draw_partial(constants.DisplayModes.DU)
+            frame (Frame): a frame in memory or a path to the image want to partially update on the specified position
+        """
+        with self._drawing(display):
+            if self.display_profile is not None:
+                img = load_native_frame(frame, self.display_profile)
+            else:
+                img = frame if isinstance(frame, Image.Image) else load_image(frame)
+            display.frame_buf.paste(img, (0, 0))
+            display.draw_partial(constants.DisplayModes.DU)
+            self.panel_frames[self._panel_of(display)] = None
 
     def read_notification(self):
         """Play the pre-recorded sound using Raspberry Pi
@@ -216,22 +476,93 @@ class Book(GeneralBook):
     def _show_notify_page(self):
         """show the notification page on the left screen
         """        
-        self.display_image_8bpp(self.left_display, self.left_page_list[NOTIFY_PAGE_NUM])
+        self.display_left_frame(self.left_page_list[NOTIFY_PAGE_NUM])
+
+    def display_left_frame(self, frame: Frame) -> None:
+        """display a frame on the left screen, nothing is done if the same composed frame is already shown
+
+        Args:
+            frame (Frame): a frame in memory or a path to a image
+        """
+        if isinstance(frame, Image.Image) and frame is self.left_frame_shown:
+            metrics.inc('left_page.skipped_refreshes')
+            return
+        self.display_image_8bpp(self.left_display, frame)
+        self.left_frame_shown = frame
+
+    def open_overview(self) -> None:
+        """show the thumbnails of the pages on the right screen, the cursor starts at the current page
+        """
+        with self._flip_lock:
+            if len(self.right_page_list) == 0:
+                self.logger.info('No page for the overview')
+                return
+            self._overview_first_shown = None
+            self.overview_navigator.sync(self.current_page)
+            self.show_overview(self.current_page)
+
+    def show_overview(self, cursor: int) -> None:
+        """draw the overview with the cursor on the given page, the navigator of the overview calls it
+           once the presses stop. Moving the cursor within the same grid only refreshes what changed
+
+        Args:
+            cursor (int): index of the selected page
+        """
+        # the overview is opened, moved and closed from different threads, it is checked and drawn in one go
+        with self._flip_lock:
+            if self.overview_cursor is None and self._overview_first_shown is not None:
+                # closed while the cursor was moving
+                return
+            self.overview_cursor = cursor
+            pages = self.right_page_list.snapshot()
+            frame = compose_overview(pages, cursor, self.thumbnails)
+            first = overview_first_page(cursor)
+            if first == self._overview_first_shown:
+                self.partial_update(self.right_display, frame)
+                metrics.inc('overview.partial_refreshes')
+            else:
+                self.display_image_8bpp(self.right_display, frame)
+                self._overview_first_shown = first
+                metrics.inc('overview.full_refreshes')
+
+    def close_overview(self) -> None:
+        """close the overview and show the selected page, one refresh instead of one per page in between
+        """
+        with self._flip_lock:
+            if self.overview_cursor is None:
+                return
+            cursor = self.overview_cursor
+            self.overview_cursor = None
+            self.navigator.sync(cursor)
+            self.go_to_page(cursor)
+        metrics.inc('overview.jumps')
+
+    def toggle_overview(self) -> None:
+        """the left long press, opens the overview or jumps to the selected page
+        """
+        if self.overview_cursor is None:
+            self.open_overview()
+        else:
+            self.close_overview()
 
     def show_right_home_page(self) -> None:
         """show the first page of the right screen
         """        
-        try:
-            self.display_image_8bpp(self.right_display, self.right_page_list[HOME_PAGE_NUM])
-        except IndexError:
-            self.logger.info('No page to show')
-            self.clear_display(self.right_display)
+        with self._flip_lock:
+            try:
+                self.display_image_8bpp(self.right_display, self.right_page_list[HOME_PAGE_NUM])
+            except IndexError:
+                self.logger.info('No page to show')
+                self.clear_display(self.right_display)
 
     def show_left_home_page(self) -> None:
         """show the first page of the left screen
         """        
+        if self.left_page_list[HOME_PAGE_NUM] is None:
+            self.logger.info('No left page to show')
+            return
         # self.partial_update(self.left_display, self.left_page_list[HOME_PAGE_NUM])
-        self.display_image_8bpp(self.left_display, self.left_page_list[HOME_PAGE_NUM])
+        self.display_left_frame(self.left_page_list[HOME_PAGE_NUM])
 
     def __del__(self):
         self.logger.info('Cleaning up GPIO...')
@@ -285,67 +616,358 @@ class Book(GeneralBook):
                     if monotonic() - start_time > 5:
                         # long press to update feeds
                         self.logger.info('Button long pressed')
-                        if queue.empty():
-                            queue.put(1)
+                        self.request_scrape()
                         scrape = True
                         break
-                if not scrape and self.has_next_page():
-                    self.logger.debug('Right button is pressed')
-                    self.next_page()
-
-                elif not scrape and not self.has_next_page():
-                    self.logger.debug('Right button is pressed but no next page')
+                if scrape:
+                    trace_recorder.record('button', button='right', long=True)
+                else:
+                    # only moves the target page, the presses in a row are shown with one refresh
+                    target = self.press(1)
+                    trace_recorder.record('button', button='right', long=False, target=target)
+                    self.logger.debug(f'Right button is pressed, target page {target}')
 
             # if not self.has_next_page() and not self.has_previous_page():
             #     return
 
-            if GPIO.input(LEFT_BUTTON) and self.has_previous_page():
-                self.logger.debug('Left button is pressed')
-                self.previous_page()
-                # return
-
-            elif GPIO.input(LEFT_BUTTON) and not self.has_previous_page():
-                self.logger.debug('Left button is pressed but no previous page')
+            if GPIO.input(LEFT_BUTTON):
+                overview = False
+                start_time = monotonic()
+                while GPIO.input(LEFT_BUTTON):
+                    if monotonic() - start_time > OVERVIEW_LONG_PRESS:
+                        # long press to open the overview or to jump to the selected page
+                        self.logger.info('Left button long pressed')
+                        overview = True
+                        break
+                    sleep(0.01)
+                if overview:
+                    trace_recorder.record('button', button='left', long=True)
+                    self.toggle_overview()
+                    while GPIO.input(LEFT_BUTTON):
+                        sleep(0.01)
+                else:
+                    target = self.press(-1)
+                    trace_recorder.record('button', button='left', long=False, target=target)
+                    self.logger.debug(f'Left button is pressed, target page {target}')
 
             sleep(0.1)
             
+    def request_scrape(self) -> None:
+        """the right long press, starts a scrape in the scrape process or asks the main loop through the queue
+        """
+        if self.scrape_supervisor is not None:
+            self.scrape_supervisor.request()
+        elif self.queue.empty():
+            self.queue.put(1)
+
+    def press(self, direction: int) -> int:
+        """a short press moves the cursor of the overview when it is open, otherwise the page
+
+        Args:
+            direction (int): 1 for the right button, -1 for the left button
+
+        Returns:
+            int: the target page or cursor
+        """
+        if self.overview_cursor is not None:
+            return self.overview_navigator.press(direction)
+        return self.navigator.press(direction)
+
+    def move_to(self, target: int) -> int:
+        """move the cursor of the overview when it is open, otherwise the page, to the target of a press
+
+        Args:
+            target (int): the target page or cursor
+
+        Returns:
+            int: the target page or cursor, within the pages
+        """
+        if self.overview_cursor is not None:
+            return self.overview_navigator.move_to(target)
+        return self.navigator.move_to(target)
+
+    def wait_for_navigation(self) -> None:
+        """wait until the navigators show their targets
+        """
+        self.navigator.wait_shown()
+        self.overview_navigator.wait_shown()
+
+    def create_notify_page(self) -> Frame:
+        """create the notify page, or download it when the pages are rendered by a render server
+        """
+        if self.render_client is not None:
+            return self.render_client.fetch_left_page('left_notify', save_left_notify_path) or save_left_notify_path
+        if self.render_process is not None:
+            return self.render_process.render_frame('left_notify') or save_left_notify_path
+        return super().create_notify_page()
+
+    def create_left_home_page(self, news) -> Frame:
+        """create the home page, in the render process when there is one
+        """
+        if self.render_process is not None:
+            return self.render_process.render_frame('left_home') or save_left_home_path
+        return super().create_left_home_page(news)
+
+    def expire_pages(self) -> int:
+        """drop the old pages, the page and the cursor being moved to are moved with the pages.
+           Nothing is dropped while the overview is open
+        """
+        with self._flip_lock:
+            if self.overview_cursor is not None:
+                return 0
+            count = super().expire_pages()
+            if count != 0:
+                self.navigator.sync(self.current_page)
+        return count
+
+    def get_protected_pages(self) -> List[Path]:
+        """the pages of the book and of the screens with their native frames,
+           and the photos of the news of the render process when there is one
+        """
+        pages = super().get_protected_pages()
+        # a dropped page can still be on the screen
+        pages.extend(frame for frame in self.panel_frames.values() if isinstance(frame, Path))
+        if self.display_profile is not None:
+            # otherwise a page would be rotated again when it is shown
+            for page in list(pages):
+                try:
+                    pages.append(native_frame_path(page, self.display_profile))
+                except OSError:
+                    pass
+        if self.render_process is not None:
+            pages.extend(self.render_process.iter_paths('left_page_files'))
+        return pages
+
     def check_update(self):
         """chcek any updates from followings and create pages for them
         """        
-        updates = self.social_media_scraper.get_new_photos_from_followings()
+        if self.render_client is not None:
+            # the pages are rendered by the render server
+            pages = self.render_client.fetch_new_pages(self.get_current_book_len())
+            if len(pages) != 0:
+                self.add_right_pages(pages)
+                self.show_notify_page()
+            return
+
+        updates = get_new_updates(self.social_media_scraper, self.photo_watcher)
+        trace_recorder.record_updates(updates)
         
         if len(updates) != 0:
             self.logger.info('There are some updates')
-            # create pages for the updates
-            pages = create_pages(updates, self.get_current_book_len())
-            self.add_right_pages(pages)
-            
-            # display notification on left page
-            self.show_notify_page()
+            if self.stream_pages:
+                # create pages for the updates in the background, the batches are created one by one
+                if self._page_thread is None:
+                    self._page_thread = Thread(target=self._create_page_batches, name='create_pages', daemon=True)
+                    self._page_thread.start()
+                self._page_batches.put(updates)
+            else:
+                self.add_pages_streaming(updates)
+
+    def _create_page_batches(self) -> None:
+        while True:
+            try:
+                self.add_pages_streaming(self._page_batches.get())
+            except Exception as e:
+                self.logger.error(f'cannot create pages: {e}')
+
+    def add_pages_streaming(self, updates: List[Update]) -> None:
+        """add each page to the book as soon as it is created, the notification is shown with the first page
+
+        Args:
+            updates (List[Update]): new updates from the followings
+        """
+        start_time = monotonic()
+        for count, page in enumerate(self.iter_pages(updates)):
+            self.add_right_pages([page])
+            if count == 0:
+                # display notification on left page
+                metrics.observe('pages.first_page_seconds', monotonic() - start_time)
+                self.show_notify_page()
+        metrics.observe('pages.batch_seconds', monotonic() - start_time)
+
+        if self.photo_watcher is not None:
+            # only the photos of this batch are done, the later batches are still in progress
+            self.photo_watcher.commit(updates)
+
+    def iter_pages(self, updates: List[Update]) -> Iterator[Path]:
+        """create the pages of the updates after the existing pages
+
+        Args:
+            updates (List[Update]): new updates from the followings
+
+        Returns:
+            Iterator[Path]: the new pages, each given as soon as it is created
+        """
+        if self.render_process is not None:
+            return self.render_process.iter_paths('pages', updates, self.get_current_book_len())
+        return iter_pages(updates, self.get_current_book_len())
 
     def get_current_book_len(self) -> int:
-        """a helper function to get the length of the right screen page list 
+        """a helper function to get the number of the pages created since the start, the new pages are named after it.
+           The expired pages are counted, so a new page never takes the name of a page still in the book
 
         Returns:
-            int: length of the right screen page list 
+            int: length of the right screen page list with the dropped pages
         """           
-        return len(self.right_page_list)
+        return len(self.right_page_list) + self.dropped_pages
+
+    def get_state(self) -> Dict:
+        """the state of the book that should be the same after replaying a trace
 
+        Returns:
+            Dict: current page, number of pages and notification status
+        """
+        return {'current_page': self.current_page,
+                'num_pages': len(self.right_page_list),
+                'showing_notification': self.showing_notification}
+
+    def get_snapshot_state(self) -> Dict:
+        """the state written by the snapshot writer, with the frame on each panel
+
+        Returns:
+            Dict: current page and its frame, pages, notification status and the frames on the panels
+        """
+        pages = self.right_page_list.snapshot()
+        current_page = self.current_page
+        return {'current_page': current_page,
+                'current_frame': pages[current_page] if 0 <= current_page < len(pages) else None,
+                'num_pages': len(pages),
+                'page_list_version': pages.version,
+                'showing_notification': self.showing_notification,
+                'panels': dict(self.panel_frames)}
+
+    def resume(self) -> None:
+        """show the frames saved before the last shutdown, from where the last run was when there is a snapshot,
+           then keep the snapshot up to date
+        """
+        self.load_last_frames()
+        snapshot = warm_restart.load_snapshot() if WARM_RESTART else None
+        if snapshot is None:
+            self.show_home_page()
+        else:
+            self.restore_snapshot(snapshot)
+        if WARM_RESTART:
+            self.snapshot_writer.start()
+
+    def restore_snapshot(self, snapshot: Dict) -> None:
+        """go back to the page and the notification of the snapshot, the panels still showing
+           the frame they would draw are not refreshed
+
+        Args:
+            snapshot (Dict): the snapshot of the last run from warm_restart.load_snapshot
+        """
+        pages = self.right_page_list.snapshot()
+        self.current_page = warm_restart.find_current_page(pages, snapshot)
+        self.navigator.sync(self.current_page)
+        self.logger.info(f'Resuming at page {self.current_page} of {len(pages)}')
+        self._restored_keys = dict(snapshot['panels'])
+        try:
+            if snapshot['showing_notification'] and save_left_notify_path.exists():
+                self.left_page_list[NOTIFY_PAGE_NUM] = save_left_notify_path
+                self.showing_notification = True
+                self._show_notify_page()
+            else:
+                self.show_left_home_page()
+            with self._flip_lock:
+                if len(pages) != 0:
+                    self.display_image_8bpp(self.right_display, pages[self.current_page])
+                else:
+                    self.show_right_home_page()
+        finally:
+            self._restored_keys = {}
+
+
+
+def run_eink_loop(book: Book, news_factory: Callable = content.NewsClient,
+                  should_stop: Optional[Callable[[], bool]] = None) -> None:
+    """main loop of the eink book, used by main.py and by soak.py with fake devices
+
+    Args:
+        book (Book): the book with its displays
+        news_factory (Callable, optional): creates the news client, slow so it runs in the background
+        should_stop (Optional[Callable[[], bool]], optional): checked every iteration, None to run forever
+    """
+    ##### Important if update this function, should also update VirtualBookUpdate.run #####
+    # show the frames saved before the last shutdown, then create the news client in the background
+    book.resume()
+    startup.mark('first_frame')
+    news_future = startup.run_in_background(news_factory)
+    news = None
+    
+    start_time = time()
+    fetch_time = time()
+    first = True
+    
+    while should_stop is None or not should_stop():
+        profiling.event()
+        if news is None and news_future.done():
+            try:
+                news = news_future.result()
+                book.add_left_home_page(book.create_left_home_page(news))
+                if not book.get_current_showing_status():
+                    book.show_left_home_page()
+                startup.mark('ready')
+            except Exception as e:
+                book.logger.error(f'cannot create news client: {e}')
+                news_future = startup.run_in_background(news_factory)
+
+        scrape_requested = not book.queue.empty()
+        if book.fetch and (time() - fetch_time > 60*60 or first or scrape_requested):
+            book.logger.info('hi')
+            trace_recorder.record('tick', name='fetch')
+            if scrape_requested:
+                book.queue.get()
+            if book.scrape_supervisor is not None:
+                # scraped in the background, the pages are created when its result is taken
+                book.scrape_supervisor.request()
+            else:
+                # fetch from social media
+                network.scrape_followings(book.social_media_scraper)
+                # add pages and create notify when there are updates
+                book.check_update()
+            fetch_time = time()
+        elif book.photo_watcher is not None:
+            # the new photos are already found by the watcher, no rescan of the folders
+            book.check_update()
+        if book.scrape_supervisor is not None and book.scrape_supervisor.take_results():
+            # a scrape finished, even a failed one may have downloaded some photos
+            book.check_update()
+        first = False
+
+        if time() - start_time > 60:
+            trace_recorder.record('tick', name='minute')
+            # update data on left page
+            content.left_page_data_time_update()
+            if book.get_current_showing_status():
+                # Check is the book showing notification, put to notify page            
+                book.logger.info(f'showing status: {book.get_current_showing_status()}')
+                book.show_notify_page()
             
+            elif news is not None:
+                book.add_left_home_page(book.create_left_home_page(news))
+                book.show_left_home_page()
+            start_time = time()
+            
+        # book.check_update()
+        # check the news client more often until it is ready
+        sleep(30 if news is not None else 1)
+
 
 class VirtualBookUpdate(QThread):
     """a helper class to handle virtual book updates
     """    
-    add_left_home_page_signal = pyqtSignal(Path)
+    add_left_home_page_signal = pyqtSignal(object)
     show_page_signal = pyqtSignal(int)
     get_current_book_len_signal = pyqtSignal()
     get_current_showing_status_signal = pyqtSignal()
     add_right_pages_signal = pyqtSignal(list)
  
 
-    def __init__(self, social_media_scraper, queue, fetch) -> None:
+    def __init__(self, social_media_scraper, queue, fetch, photo_watcher=None, scrape_supervisor=None) -> None:
         super().__init__()
         self.social_media_scraper = social_media_scraper
+        self.photo_watcher = photo_watcher
+        self.scrape_supervisor = scrape_supervisor
         self.exiting = False
         self.queue = queue
         self.logger = getLogger('vBookUpdate')
@@ -376,35 +998,51 @@ class VirtualBookUpdate(QThread):
     def check_update(self) -> None:
         """chcek any updates from followings and create pages for them
         """        
-        updates = self.social_media_scraper.get_new_photos_from_followings()
+        updates = get_new_updates(self.social_media_scraper, self.photo_watcher)
 
         if len(updates) != 0:
             self.logger.info('There are some updates')
-            pages = content.create_pages(updates, self.get_current_book_len())
-            self.add_right_pages_signal.emit(pages)
-            self.show_page_signal.emit(SHOW_NOTIFY_PAGE_SIGNAL)  # display notification on left page
+            for count, page in enumerate(content.iter_pages(updates, self.get_current_book_len())):
+                self.add_right_pages_signal.emit([page])
+                if count == 0:
+                    self.show_page_signal.emit(SHOW_NOTIFY_PAGE_SIGNAL)  # display notification on left page
+
+            if self.photo_watcher is not None:
+                self.photo_watcher.commit(updates)
     
 
     def run(self) -> None:
         """main function to run the virtual book backend update
         """        
+        # a QThread is not started by threading, so it is not traced unless it attaches itself
+        profiling.attach_current_thread('VirtualBookUpdate')
         try:
+            # show the frames saved before the last shutdown first
+            if save_left_home_path.exists():
+                self.add_left_home_page_signal.emit(save_left_home_path)
+            self.add_right_pages_signal.emit(content.load_existing_pages())
+            self.show_page_signal.emit(SHOW_HOME_PAGE_SIGNAL)
+            startup.mark('first_frame')
+
             # init content of the virtual book
             news_client = content.NewsClient()
-            # content.init_left_page_data(news)
             self.add_left_home_page_signal.emit(content.create_page_left_home(news_client))
-            self.add_right_pages_signal.emit(content.load_existing_pages())
-            self.show_page_signal.emit(SHOW_HOME_PAGE_SIGNAL)
+            self.show_page_signal.emit(SHOW_LEFT_HOME_SIGNAL)
+            startup.mark('ready')
 
             start_time = time()
             fetch_time = time()
             first = True
 
             while True and not self.exiting:
+                profiling.event()
                 if self.fetch and (time() - fetch_time > 60*60 or first):
                     # fetch from media from instagram
-                    self.social_media_scraper.scrape()
-        
+                    if self.scrape_supervisor is not None:
+                        self.scrape_supervisor.request()
+                    else:
+                        network.scrape_followings(self.social_media_scraper)
+
                     fetch_time = time()
                     first = False
 
@@ -420,6 +1058,10 @@ class VirtualBookUpdate(QThread):
                         self.show_page_signal.emit(SHOW_LEFT_HOME_SIGNAL)
                     start_time = time()
 
+                if self.scrape_supervisor is not None:
+                    # the updates are checked every loop, the results are only logged
+                    for result in self.scrape_supervisor.take_results():
+                        self.logger.info(f'scrape {result.outcome} with {result.photos} new photos')
                 # update right page content if have updates
                 self.check_update()
                 sleep(30)
@@ -429,7 +1071,7 @@ class VirtualBookUpdate(QThread):
 
 
 class VirtualBook(QMainWindow, GeneralBook):
-    def __init__(self, demo, social_media_scraper, fetch) -> None:
+    def __init__(self, demo, social_media_scraper, fetch, photo_watcher=None, scrape_supervisor=None) -> None:
         super().__init__()
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
@@ -450,7 +1092,7 @@ class VirtualBook(QMainWindow, GeneralBook):
             self.hide_start_button()
         else:
             # start the backend update class
-            self.vbook_update = VirtualBookUpdate(social_media_scraper, self.queue, self.fetch)
+            self.vbook_update = VirtualBookUpdate(social_media_scraper, self.queue, self.fetch, photo_watcher, scrape_supervisor)
             self.vbook_update.add_left_home_page_signal.connect(self.add_left_home_page)
             self.vbook_update.show_page_signal.connect(self.show_page)
             self.vbook_update.get_current_book_len_signal.connect(self.get_current_book_len)
@@ -463,7 +1105,7 @@ class VirtualBook(QMainWindow, GeneralBook):
         self.queue.put(self.showing_notification)     
 
     def get_current_book_len(self) -> None:
-        self.queue.put(len(self.right_page_list))
+        self.queue.put(len(self.right_page_list) + self.dropped_pages)
 
     def start_update(self) -> None:
         # self.vbook_update.start()
@@ -488,17 +1130,18 @@ class VirtualBook(QMainWindow, GeneralBook):
         self.set_left_page(self.left_page_list[NOTIFY_PAGE_NUM])
     
     def show_left_home_page(self) -> None:
-        self.set_left_page(self.left_page_list[HOME_PAGE_NUM])
+        if self.left_page_list[HOME_PAGE_NUM] is not None:
+            self.set_left_page(self.left_page_list[HOME_PAGE_NUM])
 
     def show_right_home_page(self) -> None:
         if len(self.right_page_list) != 0:
             self.set_right_page(self.right_page_list[HOME_PAGE_NUM])
 
-    def set_left_page(self, page_path: Path) -> None:
-        self.ui.left_page.setPixmap(QPixmap(str(page_path)))
+    def set_left_page(self, page: Frame) -> None:
+        self.ui.left_page.setPixmap(to_qpixmap(page))
 
-    def set_right_page(self, page_path: Path) -> None:
-        self.ui.right_page.setPixmap(QPixmap(str(page_path)))
+    def set_right_page(self, page: Frame) -> None:
+        self.ui.right_page.setPixmap(to_qpixmap(page))
 
     def update_left_page(self) -> None:
         self.set_left_page(self.left_page_list[HOME_PAGE_NUM])
@@ -1,25 +1,36 @@
 from collections import namedtuple
 from pathlib import Path
-from typing import NamedTuple
+from typing import NamedTuple, Optional, Tuple, Union
 
-from PIL import ImageFont
+from PIL import Image
 
 cwd = Path().resolve()
 saved_pages_path = cwd / 'media/pages'
 save_left_home_path = saved_pages_path / 'left_page_home.jpg'
 save_left_notify_path = saved_pages_path / 'left_page_notify.jpg'
 saved_right_pages_path = saved_pages_path / 'right_pages'
+native_frames_path = saved_pages_path / 'native'  # pages in the orientation of the display controller, by display profile
 saved_news_image_path = cwd / 'media/news'
+cache_path = cwd / 'media/cache'
+render_cache_path = cache_path / 'render'
+retention_ledger_path = cache_path / 'retention.json'
+render_client_state_path = cache_path / 'render_client.json'
+server_frames_path = cwd / 'media/server/frames'
+profile_path = cwd / 'media/profile'  # written by main.py --profile
+photo_watcher_state_path = cache_path / 'photo_watcher.json'
+photo_hash_index_path = cache_path / 'photo_hashes.bin'  # hashes of the photos shown recently, see photo_hash.py
+book_snapshot_path = cache_path / 'book_snapshot.json'  # what the book shows, for a warm restart, see warm_restart.py
+scraped_media_path = cwd / 'media/followings'  # download folder of the scraper, one folder per following
 
-if not saved_pages_path.exists():
-    saved_pages_path.mkdir()
 
-if not saved_right_pages_path.exists():
-    saved_right_pages_path.mkdir()
 
-if not saved_news_image_path.exists():
-    saved_news_image_path.mkdir()
-    
+def create_media_dirs() -> None:
+    """create the folders for the pages and media, called once at startup
+    """
+    for path in (saved_pages_path, saved_right_pages_path, saved_news_image_path, render_cache_path, native_frames_path):
+        path.mkdir(parents=True, exist_ok=True)
+
+
 log_file_path = cwd / 'debug.log'
 
 demo_pages_path = cwd / 'media/demo'
@@ -33,6 +44,15 @@ Photo = namedtuple('Photo', ['path', 'date', 'time'])
 Following = NamedTuple('Folloing', [('name', str), ('relationship', str)])
 Update = NamedTuple('Update', [('following', Following), ('path', Path)])
 News = NamedTuple('News', [('title', str), ('url', str)])
+# size of the frame buffer of the controller and the rotation from the portrait pages to it, as IT8951 rotate
+DisplayProfile = NamedTuple('DisplayProfile', [('name', str), ('size', Tuple[int, int]), ('rotate', Optional[str])])
+# an immutable snapshot of what the left page shows, the version increases whenever the content changes
+LeftPageState = NamedTuple('LeftPageState', [('version', int), ('time_str', str), ('date_str', str), ('robot_msg', str),
+                                             ('news1_content', Optional[str]), ('news1_photo_url', Optional[Path]),
+                                             ('news2_content', Optional[str]), ('news2_photo_url', Optional[Path])])
+Frame = Union[Path, Image.Image]  # a page can be a frame in memory or a path to a image
+RetentionBudget = NamedTuple('RetentionBudget', [('path', Path), ('pattern', str), ('max_bytes', int),
+                                                 ('max_age', float), ('exclude', Tuple[str, ...])])
 
 spi_pins = namedtuple('spi_pins', 'CS HRDY RESET')
 spi0 = spi_pins(RESET=23, CS=8, HRDY=24)
@@ -53,31 +73,112 @@ SHOW_NOTIFY_PAGE_SIGNAL = 3
 
 DAY_IN_SECONDS = 86400  # 60s*60min*24hour
 
+RETENTION_BUDGETS = [
+    # the pages are dropped from the book at the same age or past BOOK_MAX_PAGES, see GeneralBook.expire_pages
+    RetentionBudget(saved_right_pages_path, '*.jpg', 300 * 1024 * 1024, DAY_IN_SECONDS, ()),
+    RetentionBudget(native_frames_path, '*/*.png', 300 * 1024 * 1024, DAY_IN_SECONDS, ()),
+    RetentionBudget(saved_news_image_path, '*', 100 * 1024 * 1024, 3 * DAY_IN_SECONDS, ()),
+    RetentionBudget(scraped_media_path, '*/*.jpg', 1024 * 1024 * 1024, 7 * DAY_IN_SECONDS, ('profile_photo.jpg',)),
+]
+RETENTION_INTERVAL = 60 * 60
+BOOK_MAX_PAGES = 500  # the oldest pages are dropped from the book past this, about half the byte budget of the right pages
+RETENTION_BATCH_SIZE = 50
+RETENTION_BATCH_PAUSE = 0.5  # seconds between batches to keep the SD card responsive
+
+WATCH_SETTLE_SECONDS = 2  # a photo is complete when it is not written for this long
+WATCH_RESCAN_INTERVAL = 30  # only used when inotify is not available
+
 EINK_SCREEN_SIZE = (1404, 1872)
+# the 10.3 inch panels are landscape and mounted in portrait
+DISPLAY_PROFILE = DisplayProfile('it8951_1872x1404_ccw', (1872, 1404), 'CCW')
+PRE_ROTATE_FRAMES = True  # pages are rotated once when they are built instead of by the driver on every refresh
+NATIVE_IMAGE_CACHE_SIZE = 2  # native copies of the frames in memory, the home and notify left pages
+
+TWO_PHASE_FLIP = True  # show a fast black and white preview before the full refresh when turning a page
+FLIP_REFINE_DELAY = 0.3  # seconds to wait for another press before the full refresh
+NAV_COALESCE_DELAY = 0.15  # seconds without a press before the target page is shown
+NAV_REPEAT_WINDOW = 0.6  # a press of the same button within this many seconds is a repeated press
+NAV_JUMP_AFTER = 3  # repeated presses before each press jumps NAV_JUMP_PAGES pages
+NAV_JUMP_PAGES = 5
+BILEVEL_CACHE_MAX_PAGES = 100
+OVERVIEW_LONG_PRESS = 1.5  # seconds holding the left button to open the overview, or to jump to the selected page
+OVERVIEW_COLUMNS = 4
+OVERVIEW_ROWS = 4
+OVERVIEW_HEADER_HEIGHT = 120
+OVERVIEW_MARGIN = 20
+OVERVIEW_THUMBNAIL_SIZE = (240, 320)  # fits a cell of the grid with the page number below
+OVERVIEW_FONT_SIZE = 40
+OVERVIEW_CURSOR_WIDTH = 10
+THUMBNAIL_CACHE_MAX_PAGES = 200
+WARM_RESTART = True  # resume on the page and notification of the last run, without refreshing the panels that still show it
+WARM_RESTART_SNAPSHOT_INTERVAL = 5  # seconds between the checks of the book state, it is only written when it changed
+
+MEMORY_BUDGET_BYTES = 256 * 1024 * 1024  # shared by all the image caches and buffers
+MEMORY_SNAPSHOT_INTERVAL = 15 * 60  # seconds between the memory logs
+MEMORY_TRACEMALLOC_FRAMES = 5
+PROFILE_SAMPLE_INTERVAL = 0.005  # seconds between the stack samples of main.py --profile
+PROFILE_TOP = 40  # functions in the text summary of each thread
+
+RIGHT_PAGE_ONE_UPDATE_TEMPLATE = 'home_R_base_1.html'
+RIGHT_PAGE_TWO_UPDATES_TEMPLATE = 'home_R_base_2.html'
+RENDER_CACHE_MAX_BYTES = 200 * 1024 * 1024  # rendered pages kept for reuse
+RENDER_CACHE_MAX_FILE_HASHES = 2000  # hashes of the photos in the render cache keys, by path, size and mtime
+
+RENDER_SERVER_HOST = '0.0.0.0'
+RENDER_SERVER_PORT = 8951
+RENDER_SERVER_MAX_PAGES = BOOK_MAX_PAGES  # the oldest pages are dropped from the manifest past this, or at a day old
+SERVER_RETENTION_BUDGETS = RETENTION_BUDGETS + [
+    # the frames of the pages are protected while they are in the manifest, see FrameManifest.prune
+    RetentionBudget(server_frames_path, '*.jpg', 300 * 1024 * 1024, DAY_IN_SECONDS, ()),
+]
+NETWORK_TIMEOUT = 10  # seconds before a call to the network is given up
+NETWORK_FAILURES_TO_OPEN = 3  # failures in a row before an endpoint is not called for a while
+NETWORK_BACKOFF_BASE = 30  # seconds an endpoint is not called after it fails, doubled every time it fails again
+NETWORK_BACKOFF_MAX = 60 * 60
+NETWORK_WORKERS = 4
+SCRAPE_TIMEOUT = 30 * 60  # seconds a scrape may take in the scrape process before it is killed
+SCRAPE_WAIT_TIMEOUT = 60  # seconds the loop waits for a scrape run in a thread of this process, see network.scrape_followings
+SCRAPE_HEARTBEAT_INTERVAL = 10  # seconds between the progress events of the scrape process
+SCRAPE_HEARTBEAT_TIMEOUT = 5 * 60  # seconds without a progress event before the scrape process is killed
+FRAME_HANDOFF_SLOTS = 6  # shared memory frames between the render process and the display process
+
+RIGHT_PAGE_PHOTO_MAX_SIZE = (1404, 1404)  # largest photo slot in the right page templates
+PROFILE_PHOTO_MAX_SIZE = (200, 200)
+INGEST_WORKERS = 2
+DEDUP_PHOTOS = True  # skip the updates with a photo like one shown within DEDUP_WINDOW, e.g. a repost
+DEDUP_WINDOW = 7 * DAY_IN_SECONDS
+DEDUP_MAX_DISTANCE = 5  # bits of the 128 bit hashes that may differ, at most 7
+DEDUP_HASH_SIZE = 8
+DEDUP_COMPACT_AFTER = 10000  # hashes before the index file is rewritten without the old ones
+INGEST_KEEP_ORIGINALS = False
+INGEST_ORIGINALS_FOLDER = 'originals'
 
 NEW_PHOTO_ROBOT_MSG = 'New Photo! Press ‘Right’ button to update.'
 
 API_KEY = '<YOUR_API_KEY>'
 
 LEFT_HOME_BASE_IMAGE = 'media/templates/left_page_base.jpg'
+FONT_FILE = 'arial.ttf'  # fonts are loaded when first drawn, see content.get_font
+PERSIST_LEFT_PAGES = True  # save the left pages in the background for restoring after restart
+LEFT_PAGE_CACHE_SIZE = 4  # composed left pages kept by their state, e.g. the home and notify pages of this minute
 BIG_TIME_RECT = (80,100,448,277)
 BIG_TIME_START_CORNER = (80, 100)
 FILL_WHITE = (255,255,255)
-BIG_TIME_FONT = ImageFont.truetype("arial.ttf", 200)
+BIG_TIME_FONT_SIZE = 200
 
 DATE_RECT = (80, 313, 821, 391)
 DATE_START_CORNER = (80,350)
-DATE_FONT = ImageFont.truetype("arial.ttf", 60)
+DATE_FONT_SIZE = 60
 
 ACTIVITY_1_RECT = (208, 470, 990, 540)
 ACTIVITY_1_CORNER = (208, 470)
 ACTIVITY_2_RECT = (208, 584, 671, 651)
 ACTIVITY_2_CORNER = (208, 584)
-ACTIVITY_FONT = ImageFont.truetype("arial.ttf", 50)
+ACTIVITY_FONT_SIZE = 50
 
 REMINDER_RECT = (139, 842, 782, 933)
 REMINDER_CORNER = (139, 842)
-REMINDER_FONT = ACTIVITY_FONT
+REMINDER_FONT_SIZE = ACTIVITY_FONT_SIZE
 
 NEWS_1_IMAGE_RECT = (84, 1208, 624, 1511)
 NEWS_1_IMAGE_CORNER = (84, 1208)
@@ -85,5 +186,7 @@ NEWS_1_TEXT_RECT = (103, 1535, 593, 1784)
 NEWS_2_IMAGE_RECT = (728, 1208, 1262, 1511)
 NEWS_2_IMAGE_CORNER = (728, 1208)
 NEWS_2_TEXT_RECT = (738, 1534, 1241, 1784)
-NEWS_FONT = ImageFont.truetype("arial.ttf", 40)
-NEWS_IMAGE_SIZE = (534, 303)
\ No newline at end of file
+NEWS_FONT_SIZE = 40
+NEWS_IMAGE_SIZE = (534, 303)
+NEWS_REFRESH_INTERVAL = 30 * 60  # seconds between fetching the headlines in the background
+HEADLINE_RING_SIZE = 20  # headlines with their photos ready for the left page
@@ -1,34 +1,128 @@
 # Handle the content of eink
 import json
 import random
-import urllib.request
+from collections import OrderedDict, deque
 from datetime import datetime
+from functools import lru_cache
 from logging import getLogger
 from pathlib import Path
-from time import time
-from typing import Dict, List, Optional, Tuple
-
-import requests
-from html2image import Html2Image
-from jinja2 import Environment, FileSystemLoader
-from newsapi import NewsApiClient
-from PIL import Image, ImageDraw
-
+from threading import Lock, Thread
+from time import sleep, time
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from PIL import Image, ImageDraw, ImageFont
+
+import following_index
+import ingest
+import memory
+import metrics
+import network
+import photo_hash
 from constants import *
+from frame_store import frame_writer
+from memory import load_image
+from native_frames import prepare_native_frame
+from render_cache import RenderCache
+from retention import age_ledger
 
 logger = getLogger(__name__)
-file_loader = FileSystemLoader('media/templates')
-env = Environment(loader=file_loader)
 
 reminder_robot_msg = 'Hello! Have you taken your medicine?'
-left_page_data = {}  # TODO move left page data to class attribute
+_left_page_state = LeftPageState(0, '', '', '', None, None, None, None)
+_left_page_lock = Lock()
+_left_page_frames: 'OrderedDict[LeftPageState, Image.Image]' = OrderedDict()
+_saved_left_pages: Dict[Path, LeftPageState] = {}
+render_cache = RenderCache()
+
+@lru_cache(maxsize=1)
+def get_template_env():
+    """create the jinja environment the first time a template is needed, jinja is slow to import
+    """
+    from jinja2 import Environment, FileSystemLoader
+    return Environment(loader=FileSystemLoader('media/templates'))
+
+
+@lru_cache(maxsize=None)
+def get_font(size: int) -> ImageFont.FreeTypeFont:
+    """load the font of the given size the first time it is drawn
+
+    Args:
+        size (int): font size
+
+    Returns:
+        ImageFont.FreeTypeFont: the loaded font
+    """
+    return ImageFont.truetype(FONT_FILE, size)
 
-class NewsClient(NewsApiClient):
+
+class NewsClient:
     def __init__(self) -> None:
-        super().__init__(api_key=API_KEY)
+        # newsapi is imported here as it is slow to import and only needed after the first frame
+        from newsapi import NewsApiClient
+        self.api = NewsApiClient(api_key=API_KEY)
         self.top_headlines = self.fetch_top_headlines_title()
         self.remove_invalid_news()
-        logger.debug(f'{len(top_headlines["articles"])}')
+        logger.debug(f'{len(self.top_headlines)}')
+        self.start_ring()
+
+    def start_ring(self) -> None:
+        """fill the ring of ready headlines, then refresh it every NEWS_REFRESH_INTERVAL in the background
+        """
+        self._ring: Deque[Tuple[News, Path]] = deque()
+        self._ring_lock = Lock()
+        self.fill_ring()
+        Thread(target=self._refresh_ring, name='news_ring', daemon=True).start()
+
+    def _refresh_ring(self) -> None:
+        while True:
+            sleep(NEWS_REFRESH_INTERVAL)
+            try:
+                self.top_headlines = self.fetch_top_headlines_title()
+                self.remove_invalid_news()
+                self.fill_ring()
+            except Exception as e:
+                # keep showing the headlines of the ring
+                logger.error(f'cannot refresh the news: {e}')
+
+    def fill_ring(self) -> None:
+        """download and check the photos of the headlines, the ring is replaced by the headlines that are ready
+        """
+        ready = []
+        titles = set()
+        for headline in self.top_headlines:
+            if headline.title in titles:
+                continue
+            photo_path = retrieve_image_from_news(headline.url)
+            if photo_path is None or not is_valid_image(photo_path):
+                continue
+            titles.add(headline.title)
+            ready.append((headline, photo_path))
+            if len(ready) == HEADLINE_RING_SIZE:
+                break
+        with self._ring_lock:
+            self._ring = deque(ready)
+        metrics.set_gauge('news.ready_headlines', len(ready))
+        logger.info(f'{len(ready)} of {len(self.top_headlines)} headlines are ready')
+
+    def pop_headlines(self, num: int = 2) -> List[Tuple[News, Path]]:
+        """get the next headlines of the ring with their downloaded photos, no network is used
+
+        Args:
+            num (int, optional): number of headlines. Defaults to 2.
+
+        Returns:
+            List[Tuple[News, Path]]: different headlines with their photos, fewer if not enough are ready
+        """
+        headlines = []
+        with self._ring_lock:
+            for _ in range(min(num, len(self._ring))):
+                # rotate, the popped headlines come back after the others
+                headline = self._ring.popleft()
+                self._ring.append(headline)
+                headlines.append(headline)
+        # a photo removed by the retention is downloaded again at the next refresh
+        return [(headline, photo_path) for headline, photo_path in headlines if photo_path.exists()]
 
     def remove_invalid_news(self):
         """Some news urls doesn't contain .jpg .jpeg or None, which cannot fetch the image 
@@ -42,12 +136,6 @@ class NewsClient(NewsApiClient):
                     clean_top_headlines.append(headline)
         self.top_headlines = clean_top_headlines
     
-    def remove_invalid_news_by_title(self, title):
-        for headline in self.top_headlines:
-            if headline.title == title:
-                self.top_headlines.remove(headline)
-                
-                
     def get_random_headlines(self, num:int =2) -> List[News]:
         """get random headlines from the top_headlines fetched
 
@@ -64,9 +152,11 @@ class NewsClient(NewsApiClient):
             
 
     def fetch_top_headlines_title(self) -> List[News]:
-        top_headlines = self.get_top_headlines(category='general',
-                                            language='en',  # zh
-                                            country='us')  # hk
+        # the last headlines are kept while the news api is unreachable
+        top_headlines = network.call('newsapi', self.api.get_top_headlines, category='general',
+                                     language='en',  # zh
+                                     country='us',  # hk
+                                     use_last_result=True)
         return [News(top_headline['title'], top_headline['urlToImage']) for top_headline in top_headlines['articles']]
                                         
 
@@ -86,16 +176,7 @@ def get_profile_photo_from_path(following_path: Path) -> Optional[Path]:
     Returns:
         Optional[Path]: the path of the profile photo, which can be None if there is no profile photo
     """    
-    profile_path = following_path / 'profile_photo.jpg'
-    if profile_path.exists():
-        return profile_path
-    else:
-        for path in following_path.glob('*.jpg'):
-            if is_profile_photo(path):
-                return path.rename(profile_path)
-        else:
-            # if no profile photo
-            return None
+    return following_index.get_following_index(following_path).get_profile_photo()
                 
 
 def is_profile_photo(image_path: Path) -> bool:
@@ -190,18 +271,18 @@ def list_file_within_24_hour() -> List[Path]:
     Returns:
         List[Path]: a list of paths that is sorted and within 24 hour
     """   
-    # todo fix the problem that modify date can repeatedly renew after changing name 
-    pages = get_all_saved_right_pages()
-    for page in pages:
-        if not is_create_within_24_hour(page):
-            page.unlink(missing_ok=True) 
-            pages.remove(page)
+    pages = []
+    for page in get_all_saved_right_pages():
+        if is_create_within_24_hour(page):
+            pages.append(page)
+        else:
+            page.unlink(missing_ok=True)
 
-    return sort_with_last_modify_time(pages)
+    return sort_with_first_seen_time(pages)
 
 
-def sort_with_last_modify_time(files_list: List[Path]) -> List[Path]:
-    """sort the list of files by increasing last modification time
+def sort_with_first_seen_time(files_list: List[Path]) -> List[Path]:
+    """sort the list of files by increasing time they were first seen, which is kept after renaming
 
     Args:
         files_list (List[Path]): unsorted list of the pages paths
@@ -209,7 +290,7 @@ def sort_with_last_modify_time(files_list: List[Path]) -> List[Path]:
     Returns:
         List[Path]: sorted list of the pages paths
     """    
-    return sorted(files_list, key=lambda file: file.stat().st_mtime)
+    return sorted(files_list, key=age_ledger.first_seen)
 
 
 def is_create_within_24_hour(file_path: Path) -> bool:
@@ -219,9 +300,9 @@ def is_create_within_24_hour(file_path: Path) -> bool:
         file_path (Path): a path of the page image
 
     Returns:
-        bool: True if the last modification time is within 24 hour
+        bool: True if the page was first seen within 24 hour
     """    
-    return time() - file_path.stat().st_mtime < DAY_IN_SECONDS
+    return age_ledger.age(file_path) < DAY_IN_SECONDS
 
 
 def get_all_saved_right_pages() -> List[Path]:
@@ -239,28 +320,29 @@ def get_updated_datetime() -> Dict:
     Returns:
         Dict: a dict containing the current time and date
     """    
+    now = datetime.fromtimestamp(time())
     return {
-        'time_str': datetime.now().strftime('%H:%M'),
-        'date_str': datetime.now().strftime('%A %d %B %Y')
+        'time_str': now.strftime('%H:%M'),
+        'date_str': now.strftime('%A %d %B %Y')
     }
 
 
-def create_page_left_notify() -> Path:
+def create_page_left_notify() -> Image.Image:
     """create a page for the left screen for notifying there are updates
 
     Returns:
-        Path: a jpg path of this page
+        Image.Image: the frame of this page
     """
     return create_jpg_left_notify()    
 
-def create_page_left_home(news_client) -> Path:
+def create_page_left_home(news_client) -> Image.Image:
     """create a page for the left screen with the given news
 
     Args:
         news: a newsclient
 
     Returns:
-        Path: a jpg path of this page
+        Image.Image: the frame of this page
     """
     return create_jpg_left_home(news_client)    
 
@@ -270,8 +352,8 @@ def create_html_left_notify() -> str:
     Returns:
         str: a html raw string 
     """    
-    left_page_data_notify_update()
-    return env.get_template("home_L_base_chi.html").render(**left_page_data)
+    state = left_page_data_notify_update()
+    return get_template_env().get_template("home_L_base_chi.html").render(**state._asdict())
 
 
 def create_html_left_home(news: List[News]) -> str:
@@ -283,46 +365,83 @@ def create_html_left_home(news: List[News]) -> str:
     Returns:
         str: a html raw string
     """    
-    init_left_page_data(news)
-    return env.get_template("home_L_base_chi.html").render(**left_page_data)
+    state = init_left_page_data(news)
+    return get_template_env().get_template("home_L_base_chi.html").render(**state._asdict())
+
+
+def get_left_page_state() -> LeftPageState:
+    """get the current snapshot of the left page, it never changes after it is returned
+
+    Returns:
+        LeftPageState: the content of the left page
+    """
+    return _left_page_state
+
+
+def update_left_page_state(**changes) -> LeftPageState:
+    """replace some fields of the left page state, the version only increases when the content changes
+
+    Returns:
+        LeftPageState: the new snapshot
+    """
+    global _left_page_state
+    with _left_page_lock:
+        state = _left_page_state._replace(**changes)
+        if state != _left_page_state:
+            _left_page_state = state._replace(version=state.version + 1)
+        return _left_page_state
 
 
-def init_left_page_data(news_client) -> None:
-    """Initialize the global variable of the left page, e.g. News, robot's message, time
+def init_left_page_data(news_client) -> LeftPageState:
+    """Initialize the state of the left page, e.g. News, robot's message, time
 
     Args:
         news: a news client
 
     Raises:
         ValueError: no news is feteched from the API, need to check the account
+
+    Returns:
+        LeftPageState: the new snapshot
     """    
     if news_client is None:
         logger.error('news are not provided')
         raise ValueError
 
-    left_page_data_time_update()
-    left_page_data_news_update(news_client)
-    left_page_data_msg_update()
-    logger.debug(f'left_page_data: {left_page_data}')
+    # the news are fetched before the state is changed, so the page never shows half of the update
+    state = update_left_page_state(**get_updated_datetime(), **get_news_data(news_client), robot_msg=reminder_robot_msg)
+    logger.debug(f'left page state: {state}')
+    return state
 
 
-def left_page_data_msg_update() -> None:
+def left_page_data_msg_update() -> LeftPageState:
     """Unfinished function, which intended to generate some messages for the elderly for companion
     """    
-    left_page_data.update({'robot_msg': reminder_robot_msg})
+    return update_left_page_state(robot_msg=reminder_robot_msg)
 
 
-def left_page_data_notify_update() -> None:
+def left_page_data_notify_update() -> LeftPageState:
     """Update the robot's message to notify there are updates
     """    
-    left_page_data.update({'robot_msg': NEW_PHOTO_ROBOT_MSG})
-    logger.debug(left_page_data)
+    state = update_left_page_state(robot_msg=NEW_PHOTO_ROBOT_MSG)
+    logger.debug(state)
+    return state
+
+
+def get_left_page_files() -> List[Path]:
+    """get the files used by the left page, e.g. the photos of the news
+
+    Returns:
+        List[Path]: the files that the left page needs
+    """
+    state = get_left_page_state()
+    return [path for path in (state.news1_photo_url, state.news2_photo_url) if path is not None]
 
 
-def left_page_data_time_update() -> None:
-    """Update the global dict with the current time
+def left_page_data_time_update() -> LeftPageState:
+    """Update the state with the current time
     """    
-    left_page_data.update(get_updated_datetime())
+    return update_left_page_state(**get_updated_datetime())
 
 def retrieve_image_from_news(url: str) -> Path:
     filename = Path(url).name
@@ -332,6 +451,7 @@ def retrieve_image_from_news(url: str) -> Path:
         sub_str = '.jpeg'
     else:
         logger.error('invalid filename')
+        return None
         
     new_filename = filename[:filename.index(sub_str) + len(sub_str)]
     saved_path = saved_news_image_path / new_filename
@@ -340,69 +460,59 @@ def retrieve_image_from_news(url: str) -> Path:
         # downloaded before
         return saved_path
     try:
-        urllib.request.urlretrieve(url, saved_path)
-        
+        # a breaker per host, one site that is down does not stop the photos of the others
+        network.call(f'news_image:{urlparse(url).netloc}', network.download_file, url, saved_path, timeout=None)
     except Exception as e:
         logger.error(e)
         return None
     
     return saved_path
         
-def left_page_data_news_update(news_client: NewsClient) -> None:
-    """Given the list of the news, update the global dict with the news title and photos 
+def left_page_data_news_update(news_client: NewsClient) -> LeftPageState:
+    """Given the list of the news, update the state with the news title and photos 
 
     Args:
-        news (List[News]): [description]
+        news_client (NewsClient): a news client
     """
-    valid_news = []
-    valid_news_photo_path = []
-    while len(valid_news) != 2:
-        news = news_client.get_random_headlines(num=1)
-        # loop until we have 2 valid news
-        news_photo_path = retrieve_image_from_news(news[0].url)
-        if news_photo_path is not None:
-            if len(valid_news) == 1:
-                if news[0].title != valid_news[0].title:
-                    # check repeat news
-                    valid_news.append(news[0])
-                    valid_news_photo_path.append(news_photo_path)
-                    
-                elif len(news_client.top_headlines) == 1:
-                    # has one valid headline only and the loop 
-                    break
-            else:
-                # the valid news list is empty 
-                valid_news.append(news[0])
-                valid_news_photo_path.append(news_photo_path)
-        
-        else:
-            # remove from the headlines
-            news_client.remove_invalid_news_by_title(title=news[0].title)
-            
-            if len(news_client.top_headlines) == 0:
-                # no valid headline
-                break
-            
-    if len(valid_news_photo_path) == 2:
-        temp = {'news1_content': valid_news[0].title,
-                    'news1_photo_url': valid_news_photo_path[0],
-                    'news2_content': valid_news[1].title,
-                    'news2_photo_url': valid_news_photo_path[1],      
-            }
-    elif len(valid_news_photo_path) == 1:
-         temp = {'news1_content': valid_news[0].title,
-                    'news1_photo_url': valid_news_photo_path[0],
-                    'news2_content': None,
-                    'news2_photo_url': None,      
-            }
-    else:
-        temp = {'news1_content': None,
-                    'news1_photo_url': None,
-                    'news2_content': None,
-                    'news2_photo_url': None,      
-            }
+    return update_left_page_state(**get_news_data(news_client))
+
+
+def is_valid_image(image_path: Path) -> bool:
+    """check that a downloaded photo can be decoded, a broken photo is removed
+
+    Args:
+        image_path (Path): path of the photo
+
+    Returns:
+        bool: the photo is valid
+    """
+    try:
+        with Image.open(image_path) as img:
+            img.verify()
+        return True
+    except Exception as e:
+        logger.error(f'invalid photo {image_path}: {e}')
+        image_path.unlink(missing_ok=True)
+        return False
+
+
+def get_news_data(news_client: NewsClient) -> Dict:
+    """take the next two headlines of the news client, their photos are downloaded already
+
+    Args:
+        news_client (NewsClient): a news client
+
+    Returns:
+        Dict: the news title and photos of the left page
+    """
+    data = {'news1_content': None, 'news1_photo_url': None, 'news2_content': None, 'news2_photo_url': None}
+    headlines = news_client.pop_headlines(num=2)
+    for i, (headline, photo_path) in enumerate(headlines, start=1):
+        data[f'news{i}_content'] = headline.title
+        data[f'news{i}_photo_url'] = photo_path
+    if len(headlines) == 0:
         logger.debug('no valid news')
-    left_page_data.update(temp)
+    return data
 
 def create_pages(updates: List[Update], exist_num_pages: int) -> List[Path]:
     """create a number of pages with the updates for the right screen
@@ -414,47 +524,135 @@ def create_pages(updates: List[Update], exist_num_pages: int) -> List[Path]:
     Returns:
         List[Path]: a list of path that contain the new created pages
     """    
+    return list(iter_pages(updates, exist_num_pages))
+
+
+def iter_pages(updates: List[Update], exist_num_pages: int) -> Iterator[Path]:
+    """create the pages with the updates for the right screen, each page is given as soon as it is created.
+       Pages rendered before with the same inputs are taken from the render cache,
+       identical pages within the batch are only added once and photos shown recently are skipped
+
+    Args:
+        updates (List[Update]): a list of updates that contain the essential information to create a page
+        exist_num_pages (int): the current length of the right pages
+
+    Yields:
+        Iterator[Path]: the path of each new created page
+    """
+    photo_hashes: List[Optional[int]] = []
+    if DEDUP_PHOTOS:
+        # reposts are dropped before anything is ingested or rendered for them
+        updates, photo_hashes = photo_hash.remove_duplicates(updates)
     num_update = len(updates)
-    new_pages = []
     new_page_count = 0
+    batch_keys = set()
+
+    following_index.add_updates(updates)
+    profile_paths = [get_profile_photo_from_path(update.path.parents[0]) for update in updates]
+    # photos of the first page are downscaled alone, so the first page does not wait for the whole batch
+    ingest.ingest_updates(updates[:2], profile_paths[:2], workers=1)
 
     for i in range(0, num_update, 2):
-        file_name = f'right_page_{exist_num_pages + new_page_count + 1}.jpg'
+        if i == 2:
+            ingest.ingest_updates(updates[2:], profile_paths[2:])
+
         if i + 1 != num_update:
             # check if there is more then one update remain
-            page_jpg_path = html_to_jpg(create_html_two_updates(updates[i], updates[i+1]), file_name, saved_right_pages_path)
-
+            template = RIGHT_PAGE_TWO_UPDATES_TEMPLATE
+            data = create_data_two_updates(updates[i], updates[i+1])
         else:
             # if only one update left
-            page_jpg_path = html_to_jpg(create_html_one_update(updates[i]), file_name, saved_right_pages_path)
+            template = RIGHT_PAGE_ONE_UPDATE_TEMPLATE
+            data = create_data_one_update(updates[i])
+
+        key = render_cache.make_key(template, data)
+        if key in batch_keys:
+            logger.info('skip a repeated page in the same batch')
+            photo_hash.mark_shown(photo_hashes[i:i + 2])
+            continue
+        batch_keys.add(key)
+
+        file_name = f'right_page_{exist_num_pages + new_page_count + 1}.jpg'
+        page_jpg_path = render_cache.get(key, saved_right_pages_path / file_name)
+        if page_jpg_path is None:
+            page_jpg_path = html_to_jpg(render_html(template, data), file_name, saved_right_pages_path)
+            render_cache.put(key, page_jpg_path)
+        if PRE_ROTATE_FRAMES:
+            # rotate once here instead of on every refresh
+            prepare_native_frame(page_jpg_path)
 
-        new_pages.append(page_jpg_path)
         new_page_count += 1
-    return new_pages
+        yield page_jpg_path
+        # the page is taken by the book, its photos count as shown
+        photo_hash.mark_shown(photo_hashes[i:i + 2])
 
+    logger.info(f'render cache hit rate: {render_cache.hit_rate():.0%}')
 
-def create_html_two_updates(update_1: Update, update_2: Update) -> str:
-    """create a html raw string with two updates on the same page
+
+def render_html(template: str, data: Dict) -> str:
+    """render the data with a template, paths are given to the template as file uri
+
+    Args:
+        template (str): name of the jinja template
+        data (Dict): data of the page
+
+    Returns:
+        str: a html raw string
+    """
+    data = {name: value.as_uri() if isinstance(value, Path) else value for name, value in data.items()}
+    return get_template_env().get_template(template).render(**data)
+
+
+def create_data_two_updates(update_1: Update, update_2: Update) -> Dict:
+    """create the data of a page with two updates
 
     Args:
         update_1 (Update): first update 
         update_2 (Update): second update
 
     Returns:
-        str: a html raw string
-    """    
-    data = {
+        Dict: data for the two updates template
+    """
+    return {
         'relationship_1': update_1.following.relationship,
-        'image_1_path': update_1.path.as_uri(),
+        'image_1_path': update_1.path,
         'caption_1': load_caption(image_path=update_1.path),
         'profile_1': get_profile_photo_from_path(update_1.path.parents[0]), 
         'relationship_2': update_2.following.relationship,
-        'image_2_path': update_2.path.as_uri(),
+        'image_2_path': update_2.path,
         'caption_2': load_caption(image_path=update_2.path),
         'profile_2': get_profile_photo_from_path(update_2.path.parents[0]), 
     }
-    rendered = env.get_template("home_R_base_2.html").render(**data)
-    return rendered
+
+
+def create_data_one_update(update: Update) -> Dict:
+    """create the data of a page with only one update
+
+    Args:
+        update (Update): the single update left
+
+    Returns:
+        Dict: data for the one update template
+    """
+    return {
+        'relationship_1': update.following.relationship,
+        'image_1_path': update.path,
+        'caption_1': str(update.path),
+        'profile_1': get_profile_photo_from_path(update.path.parents[0]), 
+    }
+
+
+def create_html_two_updates(update_1: Update, update_2: Update) -> str:
+    """create a html raw string with two updates on the same page
+
+    Args:
+        update_1 (Update): first update 
+        update_2 (Update): second update
+
+    Returns:
+        str: a html raw string
+    """    
+    return render_html(RIGHT_PAGE_TWO_UPDATES_TEMPLATE, create_data_two_updates(update_1, update_2))
 
 
 def create_html_one_update(update: Update) -> str:
@@ -466,15 +664,7 @@ def create_html_one_update(update: Update) -> str:
     Returns:
         str: a html raw string
     """    
-    data = {
-        'relationship_1': update.following.relationship,
-        'image_1_path': update.path.as_uri(),
-        'caption_1': update.path,
-        'profile_1': get_profile_photo_from_path(update.path.parents[0]), 
-    }
-    # logger.debug(data)
-    rendered = env.get_template("home_R_base_1.html").render(**data)
-    return rendered
+    return render_html(RIGHT_PAGE_ONE_UPDATE_TEMPLATE, create_data_one_update(update))
 
 
 def html_to_jpg(html_str: str, file_name: str, output_path: Path) -> Path:
@@ -493,6 +683,7 @@ def html_to_jpg(html_str: str, file_name: str, output_path: Path) -> Path:
 
     file_path = output_path / file_name
     logger.debug(f'Making file_path:{file_path}')
+    from html2image import Html2Image
     temp = Html2Image(output_path=str(output_path))
     temp.screenshot(html_str=html_str, size=EINK_SCREEN_SIZE, save_as=file_name)
     return file_path
@@ -505,16 +696,18 @@ def jpg_to_bmp(jpg_path: Path) -> Path:
         raise FileNotFoundError('No such jpg')
     logger.debug('Converting to bmp file')
     # mode L: 8-bit pixels bw
-    img = Image.open(jpg_path)
     img_bmp_path = jpg_path.with_suffix('.bmp')
-    img_bmp = img.convert('L')
+    with Image.open(jpg_path) as img:
+        img_bmp = img.convert('L')
     img_bmp.save(img_bmp_path)
     return img_bmp_path
 
-def get_text_size(font: ImageFont.truetype, text):
-    return font.getsize(text)
+def get_text_size(font: ImageFont.FreeTypeFont, text):
+    # the same size as font.getsize, which is removed in Pillow 10
+    _, _, width, height = font.getbbox(text)
+    return width, height
 
-def write_text_box(draw: ImageDraw, x,y, text, box_width, font: ImageFont.truetype, color=(0,0,0)):
+def write_text_box(draw: ImageDraw, x,y, text, box_width, font: ImageFont.FreeTypeFont, color=(0,0,0)):
     lines = []
     line = []
     words = text.split()
@@ -539,35 +732,111 @@ def write_text_box(draw: ImageDraw, x,y, text, box_width, font: ImageFont.truety
         
 def get_news_image(image_path) -> Image:
     # TODO handle exception if no this file
-    return Image.open(image_path).resize(NEWS_IMAGE_SIZE)
+    with Image.open(image_path) as img:
+        return img.resize(NEWS_IMAGE_SIZE)
 
-def add_info_left_home(image):
+def add_info_left_home(image, state: LeftPageState):
     draw = ImageDraw.Draw(image)
-    draw.text(BIG_TIME_START_CORNER, left_page_data['time_str'], align='left', fill='black', font=BIG_TIME_FONT)
-    draw.text(DATE_START_CORNER, left_page_data['date_str'], align='left', fill='black', font=DATE_FONT)
-    draw.text(ACTIVITY_1_CORNER, '14:00 Elderly center singing activity', align='left', fill='black', font=ACTIVITY_FONT)
-    draw.text(ACTIVITY_2_CORNER, '15:30 Take pills', align='left', fill='black', font=ACTIVITY_FONT)
-    draw.text(REMINDER_CORNER, left_page_data['robot_msg'], align='center', fill='black', font=REMINDER_FONT)
-    if left_page_data['news1_photo_url'] is not None:
-        image.paste(get_news_image(left_page_data['news1_photo_url']), NEWS_1_IMAGE_CORNER)
-        write_text_box(draw, x=105, y=1544, text=left_page_data['news1_content'], box_width=478, font=NEWS_FONT)
+    draw.text(BIG_TIME_START_CORNER, state.time_str, align='left', fill='black', font=get_font(BIG_TIME_FONT_SIZE))
+    draw.text(DATE_START_CORNER, state.date_str, align='left', fill='black', font=get_font(DATE_FONT_SIZE))
+    draw.text(ACTIVITY_1_CORNER, '14:00 Elderly center singing activity', align='left', fill='black', font=get_font(ACTIVITY_FONT_SIZE))
+    draw.text(ACTIVITY_2_CORNER, '15:30 Take pills', align='left', fill='black', font=get_font(ACTIVITY_FONT_SIZE))
+    draw.text(REMINDER_CORNER, state.robot_msg, align='center', fill='black', font=get_font(REMINDER_FONT_SIZE))
+    if state.news1_photo_url is not None:
+        image.paste(get_news_image(state.news1_photo_url), NEWS_1_IMAGE_CORNER)
+        write_text_box(draw, x=105, y=1544, text=state.news1_content, box_width=478, font=get_font(NEWS_FONT_SIZE))
         
-    if left_page_data['news2_photo_url'] is not None:
-        image.paste(get_news_image(left_page_data['news2_photo_url']), NEWS_2_IMAGE_CORNER)
-        write_text_box(draw, x=747, y=1544,  text=left_page_data['news2_content'], box_width=478, font=NEWS_FONT)
+    if state.news2_photo_url is not None:
+        image.paste(get_news_image(state.news2_photo_url), NEWS_2_IMAGE_CORNER)
+        write_text_box(draw, x=747, y=1544,  text=state.news2_content, box_width=478, font=get_font(NEWS_FONT_SIZE))
     
-def create_jpg_left_home(news_client) -> Path:
-    init_left_page_data(news_client)
-    base_image = Image.open(LEFT_HOME_BASE_IMAGE)
-    add_info_left_home(base_image)
-    base_image.save(save_left_home_path)  
+@lru_cache(maxsize=1)
+def get_left_base_image() -> Image.Image:
+    """decode the base image of the left page once, every page is drawn on a copy of it
 
-    return save_left_home_path
+    Returns:
+        Image.Image: the base image of the left page
+    """
+    base_image = load_image(LEFT_HOME_BASE_IMAGE)
+    memory.budget.register('left_base_image')
+    memory.budget.charge('left_base_image', memory.image_bytes(base_image))
+    return base_image
 
-def create_jpg_left_notify() -> Path:
-    base_image = Image.open(LEFT_HOME_BASE_IMAGE)
-    add_info_left_home(base_image)
-    base_image.save(save_left_home_path)  
 
-    return save_left_home_path
-    
+def compose_left_page(state: LeftPageState, save_path: Path) -> Image.Image:
+    """draw the state on the base image, the frame is kept in memory
+       and a copy is saved in the background when PERSIST_LEFT_PAGES is set.
+       The frames are memoized by the content of the state, the same content returns the same frame,
+       which should not be changed
+
+    Args:
+        state (LeftPageState): the content of the left page
+        save_path (Path): where the frame is saved for restoring after restart
+
+    Returns:
+        Image.Image: the composed frame
+    """
+    key = state._replace(version=0)
+    with _left_page_lock:
+        image = _left_page_frames.get(key)
+        if image is not None:
+            _left_page_frames.move_to_end(key)
+    if image is not None:
+        metrics.inc('left_page.hits')
+    else:
+        metrics.inc('left_page.misses')
+        image = get_left_base_image().copy()
+        add_info_left_home(image, state)
+        memory.budget.register('left_page_frames', evict_left_page_frame)
+        with _left_page_lock:
+            _left_page_frames[key] = image
+            while len(_left_page_frames) > LEFT_PAGE_CACHE_SIZE:
+                _, evicted = _left_page_frames.popitem(last=False)
+                memory.budget.release('left_page_frames', memory.image_bytes(evicted))
+        memory.budget.charge('left_page_frames', memory.image_bytes(image))
+
+    with _left_page_lock:
+        is_saved = _saved_left_pages.get(save_path) == key
+        _saved_left_pages[save_path] = key
+    if PERSIST_LEFT_PAGES and not is_saved:
+        frame_writer.save(image, save_path)
+    return image
+
+
+def evict_left_page_frame() -> int:
+    """drop the least recently used left page, for the memory budget
+
+    Returns:
+        int: the bytes freed
+    """
+    with _left_page_lock:
+        if len(_left_page_frames) == 0:
+            return 0
+        _, image = _left_page_frames.popitem(last=False)
+    num_bytes = memory.image_bytes(image)
+    memory.budget.release('left_page_frames', num_bytes)
+    return num_bytes
+
+
+def persisted_path_of(image: Image.Image) -> Optional[Path]:
+    """find where a composed left page is saved, e.g. to know what a restart shows instead of it
+
+    Args:
+        image (Image.Image): a frame from compose_left_page
+
+    Returns:
+        Optional[Path]: the path the frame is saved to, None if another frame is saved there since
+    """
+    with _left_page_lock:
+        for save_path, key in _saved_left_pages.items():
+            if _left_page_frames.get(key) is image:
+                return save_path
+    return None
+
+
+def create_jpg_left_home(news_client) -> Image.Image:
+    return compose_left_page(init_left_page_data(news_client), save_left_home_path)
+
+
+def create_jpg_left_notify() -> Image.Image:
+    return compose_left_page(left_page_data_notify_update(), save_left_notify_path)
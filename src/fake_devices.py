@@ -0,0 +1,134 @@
+# Stand-ins for the eink displays, the scraper and the news, for replaying traces and load tests without the hardware
+import hashlib
+import os
+from logging import getLogger
+from pathlib import Path
+from time import time
+from types import SimpleNamespace
+from typing import List
+
+from PIL import Image, ImageDraw
+
+from constants import *
+from content import NewsClient
+
+logger = getLogger(__name__)
+
+
+class DisplayModes:
+    """The waveform numbers of the IT8951 controller
+    """
+    INIT = 0
+    DU = 1
+    GC16 = 2
+    GL16 = 3
+    GLR16 = 4
+    GLD16 = 5
+    A2 = 6
+    DU4 = 7
+
+
+# used by book.py in place of IT8951.constants when the IT8951 library is not installed
+it8951_constants = SimpleNamespace(DisplayModes=DisplayModes)
+
+
+class FakeDisplay:
+    """Behave like IT8951 AutoEPDDisplay, but only count the refreshes and remember what was drawn
+    """
+    def __init__(self, width: int = EINK_SCREEN_SIZE[0], height: int = EINK_SCREEN_SIZE[1], name: str = 'fake') -> None:
+        self.width = width
+        self.height = height
+        self.name = name
+        self.frame_buf = Image.new('L', (width, height), 0xFF)
+        self.refresh_count = 0
+        self.partial_count = 0
+        self.modes: List[int] = []
+        self.last_frame_hash = None
+
+    def _draw(self, mode: int) -> None:
+        self.modes.append(mode)
+        self.last_frame_hash = hashlib.sha1(self.frame_buf.tobytes()).hexdigest()
+
+    def draw_full(self, mode: int) -> None:
+        self.refresh_count += 1
+        self._draw(mode)
+
+    def draw_partial(self, mode: int) -> None:
+        self.partial_count += 1
+        self._draw(mode)
+
+    def clear(self) -> None:
+        self.frame_buf.paste(0xFF, box=(0, 0, self.width, self.height))
+        self.draw_full(DisplayModes.INIT)
+
+
+class FakeScraper:
+    """Behave like SocialMediaScraper, returning the updates given to it instead of scraping
+    """
+    def __init__(self) -> None:
+        self.pending: List[Update] = []
+        self.scrape_count = 0
+
+    def scrape(self) -> None:
+        self.scrape_count += 1
+
+    def add_updates(self, updates: List[Update]) -> None:
+        self.pending.extend(updates)
+
+    def get_new_photos_from_followings(self) -> List[Update]:
+        updates, self.pending = self.pending, []
+        return updates
+
+    def logout(self) -> None:
+        pass
+
+
+class FakeNewsClient(NewsClient):
+    """Behave like NewsClient without the news api, the headlines change every hour
+       and their photos are served from local files
+    """
+    def __init__(self, source_path: Path = cache_path / 'fake_news', headlines_per_hour: int = 5) -> None:
+        self.source_path = source_path
+        self.headlines_per_hour = headlines_per_hour
+        self.source_path.mkdir(parents=True, exist_ok=True)
+        self.hour = None
+        self.top_headlines = self.fetch_top_headlines_title()
+        self.start_ring()
+
+    def fetch_top_headlines_title(self) -> List[News]:
+        if self.hour is not None:
+            # the photos of the last hour are no longer served
+            for photo_path in self.source_path.glob(f'news_{self.hour}_*.jpg'):
+                photo_path.unlink()
+        self.hour = int(time() // 3600)
+        headlines = []
+        for i in range(self.headlines_per_hour):
+            photo_path = self.source_path / f'news_{self.hour}_{i}.jpg'
+            if not photo_path.exists():
+                Image.new('L', NEWS_IMAGE_SIZE, 0x80).save(photo_path)
+            headlines.append(News(f'headline {i} of hour {self.hour}', photo_path.as_uri()))
+        return headlines
+
+
+def fake_create_pages(updates: List[Update], exist_num_pages: int) -> List[Path]:
+    """create blank pages with the photo name written on it, instead of rendering the templates with chrome
+
+    Args:
+        updates (List[Update]): a list of updates
+        exist_num_pages (int): the current length of the right pages
+
+    Returns:
+        List[Path]: a list of path that contain the new created pages
+    """
+    new_pages = []
+    for page_index, i in enumerate(range(0, len(updates), 2)):
+        image = Image.new('L', EINK_SCREEN_SIZE, 0xFF)
+        draw = ImageDraw.Draw(image)
+        for line, update in enumerate(updates[i:i + 2]):
+            draw.text((100, 100 + line * 900), f'{update.following.relationship}: {update.path.name}', fill=0)
+        page_path = saved_right_pages_path / f'right_page_{exist_num_pages + page_index + 1}.jpg'
+        image.save(page_path)
+        # the age of a page follows the clock of the book, e.g. the simulated clock of soak.py
+        os.utime(page_path, (time(), time()))
+        new_pages.append(page_path)
+    return new_pages
@@ -0,0 +1,142 @@
+# Index of the photos downloaded for each following, so pages never glob the folders
+from logging import getLogger
+from pathlib import Path
+from threading import Lock
+from typing import Dict, List, Optional
+
+from constants import *
+
+logger = getLogger(__name__)
+
+PROFILE_PHOTO_NAME = 'profile_photo.jpg'
+
+
+def shortcode_of(image_path: Path) -> Optional[str]:
+    """get the shortcode from the filename of a photo downloaded by the instagram scraper
+
+    Args:
+        image_path (Path): any photo of a following
+
+    Returns:
+        Optional[str]: the string after _, '' for a profile photo, None if the filename has no shortcode
+    """
+    if image_path.name == PROFILE_PHOTO_NAME:
+        return ''
+    parts = image_path.stem.split(sep='_', maxsplit=1)
+    return parts[1] if len(parts) == 2 else None
+
+
+class FollowingIndex:
+    """The profile photo and the posts of one following, keyed by shortcode
+    """
+    def __init__(self, following_path: Path) -> None:
+        self.following_path = following_path
+        self.profile_photo: Optional[Path] = None
+        self.posts: Dict[str, Path] = {}
+        self._lock = Lock()
+        # mtime of the folder at the last scan, None if it has never been scanned
+        self._scanned_mtime_ns: Optional[int] = None
+        self._scan()
+
+    def _scan(self) -> None:
+        """scan the folder when the index is created, and again when the profile photo is missing
+           and the folder has changed since the last scan
+        """
+        try:
+            mtime_ns = self.following_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime_ns == self._scanned_mtime_ns:
+            return
+        self._scanned_mtime_ns = mtime_ns
+        for path in self.following_path.glob('*.jpg'):
+            self.add_file(path)
+
+    def get_profile_photo(self) -> Optional[Path]:
+        """get the profile photo, the scraper can download it after the index is created
+           without it being added, so the folder is scanned again on a miss if it changed
+
+        Returns:
+            Optional[Path]: the profile photo, None if the following has none
+        """
+        if self.profile_photo is None:
+            self._scan()
+        return self.profile_photo
+
+    def add_file(self, path: Path) -> None:
+        """add a newly downloaded photo, a profile photo is renamed to profile_photo.jpg once here
+
+        Args:
+            path (Path): a photo in the folder of this following
+        """
+        shortcode = shortcode_of(path)
+        if shortcode is None:
+            return
+        with self._lock:
+            if shortcode == '':
+                profile_path = self.following_path / PROFILE_PHOTO_NAME
+                if path != profile_path:
+                    try:
+                        path = path.rename(profile_path)
+                    except FileNotFoundError:
+                        # another thread has renamed it
+                        path = profile_path
+                self.profile_photo = path
+            else:
+                self.posts[shortcode] = path
+
+    def remove_file(self, path: Path) -> None:
+        """forget a photo that has been deleted
+
+        Args:
+            path (Path): a photo in the folder of this following
+        """
+        with self._lock:
+            if path == self.profile_photo:
+                self.profile_photo = None
+            else:
+                self.posts.pop(shortcode_of(path), None)
+
+    def get_post(self, shortcode: str) -> Optional[Path]:
+        return self.posts.get(shortcode)
+
+
+_indexes: Dict[Path, FollowingIndex] = {}
+_indexes_lock = Lock()
+
+
+def get_following_index(following_path: Path) -> FollowingIndex:
+    """get the index of a following, the folder is only scanned the first time
+
+    Args:
+        following_path (Path): the folder that contain the photos of a following
+
+    Returns:
+        FollowingIndex: the index of the following
+    """
+    index = _indexes.get(following_path)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(following_path)
+            if index is None:
+                index = FollowingIndex(following_path)
+                _indexes[following_path] = index
+    return index
+
+
+def add_updates(updates: List[Update]) -> None:
+    """add the photos of new updates to the indexes of their followings
+
+    Args:
+        updates (List[Update]): new updates from the scraper
+    """
+    for update in updates:
+        get_following_index(update.path.parent).add_file(update.path)
+
+
+def remove_file(path: Path) -> None:
+    """forget a deleted photo, if its following is indexed
+    """
+    index = _indexes.get(path.parent)
+    if index is not None:
+        index.remove_file(path)
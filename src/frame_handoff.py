@@ -0,0 +1,265 @@
+# Render in a worker process and hand the frames to the display process through shared memory,
+# so rendering never holds the GIL of the process that handles the buttons and the screens
+import os
+import queue
+import zlib
+from collections import deque
+from itertools import count
+from logging import getLogger
+from multiprocessing import get_context, shared_memory
+from pathlib import Path
+from threading import Lock, Thread
+from typing import Callable, Deque, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from PIL import Image
+
+import memory
+import metrics
+from constants import *
+
+logger = getLogger(__name__)
+
+# what the worker sends back for a request: a frame in a slot, a path, or the end of the request
+FrameDescriptor = NamedTuple('FrameDescriptor', [('request_id', int), ('slot', int), ('size', Tuple[int, int]),
+                                                 ('key', int), ('path', Optional[str]), ('done', bool),
+                                                 ('error', Optional[str])])
+
+
+def render_news() -> None:
+    """create the news client of the worker, slow as the headlines are downloaded
+    """
+    global _news_client
+    import content
+    _news_client = content.NewsClient()
+
+
+def render_left_home() -> Image.Image:
+    import content
+    return content.create_page_left_home(_news_client)
+
+
+def render_left_notify() -> Image.Image:
+    import content
+    # the left page state lives in this process, the time is not updated by the display process
+    content.left_page_data_time_update()
+    return content.create_page_left_notify()
+
+
+def render_left_page_files() -> List[Path]:
+    import content
+    return content.get_left_page_files()
+
+
+def render_pages(updates: List[Update], exist_num_pages: int) -> Iterator[Path]:
+    import content
+    return content.iter_pages(updates, exist_num_pages)
+
+
+_news_client = None
+DEFAULT_RENDERERS: Dict[str, Callable] = {
+    'news': render_news,
+    'left_home': render_left_home,
+    'left_notify': render_left_notify,
+    'pages': render_pages,
+    'left_page_files': render_left_page_files,
+}
+# the pages take long with chrome, the left pages are rendered beside them
+SLOW_RENDERERS = ('pages',)
+
+
+def _publish(result, request_id: int, slots: List[shared_memory.SharedMemory], descriptors, free_slots) -> None:
+    if isinstance(result, Image.Image):
+        frame = result if result.mode == 'L' else result.convert('L')
+        data = frame.tobytes()
+        if len(data) > slots[0].size:
+            raise ValueError(f'a frame of {frame.size} does not fit in a slot of {slots[0].size} bytes')
+        slot = free_slots.get()
+        try:
+            slots[slot].buf[:len(data)] = data
+            descriptors.put(FrameDescriptor(request_id, slot, frame.size, zlib.crc32(data), None, False, None))
+        except BaseException:
+            # the slot is only returned by the display process once it is given a descriptor
+            free_slots.put(slot)
+            raise
+    elif result is not None:
+        for path in result:
+            descriptors.put(FrameDescriptor(request_id, -1, (0, 0), 0, str(path), False, None))
+
+
+def _run_lane(lane: queue.SimpleQueue, renderers: Dict[str, Callable], slots, descriptors, free_slots) -> None:
+    while True:
+        request_id, kind, args = lane.get()
+        error = None
+        try:
+            _publish(renderers[kind](*args), request_id, slots, descriptors, free_slots)
+        except Exception as e:
+            logger.error(f'cannot render {kind}: {e}')
+            error = str(e)
+        descriptors.put(FrameDescriptor(request_id, -1, (0, 0), 0, None, True, error))
+
+
+def _worker_main(renderers: Dict[str, Callable], slot_names: List[str], requests, descriptors, free_slots) -> None:
+    """main function of the render process
+    """
+    parent_pid = os.getppid()
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    lanes = {'slow': queue.SimpleQueue(), 'fast': queue.SimpleQueue()}
+    for lane in lanes.values():
+        Thread(target=_run_lane, args=(lane, renderers, slots, descriptors, free_slots), daemon=True).start()
+
+    while True:
+        try:
+            request = requests.get(timeout=1)
+        except queue.Empty:
+            if os.getppid() != parent_pid:
+                # the display process is gone
+                break
+            continue
+        if request is None:
+            break
+        lanes['slow' if request[1] in SLOW_RENDERERS else 'fast'].put(request)
+    for slot in slots:
+        slot.close()
+
+
+class RenderProcess:
+    """The display side of the split. Requests are rendered by a worker process, the frames come back
+       in shared memory slots and are mapped as images without a copy. A frame stays valid until two newer
+       frames of the same kind are received, then its slot is given back to the worker
+    """
+    def __init__(self, renderers: Dict[str, Callable] = DEFAULT_RENDERERS, num_slots: int = FRAME_HANDOFF_SLOTS,
+                 frame_size: Tuple[int, int] = EINK_SCREEN_SIZE) -> None:
+        self.renderers = renderers
+        self.num_slots = num_slots
+        self.slot_bytes = frame_size[0] * frame_size[1]
+        self._context = get_context('spawn')  # no fork of a process with threads
+        self._slots: List[shared_memory.SharedMemory] = []
+        self._waiting: Dict[int, queue.SimpleQueue] = {}
+        self._leases: Dict[str, Deque[Tuple[int, int, Image.Image]]] = {}
+        self._request_ids = count()
+        self._lock = Lock()
+        self._process = None
+
+    def start(self) -> None:
+        self._slots = [shared_memory.SharedMemory(create=True, size=self.slot_bytes) for _ in range(self.num_slots)]
+        memory.budget.register('frame_handoff')
+        memory.budget.charge('frame_handoff', self.slot_bytes * self.num_slots)
+        self._requests = self._context.Queue()
+        self._descriptors = self._context.Queue()
+        self._free_slots = self._context.Queue()
+        for slot in range(self.num_slots):
+            self._free_slots.put(slot)
+        # not a daemon, the worker starts processes itself when ingesting photos
+        self._process = self._context.Process(target=_worker_main, name='render_process',
+                                              args=(self.renderers, [slot.name for slot in self._slots],
+                                                    self._requests, self._descriptors, self._free_slots))
+        self._process.start()
+        Thread(target=self._dispatch, name='frame_handoff', daemon=True).start()
+        logger.info(f'render process started with {self.num_slots} slots')
+
+    def stop(self) -> None:
+        if self._process is None:
+            return
+        self._requests.put(None)
+        self._process.join(timeout=5)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process = None
+        with self._lock:
+            self._leases.clear()
+        for slot in self._slots:
+            slot.unlink()
+            try:
+                slot.close()
+            except BufferError:
+                # a frame is still mapped, the memory is freed when the last image is
+                pass
+        memory.budget.release('frame_handoff', self.slot_bytes * self.num_slots)
+
+    def _dispatch(self) -> None:
+        while True:
+            descriptor = self._descriptors.get()
+            with self._lock:
+                waiting = self._waiting.get(descriptor.request_id)
+            if waiting is not None:
+                waiting.put(descriptor)
+
+    def _request(self, kind: str, *args) -> Iterator[FrameDescriptor]:
+        request_id = next(self._request_ids)
+        waiting = queue.SimpleQueue()
+        with self._lock:
+            self._waiting[request_id] = waiting
+        self._requests.put((request_id, kind, args))
+        try:
+            while True:
+                # waiting here releases the GIL, the buttons keep working while the worker renders
+                try:
+                    descriptor = waiting.get(timeout=1)
+                except queue.Empty:
+                    if self._process is None or not self._process.is_alive():
+                        raise RuntimeError(f'the render process stopped while rendering {kind}')
+                    continue
+                if descriptor.done:
+                    if descriptor.error is not None:
+                        raise RuntimeError(f'the render process cannot render {kind}: {descriptor.error}')
+                    return
+                yield descriptor
+        finally:
+            with self._lock:
+                del self._waiting[request_id]
+
+    def create_news(self) -> 'RenderProcess':
+        """create the news client of the worker, in place of content.NewsClient for run_eink_loop
+
+        Returns:
+            RenderProcess: this render process, the left home page is rendered with the news of the worker
+        """
+        for _ in self._request('news'):
+            pass
+        return self
+
+    def render_frame(self, kind: str, *args) -> Optional[Image.Image]:
+        """render a frame in the worker
+
+        Args:
+            kind (str): name of the renderer, e.g. left_home
+
+        Returns:
+            Optional[Image.Image]: the frame mapped from shared memory, which should not be changed.
+                The same image as last time if the frame did not change, None if the rendering failed
+        """
+        frame = None
+        try:
+            for descriptor in self._request(kind, *args):
+                frame = self._lease(kind, descriptor)
+        except RuntimeError as e:
+            logger.error(e)
+            return None
+        return frame
+
+    def _lease(self, kind: str, descriptor: FrameDescriptor) -> Image.Image:
+        with self._lock:
+            leases = self._leases.setdefault(kind, deque())
+            if len(leases) != 0 and leases[-1][1] == descriptor.key:
+                # unchanged, keep the mapped image so the display can skip the refresh
+                self._free_slots.put(descriptor.slot)
+                metrics.inc('frame_handoff.unchanged')
+                return leases[-1][2]
+            image = Image.frombuffer('L', descriptor.size, self._slots[descriptor.slot].buf, 'raw', 'L', 0, 1)
+            leases.append((descriptor.slot, descriptor.key, image))
+            if len(leases) > 2:
+                # the frame before the last one may still be drawn by another thread, older ones are done
+                slot, _, _ = leases.popleft()
+                self._free_slots.put(slot)
+        metrics.inc('frame_handoff.frames')
+        return image
+
+    def iter_paths(self, kind: str, *args) -> Iterator[Path]:
+        """run a renderer that gives files in the worker, e.g. pages for the pages of updates,
+           each path is given as soon as the worker has it
+
+        Raises:
+            RuntimeError: the renderer failed
+        """
+        for descriptor in self._request(kind, *args):
+            yield Path(descriptor.path)
@@ -0,0 +1,87 @@
+# Save frames to disk in the background, only needed to show the last frames after a restart
+import os
+from logging import getLogger
+from pathlib import Path
+from threading import Condition, Thread
+from typing import Dict
+
+from PIL import Image
+
+import memory
+import metrics
+
+logger = getLogger(__name__)
+
+
+class FrameWriter:
+    """Write frames atomically in a background thread.
+       Only the latest frame of each path is kept, so a slow SD card never builds a backlog
+    """
+    def __init__(self) -> None:
+        self._pending: Dict[Path, Image.Image] = {}
+        self._condition = Condition()
+        self._thread = None
+
+    def save(self, image: Image.Image, path: Path) -> None:
+        """queue a frame to be saved, replacing any frame still waiting for the same path.
+           The image should not be changed after it is queued
+
+        Args:
+            image (Image.Image): the composed frame
+            path (Path): where the frame should be saved
+        """
+        with self._condition:
+            if path in self._pending:
+                metrics.inc('frame_store.coalesced')
+                memory.budget.release('frame_writer', memory.image_bytes(self._pending[path]))
+            memory.budget.charge('frame_writer', memory.image_bytes(image))
+            self._pending[path] = image
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='frame_writer', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def pending(self) -> int:
+        """the number of frames waiting to be written
+        """
+        with self._condition:
+            return len(self._pending)
+
+    def flush(self) -> None:
+        """block until all the queued frames are written
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._pending) == 0)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._pending) != 0)
+                path, image = next(iter(self._pending.items()))
+
+            try:
+                write_frame(image, path)
+            except OSError as e:
+                logger.error(f'cannot save {path}: {e}')
+
+            with self._condition:
+                if self._pending.get(path) is image:
+                    del self._pending[path]
+                    memory.budget.release('frame_writer', memory.image_bytes(image))
+                self._condition.notify_all()
+
+
+def write_frame(image: Image.Image, path: Path) -> None:
+    """save a frame to a temporary file and move it into place, so a crash never leaves half a frame
+
+    Args:
+        image (Image.Image): the frame
+        path (Path): where the frame should be saved
+    """
+    temp_path = path.with_name(f'.{path.name}.tmp')
+    image.save(temp_path, format='JPEG')
+    os.replace(temp_path, path)
+    metrics.inc('frame_store.writes')
+
+
+frame_writer = FrameWriter()
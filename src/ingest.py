@@ -0,0 +1,112 @@
+# Downscale the scraped photos once when they arrive, so page rendering never loads full size photos
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+from multiprocessing import get_context
+from pathlib import Path
+from threading import Lock
+from time import monotonic
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+import metrics
+from constants import *
+
+logger = getLogger(__name__)
+
+
+def is_ingested(image_path: Path, max_size: Tuple[int, int]) -> bool:
+    """Check the photo is already grayscale and fit in the slot, only the header is read
+
+    Args:
+        image_path (Path): path of the photo
+        max_size (Tuple[int, int]): the largest size the photo can be shown
+
+    Returns:
+        bool: True if the photo does not need to downscale
+    """
+    with Image.open(image_path) as img:
+        return img.mode == 'L' and img.size[0] <= max_size[0] and img.size[1] <= max_size[1]
+
+
+def downscale_photo(image_path: Path, max_size: Tuple[int, int], keep_original: bool = INGEST_KEEP_ORIGINALS) -> bool:
+    """Downscale a photo in place to fit the max size and convert to grayscale
+
+    Args:
+        image_path (Path): path of the photo
+        max_size (Tuple[int, int]): the largest size the photo can be shown
+        keep_original (bool, optional): move the full size photo to the originals folder.
+
+    Returns:
+        bool: True if the photo is downscaled, False if it is ingested before or cannot be read
+    """
+    try:
+        if is_ingested(image_path, max_size):
+            return False
+
+        with Image.open(image_path) as img:
+            # decode the jpeg at a reduced scale directly, much faster than decoding full size
+            img.draft('L', max_size)
+            img = img.convert('L')
+            img.thumbnail(max_size, Image.LANCZOS)
+
+            if keep_original:
+                original_path = image_path.parent / INGEST_ORIGINALS_FOLDER / image_path.name
+                original_path.parent.mkdir(exist_ok=True)
+                shutil.copy2(image_path, original_path)
+
+            temp_path = image_path.with_name(f'.{image_path.name}.tmp')
+            img.save(temp_path, format='JPEG', quality=90)
+        os.replace(temp_path, image_path)
+        return True
+
+    except OSError as e:
+        logger.error(f'cannot ingest {image_path}: {e}')
+        return False
+
+
+def _downscale_job(job: Tuple[Path, Tuple[int, int], bool]) -> bool:
+    return downscale_photo(*job)
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = Lock()
+
+
+def get_pool(workers: int = INGEST_WORKERS) -> ProcessPoolExecutor:
+    """get the worker processes of the ingest, started once. They are spawned, forking the book
+       while its threads hold locks could deadlock the workers
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'))
+        return _pool
+
+
+def ingest_updates(updates: List[Update], profile_paths: List[Path], workers: int = INGEST_WORKERS) -> None:
+    """downscale the photos and the profile photos of the updates using a pool of worker processes
+
+    Args:
+        updates (List[Update]): new updates from the scraper
+        profile_paths (List[Path]): profile photos of the followings of the updates
+        workers (int, optional): number of worker processes, 1 to downscale in this process.
+    """
+    jobs = [(update.path, RIGHT_PAGE_PHOTO_MAX_SIZE, INGEST_KEEP_ORIGINALS) for update in updates]
+    jobs += [(path, PROFILE_PHOTO_MAX_SIZE, INGEST_KEEP_ORIGINALS) for path in set(profile_paths) if path is not None]
+
+    if len(jobs) == 0:
+        return
+
+    start_time = monotonic()
+    if workers > 1 and len(jobs) > 1:
+        results = list(get_pool(workers).map(_downscale_job, jobs))
+    else:
+        results = [_downscale_job(job) for job in jobs]
+
+    num_downscaled = sum(results)
+    metrics.inc('ingest.photos', num_downscaled)
+    metrics.observe('ingest.batch_seconds', monotonic() - start_time)
+    logger.info(f'downscaled {num_downscaled} of {len(jobs)} photos in {monotonic() - start_time:.2f}s')
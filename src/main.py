@@ -1,16 +1,21 @@
+import startup  # isort:skip  imported first to time the startup
 import logging
 import sys
 from argparse import ArgumentParser
+from functools import partial
 from multiprocessing import Queue
+from pathlib import Path
 from time import sleep, time
 
-from PyQt5.QtWidgets import QApplication
-
-import content
-from book import Book, VirtualBook
-from constants import log_file_path
+import memory
+import profiling
+import trace_recorder
+from constants import RENDER_SERVER_PORT, book_snapshot_path, create_media_dirs, log_file_path, save_left_home_path
+from memory import MemoryMonitor
 from socialmedia_scraper.social_media_scraper import SocialMediaScraper
 
+# the book, Qt, the render server and the workers are imported by the mode that uses them, after the imports mark
+
 if not log_file_path.exists():
     log_file_path.touch(exist_ok=True)
     
@@ -26,93 +31,170 @@ formatter = logging.Formatter(fmt='%(asctime)s - %(name)-12s - %(funcName)s: \t%
 console.setFormatter(formatter)
 logger = logging.getLogger(__name__)
 logger.addHandler(console)
+startup.mark('imports')
 
 
 def eink_main():
-    ##### Important if update this function, should also update VirtualBookUpdate.run #####
-    # import content
-    news = content.NewsClient()
-    
-    start_time = time()
-    fetch_time = time()
-    first = True
-    
+    from book import run_eink_loop
+    if book.render_process is not None:
+        run_eink_loop(book, news_factory=book.render_process.create_news)
+    else:
+        run_eink_loop(book)
+
+
+def eink_remote_main():
+    """main loop of a book that downloads its pages from a render server instead of rendering them
+    """
+    book.resume()
+    startup.mark('first_frame')
+    start_time = 0
+
     while True:
-        if first:
-            book.add_left_home_page(content.create_page_left_home(news.get_random_headlines()))
-            book.add_right_pages(content.load_existing_pages())
-            book.show_home_page()  # display home page
-
-        if book.fetch and (time() - fetch_time > 60*60 or first):
-            book.logger.info('hi')
-            # fetch from social media
-            book.social_media_scraper.scrape()           
-            fetch_time = time()
-            # add pages and create notify when there are updates
+        profiling.event()
+        try:
             book.check_update()
-        first = False
-
-        if time() - start_time > 60:
-            # update data on left page
-            content.left_page_data_time_update()
-            if book.get_current_showing_status():
-                # Check is the book showing notification, put to notify page            
-                book.logger.info(f'showing status: {book.get_current_showing_status()}')
-                book.show_notify_page()
-            
-            else:
-                book.add_left_home_page(content.create_page_left_home(news.get_random_headlines()))
-                book.show_left_home_page()
-            start_time = time()
-            
-        # book.check_update()
+            if time() - start_time > 60:
+                if book.get_current_showing_status():
+                    book.show_notify_page()
+                else:
+                    left_home = book.render_client.fetch_left_page('left_home', save_left_home_path)
+                    if left_home is not None:
+                        book.add_left_home_page(left_home)
+                        book.show_left_home_page()
+                start_time = time()
+        except OSError as e:
+            book.logger.error(f'cannot reach the render server: {e}')
         sleep(30)
-            
-                       
-                    
+
+
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('--novirtual', help='run program with eink display', action='store_true', default=False)
     parser.add_argument('-d', '--demo', help='Use demo photo', action='store_true', default=False)
     parser.add_argument('-f', '--fetch', help='Fetech photos from social media', action='store_true', default=False)
     parser.add_argument('-allclean', help='Clean start: clean all cache and pages', action='store_true', default=False)
+    parser.add_argument('--serve', help='Run as a render server for other books, without display', action='store_true', default=False)
+    parser.add_argument('--port', help='Port of the render server', type=int, default=RENDER_SERVER_PORT)
+    parser.add_argument('--memory-budget', help='Memory budget in MB shared by the image caches and buffers', type=int, default=None)
+    parser.add_argument('--tracemalloc', help='Log the biggest memory growth by line of code with the memory snapshots', action='store_true', default=False)
+    parser.add_argument('--watch', help='Watch the download folders for new photos instead of rescanning them', action='store_true', default=False)
+    parser.add_argument('--record', help='Record a trace of the events to this file for trace_replay.py', default=None)
+    parser.add_argument('--server', help='Url of a render server to download the pages from, e.g. http://host:8951', default=None)
+    parser.add_argument('--profile', help='Profile all threads, dumped to media/profile on exit and on SIGUSR1', choices=profiling.PROFILE_MODES, default=None)
+    parser.add_argument('--profile-seconds', help='Stop profiling after this many seconds', type=float, default=None)
+    parser.add_argument('--scrape-process', help='Scrape in a supervised process, the main loop keeps running while scraping', action='store_true', default=False)
+    parser.add_argument('--render-process', help='Render the pages in a separate process, the frames are shared with the display process', action='store_true', default=False)
+    parser.add_argument('--profile-events', help='Stop profiling after this many iterations of the main loop', type=int, default=None)
     
     args = parser.parse_args()
+    create_media_dirs()
+    if args.profile:
+        profiling.start(args.profile, seconds=args.profile_seconds, max_events=args.profile_events)
+    if args.memory_budget:
+        memory.budget.set_limit(args.memory_budget * 1024 * 1024)
+    MemoryMonitor(use_tracemalloc=args.tracemalloc).start()
+    if args.record:
+        trace_recorder.start_recording(Path(args.record))
 
     queue = Queue(maxsize=1)
     if args.allclean:
+        import content
         content.clear_existing_page()
+        # the snapshot points at the deleted pages
+        book_snapshot_path.unlink(missing_ok=True)
+
+    scrape_supervisor = None
+    if args.scrape_process and args.fetch and not args.serve:
+        # this process only scans the download folders, the scrape process logs in and scrapes
+        from scrape_worker import ScrapeSupervisor
+        social_media_scraper = SocialMediaScraper(False)
+        scrape_supervisor = ScrapeSupervisor(partial(SocialMediaScraper, True))
+        scrape_supervisor.start()
+    else:
+        social_media_scraper = SocialMediaScraper(args.fetch)
+    photo_watcher = None
+    if args.watch:
+        from photo_watcher import PhotoWatcher
+        photo_watcher = PhotoWatcher(getattr(social_media_scraper, 'followings', {}))
+        photo_watcher.start()
+
+    if args.serve:
+        from constants import SERVER_RETENTION_BUDGETS
+        from render_server import RenderServer
+        from retention import RetentionService
+        render_server = RenderServer(social_media_scraper, port=args.port)
+        render_server.start()
+        RetentionService(render_server.manifest.get_protected_frames, budgets=SERVER_RETENTION_BUDGETS,
+                         before_collect=render_server.manifest.prune).start()
+        try:
+            render_server.run(args.fetch)
+        finally:
+            render_server.stop()
+            profiling.stop()
+            if args.fetch:
+                social_media_scraper.logout()
 
-    social_media_scraper = SocialMediaScraper(args.fetch)
-
-    if args.novirtual:
+    elif args.novirtual:
         import RPi.GPIO as GPIO
+
+        from book import Book
+        from render_server import RenderClient
+        from retention import RetentionService
         GPIO.setmode(GPIO.BCM)
 
+        render_process = None
+        if args.render_process and not args.server:
+            from frame_handoff import RenderProcess
+            render_process = RenderProcess()
+            render_process.start()
+
         book = Book(queue, demo=args.demo, 
                     social_media_scraper=social_media_scraper, 
-                    fetch=args.fetch
+                    fetch=args.fetch,
+                    render_client=RenderClient(args.server) if args.server else None,
+                    photo_watcher=photo_watcher,
+                    render_process=render_process,
+                    scrape_supervisor=scrape_supervisor
                     )
 
+        RetentionService(book.get_protected_pages, before_collect=book.expire_pages).start()
+
         try:
-            eink_main()
+            if args.server:
+                eink_remote_main()
+            else:
+                eink_main()
         finally:
-            if args.fetch:
+            trace_recorder.stop_recording(book.get_state())
+            profiling.stop()
+            if render_process is not None:
+                render_process.stop()
+            if scrape_supervisor is not None:
+                scrape_supervisor.stop()
+            elif args.fetch:
                 social_media_scraper.logout()
 
     else:
+        from PyQt5.QtWidgets import QApplication
+
+        from book import VirtualBook
+        from retention import RetentionService
         logger.info('Using virtual display')
         app = QApplication([])
-        vbook = VirtualBook(args.demo, social_media_scraper, args.fetch)
+        vbook = VirtualBook(args.demo, social_media_scraper, args.fetch, photo_watcher, scrape_supervisor)
 
         vbook.show()
+        RetentionService(vbook.get_protected_pages, before_collect=vbook.expire_pages).start()
 
         try:
             sys.exit(app.exec())
         except Exception as e:
             logger.error(e)
         finally:
-            if args.fetch:
+            profiling.stop()
+            if scrape_supervisor is not None:
+                scrape_supervisor.stop()
+            elif args.fetch:
                 social_media_scraper.logout()
 
 
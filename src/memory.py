@@ -0,0 +1,166 @@
+# A global memory budget for the image caches and buffers, and periodic memory snapshots for finding leaks
+import os
+import tracemalloc
+from logging import getLogger
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, Optional
+
+from PIL import Image
+
+import metrics
+from constants import *
+
+logger = getLogger(__name__)
+
+
+def image_bytes(image: Image.Image) -> int:
+    """estimate the memory used by the pixels of an image
+    """
+    return image.size[0] * image.size[1] * len(image.getbands())
+
+
+def load_image(path: Path) -> Image.Image:
+    """open and decode an image, the file is closed before returning instead of when the image is garbage collected
+
+    Args:
+        path (Path): path of the image
+
+    Returns:
+        Image.Image: the decoded image
+    """
+    with Image.open(path) as image:
+        image.load()
+    return image
+
+
+class MemoryBudget:
+    """Every image cache and buffer charges the bytes it keeps to the budget.
+       When the total is over the limit, the caches are asked to evict, the largest first
+    """
+    def __init__(self, limit: int = MEMORY_BUDGET_BYTES) -> None:
+        self.limit = limit
+        self._usage: Dict[str, int] = {}
+        self._evictors: Dict[str, Callable[[], int]] = {}
+        self._lock = Lock()
+
+    def register(self, name: str, evict: Optional[Callable[[], int]] = None) -> None:
+        """register a user of the budget
+
+        Args:
+            name (str): name of the cache or buffer
+            evict (Optional[Callable[[], int]], optional): frees some memory by calling release, returns the bytes freed.
+                None for buffers that cannot be evicted.
+        """
+        with self._lock:
+            self._usage.setdefault(name, 0)
+            if evict is not None:
+                self._evictors[name] = evict
+
+    def charge(self, name: str, num_bytes: int) -> None:
+        """add to the memory used by a cache or buffer, evicting from the caches if over the limit
+        """
+        with self._lock:
+            self._usage[name] = self._usage.get(name, 0) + num_bytes
+        self._enforce()
+
+    def release(self, name: str, num_bytes: int) -> None:
+        """remove from the memory used by a cache or buffer
+        """
+        with self._lock:
+            self._usage[name] = max(0, self._usage.get(name, 0) - num_bytes)
+
+    def total(self) -> int:
+        with self._lock:
+            return sum(self._usage.values())
+
+    def usage(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._usage)
+
+    def _enforce(self) -> None:
+        while self.total() > self.limit:
+            with self._lock:
+                evictable = [name for name in self._evictors if self._usage.get(name, 0) > 0]
+                if len(evictable) == 0:
+                    break
+                name = max(evictable, key=lambda name: self._usage[name])
+                evict = self._evictors[name]
+            # evict without the lock, the cache calls release
+            if evict() == 0:
+                break
+            metrics.inc(f'memory.evictions.{name}')
+
+    def set_limit(self, limit: int) -> None:
+        self.limit = limit
+        self._enforce()
+
+
+budget = MemoryBudget()
+
+
+def get_rss_bytes() -> int:
+    """get the resident memory of this process, 0 if it cannot be read e.g. not on linux
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def count_open_files() -> int:
+    """get the number of open file descriptors of this process, 0 if it cannot be read
+    """
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return 0
+
+
+class MemoryMonitor:
+    """Log the memory of the process periodically, with the biggest growth by line of code when tracemalloc is on,
+       and the metrics of the components
+    """
+    def __init__(self, interval: float = MEMORY_SNAPSHOT_INTERVAL, use_tracemalloc: bool = False, top: int = 10) -> None:
+        self.interval = interval
+        self.use_tracemalloc = use_tracemalloc
+        self.top = top
+        self._last_snapshot = None
+        self._stop = Event()
+
+    def start(self) -> None:
+        if self.use_tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start(MEMORY_TRACEMALLOC_FRAMES)
+        Thread(target=self._run, name='memory_monitor', daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.log_snapshot()
+                metrics.log_summary()
+            except Exception as e:
+                logger.error(e)
+
+    def log_snapshot(self) -> None:
+        """log the rss, open files, budget usage and the top growth since the last snapshot
+        """
+        rss = get_rss_bytes()
+        open_files = count_open_files()
+        metrics.set_gauge('memory.rss_bytes', rss)
+        metrics.set_gauge('memory.open_files', open_files)
+        metrics.set_gauge('memory.budget_bytes', budget.total())
+        usage = ', '.join(f'{name}={size / 1024 / 1024:.1f}MB' for name, size in sorted(budget.usage().items()))
+        logger.info(f'rss={rss / 1024 / 1024:.1f}MB open_files={open_files} '
+                    f'budget={budget.total() / 1024 / 1024:.1f}/{budget.limit / 1024 / 1024:.0f}MB ({usage})')
+
+        if not tracemalloc.is_tracing():
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        if self._last_snapshot is not None:
+            for stat in snapshot.compare_to(self._last_snapshot, 'lineno')[:self.top]:
+                logger.info(f'memory growth: {stat}')
+        self._last_snapshot = snapshot
@@ -0,0 +1,87 @@
+# Simple in-process counters and timings shared by the book's components
+from logging import getLogger
+from threading import Lock
+from typing import Dict
+
+logger = getLogger(__name__)
+
+_lock = Lock()
+_counters: Dict[str, float] = {}
+_gauges: Dict[str, float] = {}
+_timings: Dict[str, Dict[str, float]] = {}
+
+
+def inc(name: str, value: float = 1) -> None:
+    """increase a counter by the given value
+
+    Args:
+        name (str): name of the counter
+        value (float, optional): amount to add. Defaults to 1.
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: float) -> None:
+    """set a gauge to the latest value
+
+    Args:
+        name (str): name of the gauge
+        value (float): the latest value
+    """
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, seconds: float) -> None:
+    """record a duration, keeping count, total, min, max and last
+
+    Args:
+        name (str): name of the timing
+        seconds (float): the measured duration in seconds
+    """
+    with _lock:
+        timing = _timings.setdefault(name, {'count': 0, 'total': 0.0, 'min': seconds, 'max': seconds, 'last': seconds})
+        timing['count'] += 1
+        timing['total'] += seconds
+        timing['min'] = min(timing['min'], seconds)
+        timing['max'] = max(timing['max'], seconds)
+        timing['last'] = seconds
+
+
+def ratio(numerator: str, denominator: str) -> float:
+    """a helper function to get the ratio of two counters, e.g. a cache hit rate
+
+    Returns:
+        float: numerator / denominator, 0 if the denominator is 0
+    """
+    with _lock:
+        total = _counters.get(denominator, 0)
+        return _counters.get(numerator, 0) / total if total else 0.0
+
+
+def snapshot() -> Dict[str, Dict]:
+    """get a copy of all the metrics
+
+    Returns:
+        Dict[str, Dict]: the counters, gauges and timings
+    """
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'timings': {name: dict(timing) for name, timing in _timings.items()},
+        }
+
+
+def log_summary() -> None:
+    """log all the metrics in one line each
+    """
+    data = snapshot()
+    for name, value in sorted(data['counters'].items()):
+        logger.info(f'{name}: {value}')
+    for name, value in sorted(data['gauges'].items()):
+        logger.info(f'{name}: {value}')
+    for name, timing in sorted(data['timings'].items()):
+        mean = timing['total'] / timing['count']
+        logger.info(f'{name}: n={timing["count"]} mean={mean:.3f}s max={timing["max"]:.3f}s last={timing["last"]:.3f}s')
@@ -0,0 +1,158 @@
+# Frames in the native orientation of the display controller, so the driver never rotates a frame on a refresh
+import os
+from logging import getLogger
+from pathlib import Path
+from threading import Lock
+from typing import List, Tuple
+
+from PIL import Image
+
+import memory
+import metrics
+from constants import *
+from memory import load_image
+
+logger = getLogger(__name__)
+
+# the same rotations as the rotate option of IT8951 AutoDisplay
+ROTATIONS = {
+    None: None,
+    'CW': Image.ROTATE_270,
+    'CCW': Image.ROTATE_90,
+    'flip': Image.ROTATE_180,
+}
+
+# native copies of the latest frames in memory, e.g. the left pages, matched by identity as the frames are not changed
+_native_images: List[Tuple[Image.Image, str, Image.Image]] = []
+_native_images_lock = Lock()
+
+
+def to_native(image: Image.Image, profile: DisplayProfile = DISPLAY_PROFILE) -> Image.Image:
+    """fit a portrait frame in the screen the way display_image_8bpp does, then rotate it to the controller
+
+    Args:
+        image (Image.Image): a frame in the orientation of the pages
+        profile (DisplayProfile, optional): the display the frame is for
+
+    Returns:
+        Image.Image: 8 bit gray frame of the size of the controller frame buffer
+    """
+    rotation = ROTATIONS[profile.rotate]
+    width, height = profile.size if rotation in (None, Image.ROTATE_180) else profile.size[::-1]
+    img = image.convert('L')
+    if img.size[0] > width or img.size[1] > height:
+        if img is image:
+            img = img.copy()
+        img.thumbnail((width, height))
+    if img.size != (width, height):
+        # align image with bottom of display
+        canvas = Image.new('L', (width, height), 0xFF)
+        canvas.paste(img, (width - img.size[0], height - img.size[1]))
+        img = canvas
+    return img if rotation is None else img.transpose(rotation)
+
+
+def native_frame_path(page: Path, profile: DisplayProfile = DISPLAY_PROFILE) -> Path:
+    """where the native frame of a page is saved. It is named after the file, not its name,
+       so it is still found after the pages are renamed by their order, and a page replaced under the same name gets a new path
+
+    Args:
+        page (Path): a page in the orientation of the pages
+        profile (DisplayProfile, optional): the display the frame is for
+
+    Returns:
+        Path: path of the native frame
+    """
+    stat = page.stat()
+    return native_frames_path / profile.name / f'{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}.png'
+
+
+def prepare_native_frame(page: Path, profile: DisplayProfile = DISPLAY_PROFILE) -> Path:
+    """save the native frame of a page unless it is saved already
+
+    Args:
+        page (Path): a page in the orientation of the pages
+        profile (DisplayProfile, optional): the display the frame is for
+
+    Returns:
+        Path: path of the native frame
+    """
+    native_path = native_frame_path(page, profile)
+    if native_path.exists():
+        return native_path
+    native_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = native_path.with_name(f'.{native_path.name}.tmp')
+    # lossless and fast to decode, the page was compressed once already
+    to_native(load_image(page), profile).save(temp_path, format='PNG', compress_level=1)
+    os.replace(temp_path, native_path)
+    metrics.inc('native_frames.prepared')
+    return native_path
+
+
+def load_native_frame(frame: Frame, profile: DisplayProfile = DISPLAY_PROFILE) -> Image.Image:
+    """get a frame in the native orientation, from the saved native frame when the page has one
+
+    Args:
+        frame (Frame): a frame in memory or a path to a page
+        profile (DisplayProfile, optional): the display the frame is for
+
+    Returns:
+        Image.Image: the frame ready to be pasted at the origin of the frame buffer
+    """
+    if isinstance(frame, Image.Image):
+        return native_image(frame, profile)
+
+    try:
+        native_path = native_frame_path(frame, profile)
+        if native_path.exists():
+            metrics.inc('native_frames.hits')
+            return load_image(native_path)
+    except OSError as e:
+        logger.error(f'cannot load the native frame of {frame}: {e}')
+    metrics.inc('native_frames.misses')
+    return to_native(load_image(frame), profile)
+
+
+def native_image(image: Image.Image, profile: DisplayProfile = DISPLAY_PROFILE) -> Image.Image:
+    """get the native copy of a frame in memory, the copies of the latest NATIVE_IMAGE_CACHE_SIZE frames are kept,
+       so a memoized left page is only rotated once
+
+    Args:
+        image (Image.Image): a frame in the orientation of the pages, not changed afterwards
+        profile (DisplayProfile, optional): the display the frame is for
+
+    Returns:
+        Image.Image: the frame ready to be pasted at the origin of the frame buffer
+    """
+    with _native_images_lock:
+        for index, (source, name, native) in enumerate(_native_images):
+            if source is image and name == profile.name:
+                _native_images.append(_native_images.pop(index))
+                metrics.inc('native_frames.image_hits')
+                return native
+
+    native = to_native(image, profile)
+    memory.budget.register('native_images', evict_native_image)
+    with _native_images_lock:
+        _native_images.append((image, profile.name, native))
+        evicted = _native_images[:-NATIVE_IMAGE_CACHE_SIZE]
+        del _native_images[:-NATIVE_IMAGE_CACHE_SIZE]
+    memory.budget.charge('native_images', memory.image_bytes(native))
+    for _, _, old_native in evicted:
+        memory.budget.release('native_images', memory.image_bytes(old_native))
+    return native
+
+
+def evict_native_image() -> int:
+    """drop the least recently used native copy, for the memory budget
+
+    Returns:
+        int: the bytes freed
+    """
+    with _native_images_lock:
+        if len(_native_images) == 0:
+            return 0
+        _, _, native = _native_images.pop(0)
+    num_bytes = memory.image_bytes(native)
+    memory.budget.release('native_images', num_bytes)
+    return num_bytes
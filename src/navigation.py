@@ -0,0 +1,130 @@
+# Coalesce the button presses into a target page, so flipping through many pages takes one refresh
+from logging import getLogger
+from threading import Condition, Thread
+from time import monotonic
+from typing import Callable, Optional
+
+import metrics
+from constants import *
+
+logger = getLogger(__name__)
+
+
+class Navigator:
+    """The buttons only move a target page, a background thread shows the target once no press is
+       seen for NAV_COALESCE_DELAY. Pressing the same button again within NAV_REPEAT_WINDOW counts
+       as a repeated press, which jumps NAV_JUMP_PAGES pages after NAV_JUMP_AFTER presses
+    """
+    def __init__(self, get_num_pages: Callable[[], int], show_page: Callable[[int], None],
+                 current_page: int = HOME_PAGE_NUM, delay: float = NAV_COALESCE_DELAY) -> None:
+        """
+        Args:
+            get_num_pages (Callable[[], int]): the number of pages that can be shown
+            show_page (Callable[[int], None]): shows a page, called from the navigator thread only
+            current_page (int, optional): the page on the screen
+            delay (float, optional): seconds without a press before the target is shown
+        """
+        self.get_num_pages = get_num_pages
+        self.show_page = show_page
+        self.delay = delay
+        self.target = current_page
+        self.shown = current_page
+        self._condition = Condition()
+        self._last_press: Optional[float] = None
+        self._last_step = 0
+        self._repeats = 0
+        self._thread = None
+
+    def press(self, direction: int) -> int:
+        """move the target by a press, returns at once
+
+        Args:
+            direction (int): 1 for next page, -1 for previous page
+
+        Returns:
+            int: the new target page
+        """
+        now = monotonic()
+        with self._condition:
+            if direction == self._last_step and self._last_press is not None and now - self._last_press < NAV_REPEAT_WINDOW:
+                self._repeats += 1
+            else:
+                self._repeats = 0
+            self._last_press = now
+            self._last_step = direction
+
+            pages = NAV_JUMP_PAGES if self._repeats >= NAV_JUMP_AFTER else 1
+            return self._move(self.target + direction * pages)
+
+    def move_to(self, page: int) -> int:
+        """move the target to a page like a press does, e.g. the target recorded in a trace
+
+        Args:
+            page (int): the target page
+
+        Returns:
+            int: the new target page, within the pages
+        """
+        with self._condition:
+            self._last_press = monotonic()
+            self._last_step = 0
+            self._repeats = 0
+            return self._move(page)
+
+    def _move(self, target: int) -> int:
+        # called with the condition held
+        target = min(max(target, HOME_PAGE_NUM), max(self.get_num_pages() - 1, HOME_PAGE_NUM))
+        if target != self.target:
+            if self.target != self.shown:
+                metrics.inc('navigation.coalesced')
+            self.target = target
+            self._condition.notify_all()
+
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name='navigator', daemon=True)
+            self._thread.start()
+        return self.target
+
+    def is_moving(self) -> bool:
+        """check if the target is not the page being shown, e.g. a slow refresh can be skipped
+        """
+        with self._condition:
+            return self.target != self.shown
+
+    def wait_shown(self, timeout: Optional[float] = None) -> bool:
+        """wait until the target is shown
+
+        Returns:
+            bool: False if the target is still not shown after the timeout
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self.target == self.shown, timeout)
+
+    def sync(self, page: int) -> None:
+        """the page is shown by someone else, e.g. the book jumped to a page
+        """
+        with self._condition:
+            self.target = self.shown = page
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self.target != self.shown)
+                # wait until the presses stop, every new press restarts the wait
+                while monotonic() - self._last_press < self.delay:
+                    self._condition.wait(self.delay - (monotonic() - self._last_press))
+                target = self.target
+                if target == self.shown:
+                    continue
+                skipped = abs(target - self.shown) - 1
+
+            metrics.inc('navigation.refreshes')
+            metrics.inc('navigation.skipped_pages', skipped)
+            try:
+                self.show_page(target)
+            except Exception as e:
+                logger.error(f'cannot show page {target}: {e}')
+
+            with self._condition:
+                self.shown = target
+                self._condition.notify_all()
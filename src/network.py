@@ -0,0 +1,199 @@
+# Calls to the network with a deadline and a circuit breaker per endpoint, so an outage fails at once
+# instead of blocking the main loop on every tick
+import os
+import urllib.request
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from logging import getLogger
+from pathlib import Path
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Dict, Optional
+
+import metrics
+from constants import *
+
+logger = getLogger(__name__)
+
+_MISSING = object()
+
+
+class CircuitOpenError(ConnectionError):
+    """the endpoint failed recently and is not called until its backoff ends,
+       an OSError like the errors of the call itself
+    """
+
+
+class CircuitBreaker:
+    """Closed while the endpoint works. After NETWORK_FAILURES_TO_OPEN failures in a row it opens and
+       calls fail at once for a backoff that doubles every time it opens again, up to NETWORK_BACKOFF_MAX.
+       Then a single trial call is let through, which closes it on success
+    """
+    def __init__(self, name: str, failures_to_open: int = NETWORK_FAILURES_TO_OPEN,
+                 backoff: float = NETWORK_BACKOFF_BASE, max_backoff: float = NETWORK_BACKOFF_MAX) -> None:
+        self.name = name
+        self.failures_to_open = failures_to_open
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.opened = 0
+        self.open_until = 0.0
+        self.in_flight = False
+        self.held = False
+        self.last_result: Any = _MISSING
+        self._lock = Lock()
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.opened > 0 and monotonic() < self.open_until
+
+    def acquire(self) -> bool:
+        """ask to call the endpoint, only one call at a time so a hanging call is not called again
+
+        Returns:
+            bool: the call can be made, release must be called after it
+        """
+        with self._lock:
+            if self.in_flight or self.held or (self.opened > 0 and monotonic() < self.open_until):
+                return False
+            self.in_flight = True
+            return True
+
+    def release(self, success: bool, result: Any = None) -> None:
+        """the call is done, a failure counts towards opening the circuit
+        """
+        with self._lock:
+            self.in_flight = False
+            if success:
+                if self.opened > 0:
+                    logger.info(f'{self.name} works again')
+                self.failures = 0
+                self.opened = 0
+                self.last_result = result
+                return
+            self.failures += 1
+            if self.failures >= self.failures_to_open:
+                self.opened += 1
+                backoff = min(self.backoff * 2 ** (self.opened - 1), self.max_backoff)
+                self.open_until = monotonic() + backoff
+                metrics.inc(f'network.{self.name}.opened')
+                logger.warning(f'{self.name} failed {self.failures} times in a row, not called for {backoff:.0f}s')
+
+    def hold_until_done(self, future: Future) -> None:
+        """keep the endpoint busy until a call that timed out returns, its result is ignored
+        """
+        def done(_) -> None:
+            with self._lock:
+                self.held = False
+
+        with self._lock:
+            self.held = True
+        future.add_done_callback(done)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = Lock()
+# calls without a timeout of their own run here, a call past its deadline keeps its thread until it returns
+_executor = ThreadPoolExecutor(max_workers=NETWORK_WORKERS, thread_name_prefix='network')
+
+
+def get_breaker(endpoint: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(endpoint)
+        return breaker
+
+
+def call(endpoint: str, function: Callable, *args, timeout: Optional[float] = NETWORK_TIMEOUT,
+         use_last_result: bool = False, **kwargs) -> Any:
+    """call the network through the circuit breaker of the endpoint
+
+    Args:
+        endpoint (str): name of the breaker, e.g. newsapi
+        function (Callable): the call, which raises on failure
+        timeout (Optional[float], optional): seconds before giving up on the call, None to wait in this thread
+            for a function with its own timeout
+        use_last_result (bool, optional): return the last result of the endpoint instead of raising,
+            when the call fails or the circuit is open and there is a last result
+
+    Raises:
+        CircuitOpenError: the circuit is open, or the previous call is still running
+        TimeoutError: the call took longer than the timeout
+        Exception: the error of the call
+
+    Returns:
+        Any: the result of the call
+    """
+    breaker = get_breaker(endpoint)
+    if not breaker.acquire():
+        metrics.inc(f'network.{endpoint}.short_circuited')
+        if use_last_result and breaker.last_result is not _MISSING:
+            return breaker.last_result
+        raise CircuitOpenError(f'{endpoint} is not called after failing')
+
+    start_time = monotonic()
+    try:
+        if timeout is None:
+            result = function(*args, **kwargs)
+        else:
+            result = _call_with_deadline(breaker, function, args, kwargs, timeout)
+    except Exception as e:
+        metrics.inc(f'network.{endpoint}.failures')
+        breaker.release(False)
+        if use_last_result and breaker.last_result is not _MISSING:
+            logger.error(f'{endpoint} failed, the last result is used: {e}')
+            return breaker.last_result
+        raise
+    finally:
+        metrics.observe(f'network.{endpoint}.seconds', monotonic() - start_time)
+    breaker.release(True, result)
+    return result
+
+
+def download_file(url: str, file_path: Path, timeout: float = NETWORK_TIMEOUT) -> Path:
+    """download a file with a timeout, a broken download never leaves a partial file
+
+    Args:
+        url (str): url of the file
+        file_path (Path): where it is saved
+
+    Returns:
+        Path: the saved file
+    """
+    temp_path = file_path.with_name(f'.{file_path.name}.tmp')
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        temp_path.write_bytes(response.read())
+    os.replace(temp_path, file_path)
+    return file_path
+
+
+def scrape_followings(social_media_scraper, timeout: float = SCRAPE_WAIT_TIMEOUT) -> bool:
+    """scrape the followings through the circuit breaker of the scraper, an outage does not block the loop.
+       A scrape longer than the timeout keeps running in the background, its photos are found by the next
+       check for updates and the scraper is not called again until it returns
+
+    Args:
+        timeout (float, optional): seconds the caller waits for the scrape
+
+    Returns:
+        bool: the scrape finished
+    """
+    try:
+        call('scraper', social_media_scraper.scrape, timeout=timeout)
+        return True
+    except Exception as e:
+        # any error of the scraper library, the loop keeps running and the breaker backs off
+        logger.error(f'cannot scrape: {e!r}')
+        return False
+
+
+def _call_with_deadline(breaker: CircuitBreaker, function: Callable, args, kwargs, timeout: float) -> Any:
+    future = _executor.submit(function, *args, **kwargs)
+    try:
+        return future.result(timeout)
+    except FutureTimeoutError:
+        metrics.inc(f'network.{breaker.name}.timeouts')
+        # the endpoint is not called again while the late call still runs
+        breaker.hold_until_done(future)
+        raise TimeoutError(f'{breaker.name} did not answer in {timeout}s')
@@ -0,0 +1,169 @@
+# The overview of the right pages, a grid of thumbnails to jump to any page with one refresh
+from collections import OrderedDict
+from logging import getLogger
+from pathlib import Path
+from queue import SimpleQueue
+from threading import Lock, Thread
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageDraw
+
+import content
+import memory
+import metrics
+from constants import *
+
+logger = getLogger(__name__)
+
+PAGES_PER_OVERVIEW = OVERVIEW_COLUMNS * OVERVIEW_ROWS
+
+
+def make_thumbnail(page: Path, size: Tuple[int, int] = OVERVIEW_THUMBNAIL_SIZE) -> Image.Image:
+    """make a small gray copy of a page
+
+    Args:
+        page (Path): a page of the right screen
+        size (Tuple[int, int], optional): the largest size of the thumbnail
+
+    Returns:
+        Image.Image: the thumbnail in mode L within the size
+    """
+    with Image.open(page) as opened:
+        # a jpeg is decoded at a fraction of its size, much faster than a full decode
+        opened.draft('L', size)
+        img = opened.convert('L')
+    img.thumbnail(size)
+    return img
+
+
+class ThumbnailCache:
+    """Keep the thumbnails of the pages, created in the background when pages are added
+    """
+    def __init__(self, size: Tuple[int, int] = OVERVIEW_THUMBNAIL_SIZE, max_pages: int = THUMBNAIL_CACHE_MAX_PAGES) -> None:
+        self.size = size
+        self.max_pages = max_pages
+        self._thumbnails: 'OrderedDict[str, Image.Image]' = OrderedDict()
+        self._lock = Lock()
+        # the new pages are created one batch after another by a single worker
+        self._pending: 'SimpleQueue[List[Path]]' = SimpleQueue()
+        self._worker: Optional[Thread] = None
+        memory.budget.register('thumbnail_cache', self.evict_oldest)
+
+    @staticmethod
+    def _key(page: Path) -> str:
+        return f'{page}:{page.stat().st_mtime_ns}'
+
+    def get(self, page: Path) -> Image.Image:
+        """get the thumbnail of a page, created now if it is not cached
+
+        Args:
+            page (Path): a page of the right screen
+
+        Returns:
+            Image.Image: the thumbnail
+        """
+        key = self._key(page)
+        with self._lock:
+            thumbnail = self._thumbnails.get(key)
+            if thumbnail is not None:
+                self._thumbnails.move_to_end(key)
+                metrics.inc('thumbnail_cache.hits')
+                return thumbnail
+
+        metrics.inc('thumbnail_cache.misses')
+        return self._add(key, page)
+
+    def _add(self, key: str, page: Path) -> Image.Image:
+        thumbnail = make_thumbnail(page, self.size)
+        with self._lock:
+            old_thumbnail = self._thumbnails.pop(key, None)
+            if old_thumbnail is not None:
+                memory.budget.release('thumbnail_cache', memory.image_bytes(old_thumbnail))
+            self._thumbnails[key] = thumbnail
+        memory.budget.charge('thumbnail_cache', memory.image_bytes(thumbnail))
+        while len(self._thumbnails) > self.max_pages:
+            self.evict_oldest()
+        return thumbnail
+
+    def evict_oldest(self) -> int:
+        """drop the least recently used thumbnail, also called by the memory budget
+
+        Returns:
+            int: number of bytes freed
+        """
+        with self._lock:
+            if len(self._thumbnails) == 0:
+                return 0
+            _, thumbnail = self._thumbnails.popitem(last=False)
+        num_bytes = memory.image_bytes(thumbnail)
+        memory.budget.release('thumbnail_cache', num_bytes)
+        return num_bytes
+
+    def precompute(self, pages: Iterable[Path]) -> None:
+        """create the thumbnails of new pages in the worker thread of the cache, after the pages added before
+
+        Args:
+            pages (Iterable[Path]): the new pages
+        """
+        self._pending.put(list(pages))
+        with self._lock:
+            if self._worker is None:
+                self._worker = Thread(target=self._precompute, name='thumbnail_cache', daemon=True)
+                self._worker.start()
+
+    def _precompute(self) -> None:
+        while True:
+            for page in self._pending.get():
+                try:
+                    key = self._key(page)
+                    if key not in self._thumbnails:
+                        self._add(key, page)
+                except Exception as e:
+                    logger.error(f'cannot create the thumbnail of {page}: {e}')
+
+
+def overview_first_page(cursor: int) -> int:
+    """the first page of the overview grid that shows the cursor
+    """
+    return cursor - cursor % PAGES_PER_OVERVIEW
+
+
+def compose_overview(pages: Sequence[Path], cursor: int, thumbnails: ThumbnailCache,
+                     size: Tuple[int, int] = EINK_SCREEN_SIZE) -> Image.Image:
+    """draw the grid of thumbnails around the cursor, with the page numbers and the cursor as a frame
+
+    Args:
+        pages (Sequence[Path]): the pages of the right screen, e.g. a snapshot of the page list
+        cursor (int): index of the selected page
+        thumbnails (ThumbnailCache): the cached thumbnails
+        size (Tuple[int, int], optional): size of the screen
+
+    Returns:
+        Image.Image: the overview frame in mode L
+    """
+    image = Image.new('L', size, 0xFF)
+    draw = ImageDraw.Draw(image)
+    font = content.get_font(OVERVIEW_FONT_SIZE)
+    first = overview_first_page(cursor)
+    last = min(first + PAGES_PER_OVERVIEW, len(pages))
+    draw.text((OVERVIEW_MARGIN, OVERVIEW_MARGIN), f'Pages {first + 1}-{last} of {len(pages)}', font=font, fill=0)
+
+    cell_width = size[0] // OVERVIEW_COLUMNS
+    cell_height = (size[1] - OVERVIEW_HEADER_HEIGHT) // OVERVIEW_ROWS
+    for index in range(first, last):
+        column, row = (index - first) % OVERVIEW_COLUMNS, (index - first) // OVERVIEW_COLUMNS
+        left, top = column * cell_width, OVERVIEW_HEADER_HEIGHT + row * cell_height
+        try:
+            thumbnail = thumbnails.get(pages[index])
+        except OSError as e:
+            logger.error(f'cannot show the thumbnail of {pages[index]}: {e}')
+            continue
+        image.paste(thumbnail, (left + (cell_width - thumbnail.size[0]) // 2, top + OVERVIEW_MARGIN))
+        label = str(index + 1)
+        label_width, _ = content.get_text_size(font, label)
+        draw.text((left + (cell_width - label_width) // 2, top + OVERVIEW_MARGIN * 2 + thumbnail.size[1]), label, font=font, fill=0)
+        if index == cursor:
+            inset = OVERVIEW_CURSOR_WIDTH // 2
+            draw.rectangle((left + inset, top, left + cell_width - inset - 1, top + cell_height - inset - 1),
+                           outline=0, width=OVERVIEW_CURSOR_WIDTH)
+    return image
@@ -0,0 +1,151 @@
+# A versioned, copy-on-write list of the right pages, read from the button thread while the update thread appends
+from collections.abc import Sequence
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterable, List, Optional
+
+
+def page_id_of(page: Path) -> str:
+    """the id of a page is its file name, e.g. 12.jpg
+    """
+    return page.name
+
+
+class PageSnapshot(Sequence):
+    """An immutable view of the pages at one version.
+       The pages are shared with the later snapshots, which only append after the length of this one
+    """
+    __slots__ = ('version', '_pages', '_ids', '_length')
+
+    def __init__(self, version: int, pages: List[Path], ids: Dict[str, int], length: int) -> None:
+        self.version = version
+        self._pages = pages
+        self._ids = ids
+        self._length = length
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._pages[:self._length][index]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('page index out of range')
+        return self._pages[index]
+
+    def __iter__(self):
+        for index in range(self._length):
+            yield self._pages[index]
+
+    def __contains__(self, page) -> bool:
+        return self.index_of(page_id_of(Path(page))) is not None
+
+    def index_of(self, page_id: str) -> Optional[int]:
+        """find a page by its id in O(1)
+
+        Args:
+            page_id (str): the id from page_id_of
+
+        Returns:
+            Optional[int]: index of the page, None if it is not in this snapshot
+        """
+        index = self._ids.get(page_id)
+        if index is None or index >= self._length:
+            return None
+        return index
+
+    def __repr__(self) -> str:
+        return f'PageSnapshot(version={self.version}, pages={self._length})'
+
+
+class PageList(Sequence):
+    """The pages of the right screen. Readers take the current snapshot without a lock and index it
+       consistently, even while pages are appended. Appends are O(1) amortized as the snapshots share
+       one list that is only appended to, any other change copies the list first
+    """
+    def __init__(self, pages: Iterable[Path] = ()) -> None:
+        self._lock = Lock()
+        self._snapshot = PageSnapshot(0, [], {}, 0)
+        self.replace(pages)
+
+    def snapshot(self) -> PageSnapshot:
+        """get the pages at the current version, it never changes after it is returned
+        """
+        return self._snapshot
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    def extend(self, pages: Iterable[Path]) -> PageSnapshot:
+        """append pages
+
+        Args:
+            pages (Iterable[Path]): the new pages
+
+        Returns:
+            PageSnapshot: the snapshot with the new pages
+        """
+        pages = list(pages)
+        with self._lock:
+            current = self._snapshot
+            items, ids = current._pages, current._ids
+            if len(items) != len(current):
+                # only a snapshot that owns the end of the list can append in place
+                items, ids = items[:len(current)], dict(ids)
+            elif any(page_id_of(page) in ids for page in pages):
+                # a page added again moves its id, the older snapshots keep their own index of it
+                ids = dict(ids)
+            for page in pages:
+                ids[page_id_of(page)] = len(items)
+                items.append(page)
+            if len(items) != len(current):
+                self._snapshot = PageSnapshot(current.version + 1, items, ids, len(items))
+            return self._snapshot
+
+    def append(self, page: Path) -> PageSnapshot:
+        return self.extend([page])
+
+    def drop_first(self, count: int) -> PageSnapshot:
+        """remove the oldest pages, the old snapshots are unchanged
+
+        Args:
+            count (int): number of pages to remove from the start
+
+        Returns:
+            PageSnapshot: the snapshot without the pages
+        """
+        with self._lock:
+            current = self._snapshot
+            if count <= 0:
+                return current
+            items = current[count:]
+            ids = {page_id_of(page): index for index, page in enumerate(items)}
+            self._snapshot = PageSnapshot(current.version + 1, items, ids, len(items))
+            return self._snapshot
+
+    def replace(self, pages: Iterable[Path]) -> PageSnapshot:
+        """replace all the pages with a copy of the given pages, the old snapshots are unchanged
+        """
+        items = list(pages)
+        ids = {page_id_of(page): index for index, page in enumerate(items)}
+        with self._lock:
+            self._snapshot = PageSnapshot(self._snapshot.version + 1, items, ids, len(items))
+            return self._snapshot
+
+    def __len__(self) -> int:
+        return len(self._snapshot)
+
+    def __getitem__(self, index):
+        return self._snapshot[index]
+
+    def __iter__(self):
+        return iter(self._snapshot)
+
+    def __contains__(self, page) -> bool:
+        return page in self._snapshot
+
+    def index_of(self, page_id: str) -> Optional[int]:
+        return self._snapshot.index_of(page_id)
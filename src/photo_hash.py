@@ -0,0 +1,219 @@
+# Skip the updates whose photo was shown recently, e.g. a repost, before any page is rendered for them
+import os
+import struct
+from logging import getLogger
+from pathlib import Path
+from threading import Lock
+from time import monotonic, time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image, ImageChops
+
+import metrics
+from constants import *
+
+logger = getLogger(__name__)
+
+HASH_BITS = 2 * DEDUP_HASH_SIZE * DEDUP_HASH_SIZE
+# a hash in two halves and the time it was first seen, 24 bytes per photo on disk
+RECORD = struct.Struct('<QQd')
+# the hash is split in 8 bands, two hashes at most 7 bits apart share at least one band
+NUM_BANDS = 8
+BAND_BITS = HASH_BITS // NUM_BANDS
+
+
+def _brighter_bits(image: Image.Image, next_pixels: Image.Image) -> bytes:
+    # negative differences are clipped to 0, a bit is set where the next pixel is brighter
+    return ImageChops.subtract(next_pixels, image).point(lambda value: 255 if value else 0).convert('1').tobytes()
+
+
+def dhash(image_path: Path) -> int:
+    """the difference hash of a photo: a bit for each pixel of a 9x9 gray copy telling if the pixel on
+       its right, then the pixel below, is brighter. Both directions make unrelated photos rarely close.
+       Computed by PIL in C, the jpeg is decoded at its smallest scale
+
+    Args:
+        image_path (Path): path of the photo
+
+    Returns:
+        int: the hash of HASH_BITS bits
+    """
+    size = DEDUP_HASH_SIZE
+    with Image.open(image_path) as img:
+        img.draft('L', (size + 1, size + 1))
+        small = img.convert('L').resize((size + 1, size + 1), Image.BILINEAR)
+    pixels = small.crop((0, 0, size, size))
+    rows = _brighter_bits(pixels, small.crop((1, 0, size + 1, size)))
+    columns = _brighter_bits(pixels, small.crop((0, 1, size, size + 1)))
+    return int.from_bytes(rows + columns, 'big')
+
+
+def _pack(photo_hash: int, seen_time: float) -> bytes:
+    return RECORD.pack(photo_hash >> 64, photo_hash & 0xFFFFFFFFFFFFFFFF, seen_time)
+
+
+def hamming_distance(hash_1: int, hash_2: int) -> int:
+    return bin(hash_1 ^ hash_2).count('1')
+
+
+class PhotoHashIndex:
+    """The hashes of the photos shown within the window, appended to a file of fixed size records.
+       Near hashes are found through the bands of the hash instead of comparing with every hash
+    """
+    def __init__(self, index_path: Path = photo_hash_index_path, window: float = DEDUP_WINDOW,
+                 max_distance: int = DEDUP_MAX_DISTANCE) -> None:
+        if max_distance >= NUM_BANDS:
+            raise ValueError(f'the bands only find hashes less than {NUM_BANDS} bits apart')
+        self.index_path = index_path
+        self.window = window
+        self.max_distance = max_distance
+        self._hashes: List[Tuple[int, float]] = []
+        self._bands: List[Dict[int, List[int]]] = [{} for _ in range(NUM_BANDS)]
+        self._lock = Lock()
+        self._compact_at = DEDUP_COMPACT_AFTER
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            data = self.index_path.read_bytes()
+        except FileNotFoundError:
+            return
+        # a record cut by a crash is dropped
+        data = data[:len(data) - len(data) % RECORD.size]
+        records = [((high << 64) | low, seen_time) for high, low, seen_time in RECORD.iter_unpack(data)]
+        oldest = time() - self.window
+        for photo_hash, seen_time in records:
+            if seen_time >= oldest:
+                self._insert(photo_hash, seen_time)
+        if len(self._hashes) < len(records):
+            self._compact()
+        logger.info(f'{len(self._hashes)} photo hashes within the window')
+
+    @staticmethod
+    def _band_values(photo_hash: int):
+        for band in range(NUM_BANDS):
+            yield band, (photo_hash >> (band * BAND_BITS)) & ((1 << BAND_BITS) - 1)
+
+    def _insert(self, photo_hash: int, seen_time: float) -> None:
+        position = len(self._hashes)
+        self._hashes.append((photo_hash, seen_time))
+        for band, value in self._band_values(photo_hash):
+            self._bands[band].setdefault(value, []).append(position)
+
+    def _compact(self) -> None:
+        """drop the hashes out of the window, in memory and on disk
+        """
+        oldest = time() - self.window
+        hashes = [record for record in self._hashes if record[1] >= oldest]
+        self._hashes = []
+        self._bands = [{} for _ in range(NUM_BANDS)]
+        for photo_hash, seen_time in hashes:
+            self._insert(photo_hash, seen_time)
+        # compacted again when the index doubles
+        self._compact_at = max(DEDUP_COMPACT_AFTER, 2 * len(hashes))
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.index_path.with_name(f'.{self.index_path.name}.tmp')
+        temp_path.write_bytes(b''.join(_pack(*record) for record in hashes))
+        os.replace(temp_path, self.index_path)
+
+    def find(self, photo_hash: int) -> Optional[int]:
+        """find a hash within the max distance that was seen within the window
+
+        Args:
+            photo_hash (int): hash of a photo
+
+        Returns:
+            Optional[int]: the nearest hash, None if the photo is new
+        """
+        oldest = time() - self.window
+        nearest, nearest_distance = None, self.max_distance + 1
+        with self._lock:
+            checked = set()
+            for band, value in self._band_values(photo_hash):
+                for position in self._bands[band].get(value, ()):
+                    if position in checked:
+                        continue
+                    checked.add(position)
+                    other_hash, seen_time = self._hashes[position]
+                    distance = hamming_distance(photo_hash, other_hash)
+                    if seen_time >= oldest and distance < nearest_distance:
+                        nearest, nearest_distance = other_hash, distance
+        return nearest
+
+    def add(self, photo_hash: int) -> None:
+        """remember the hash of a photo that is shown
+        """
+        with self._lock:
+            seen_time = time()
+            self._insert(photo_hash, seen_time)
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            with self.index_path.open('ab') as file:
+                file.write(_pack(photo_hash, seen_time))
+            if len(self._hashes) >= self._compact_at:
+                self._compact()
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+
+_index: Optional[PhotoHashIndex] = None
+_index_lock = Lock()
+
+
+def get_photo_hash_index() -> PhotoHashIndex:
+    """get the index of the photo hashes, loaded from disk the first time
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = PhotoHashIndex()
+        return _index
+
+
+def remove_duplicates(updates: List[Update]) -> Tuple[List[Update], List[Optional[int]]]:
+    """drop the updates whose photo is the same or nearly the same as a photo shown within the window,
+       including the photos earlier in the same batch. The hashes are not remembered here,
+       call mark_shown once the page of a photo is in the book, so a photo whose page was never made
+       is not skipped as a repost of itself after a restart
+
+    Args:
+        updates (List[Update]): new updates from the scraper
+
+    Returns:
+        Tuple[List[Update], List[Optional[int]]]: the updates with a new photo, in the same order,
+                                                  and the hash of each photo, None if it cannot be hashed
+    """
+    index = get_photo_hash_index()
+    start_time = monotonic()
+    new_updates, new_hashes = [], []
+    for update in updates:
+        try:
+            photo_hash = dhash(update.path)
+        except OSError as e:
+            # a page is still made, it shows what it can of the photo
+            logger.error(f'cannot hash {update.path}: {e}')
+            new_updates.append(update)
+            new_hashes.append(None)
+            continue
+        in_batch = any(other_hash is not None and hamming_distance(photo_hash, other_hash) <= index.max_distance
+                       for other_hash in new_hashes)
+        if in_batch or index.find(photo_hash) is not None:
+            logger.info(f'skip {update.path.name} of {update.following.name}, the photo was shown recently')
+            metrics.inc('dedup.skipped')
+            continue
+        new_updates.append(update)
+        new_hashes.append(photo_hash)
+    metrics.observe('dedup.batch_seconds', monotonic() - start_time)
+    return new_updates, new_hashes
+
+
+def mark_shown(photo_hashes: Iterable[Optional[int]]) -> None:
+    """remember the hashes of photos whose page is in the book
+
+    Args:
+        photo_hashes (Iterable[Optional[int]]): hashes from remove_duplicates, None is ignored
+    """
+    index = get_photo_hash_index()
+    for photo_hash in photo_hashes:
+        if photo_hash is not None:
+            index.add(photo_hash)
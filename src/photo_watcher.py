@@ -0,0 +1,300 @@
+# Watch the download folders of the scraper with inotify and turn each finished photo into an Update
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+from logging import getLogger
+from pathlib import Path
+from threading import Event, Lock, Thread
+from time import monotonic, time
+from typing import Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+import metrics
+from constants import *
+from following_index import shortcode_of
+
+logger = getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000  # the kernel queue was full and events were dropped, sent with wd -1
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct('iIII')
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+
+
+class Inotify:
+    """A minimal inotify binding with ctypes, raise OSError where inotify is not available
+    """
+    def __init__(self) -> None:
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError('libc is not found')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches: Dict[int, Path] = {}
+
+    def add_watch(self, path: Path) -> None:
+        wd = self._libc.inotify_add_watch(self.fd, str(path).encode(), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'cannot watch {path}')
+        self.watches[wd] = path
+
+    def read_events(self, timeout: float) -> List[Tuple[Optional[Path], int]]:
+        """wait for events
+
+        Args:
+            timeout (float): seconds to wait
+
+        Returns:
+            List[Tuple[Optional[Path], int]]: path and mask of each event, the path is None for IN_Q_OVERFLOW
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b'\0').decode()
+            offset += name_length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+            elif mask & IN_DELETE_SELF:
+                self.watches.pop(wd, None)
+            elif wd in self.watches:
+                events.append((self.watches[wd] / name, mask))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PhotoWatcher:
+    """Turn the photos downloaded by the scraper into Updates once the photo is written
+       and its entry is in the json of the following. Events of the same photo are coalesced until
+       no write is seen for WATCH_SETTLE_SECONDS. The emitted photos are saved, and a restart rescans
+       only the photos changed after the last checkpoint, so nothing is lost or repeated
+    """
+    def __init__(self, followings: Mapping[str, Following], media_path: Path = scraped_media_path,
+                 state_path: Path = photo_watcher_state_path) -> None:
+        self.followings = followings
+        self.media_path = media_path
+        self.state_path = state_path
+        self._lock = Lock()
+        self._stop = Event()
+        self._settling: Dict[Path, float] = {}
+        self._waiting_json: Set[Path] = set()
+        self._ready: List[Update] = []
+        # emitted, but their pages are not in the book yet, they are emitted again after a restart
+        self._pending: Set[Path] = set()
+        self._commit_lock = Lock()
+        self._json_shortcodes: Dict[Path, Tuple[int, Set[str]]] = {}
+        self._checkpoint, self._emitted = self._load_state()
+        self._inotify: Optional[Inotify] = None
+
+    def _load_state(self) -> Tuple[float, Set[str]]:
+        if self.state_path.exists():
+            try:
+                state = json.loads(self.state_path.read_text())
+                return state['checkpoint'], set(state['emitted'])
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f'cannot load the watcher state: {e}')
+        # first start, only the photos from now on are new
+        return time(), set()
+
+    def start(self) -> None:
+        """watch the folders in a background thread, the photos missed while not running are found first
+        """
+        self.media_path.mkdir(parents=True, exist_ok=True)
+        try:
+            self._inotify = Inotify()
+            self._inotify.add_watch(self.media_path)
+            for following_path in self.media_path.iterdir():
+                if following_path.is_dir():
+                    self._inotify.add_watch(following_path)
+        except OSError as e:
+            logger.error(f'inotify is not available, the folders are rescanned instead: {e}')
+            self._inotify = None
+        self.rescan()
+        Thread(target=self._run, name='photo_watcher', daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def rescan(self) -> None:
+        """find the photos newer than the checkpoint that have not been emitted
+        """
+        for photo_path in self.media_path.glob('*/*.jpg'):
+            try:
+                # ctime as the scraper may set the mtime to the time of the post
+                is_new = photo_path.stat().st_ctime >= self._checkpoint
+            except FileNotFoundError:
+                continue
+            if is_new and str(photo_path) not in self._emitted:
+                self._on_photo(photo_path)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if self._inotify is not None:
+                for path, mask in self._inotify.read_events(timeout=WATCH_SETTLE_SECONDS / 2):
+                    self._on_event(path, mask)
+            else:
+                self._stop.wait(WATCH_RESCAN_INTERVAL)
+                self.rescan()
+            self._promote_settled()
+
+    def _on_event(self, path: Optional[Path], mask: int) -> None:
+        if mask & IN_Q_OVERFLOW:
+            self._recover_overflow()
+            return
+        if mask & IN_ISDIR:
+            if path.parent == self.media_path:
+                # a new following, watch it and pick up what was written before the watch started
+                self._inotify.add_watch(path)
+                for photo_path in path.glob('*.jpg'):
+                    self._on_photo(photo_path)
+            return
+        if path.suffix == '.json' and mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self._check_waiting_json(path.parent)
+        elif path.suffix == '.jpg':
+            self._on_photo(path)
+
+    def _recover_overflow(self) -> None:
+        """the kernel dropped events, e.g. during a large scrape: watch the folders created since
+           and find the photos and the json files that were missed
+        """
+        logger.warning('inotify queue overflowed, rescanning the folders')
+        metrics.inc('photo_watcher.overflows')
+        watched = set(self._inotify.watches.values())
+        for following_path in self.media_path.iterdir():
+            if following_path.is_dir() and following_path not in watched:
+                self._inotify.add_watch(following_path)
+        self.rescan()
+        with self._lock:
+            waiting_folders = {path.parent for path in self._waiting_json}
+        for following_path in waiting_folders:
+            self._check_waiting_json(following_path)
+
+    def _on_photo(self, photo_path: Path) -> None:
+        shortcode = shortcode_of(photo_path)
+        if not shortcode:
+            # not a post, e.g. the profile photo or a temporary file
+            return
+        with self._lock:
+            if str(photo_path) in self._emitted:
+                # e.g. replaced by the downscaled photo at ingest
+                return
+            self._settling[photo_path] = monotonic()
+            self._waiting_json.discard(photo_path)
+
+    def _promote_settled(self) -> None:
+        """photos without a write for the settle time are ready once they are in the json
+        """
+        now = monotonic()
+        with self._lock:
+            settled = [path for path, last_event in self._settling.items() if now - last_event >= WATCH_SETTLE_SECONDS]
+            for path in settled:
+                del self._settling[path]
+                self._waiting_json.add(path)
+        for following_path in {path.parent for path in settled}:
+            self._check_waiting_json(following_path)
+
+    def _get_json_shortcodes(self, following_path: Path) -> Set[str]:
+        """get the shortcodes in the json of a following, read again only if the json changed
+        """
+        json_path = following_path / f'{following_path.name}.json'
+        try:
+            mtime = json_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return set()
+        cached = self._json_shortcodes.get(following_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            with json_path.open(encoding='utf-8') as file:
+                shortcodes = {graph['shortcode'] for graph in json.load(file)['GraphImages']}
+        except (OSError, ValueError, KeyError):
+            # the json is still being written
+            return set()
+        self._json_shortcodes[following_path] = (mtime, shortcodes)
+        return shortcodes
+
+    def _check_waiting_json(self, following_path: Path) -> None:
+        shortcodes = self._get_json_shortcodes(following_path)
+        following = self.followings.get(following_path.name, Following(following_path.name, ''))
+        with self._lock:
+            waiting = [path for path in self._waiting_json if path.parent == following_path]
+            for path in waiting:
+                if shortcode_of(path) in shortcodes and path.exists():
+                    self._waiting_json.discard(path)
+                    self._ready.append(Update(following, path))
+                    metrics.inc('photo_watcher.updates')
+
+    def get_updates(self) -> List[Update]:
+        """get the photos that are ready since the last call, call commit with them once their pages are in the book
+
+        Returns:
+            List[Update]: the new updates
+        """
+        with self._lock:
+            updates, self._ready = self._ready, []
+            self._emitted.update(str(update.path) for update in updates)
+            self._pending.update(update.path for update in updates)
+        return updates
+
+    def commit(self, done: Iterable[Update] = ()) -> None:
+        """save which photos are emitted and done, the checkpoint moves to the oldest photo still in progress.
+           The photos emitted without their pages in the book yet are in progress
+
+        Args:
+            done (Iterable[Update], optional): updates from get_updates whose pages are in the book
+        """
+        with self._commit_lock:
+            self._commit(done)
+
+    def _commit(self, done: Iterable[Update]) -> None:
+        with self._lock:
+            self._pending.difference_update(update.path for update in done)
+            in_progress = list(self._settling) + list(self._waiting_json) + [update.path for update in self._ready]
+            in_progress += list(self._pending)
+            emitted = list(self._emitted)
+        checkpoint = time()
+        for path in in_progress:
+            try:
+                checkpoint = min(checkpoint, path.stat().st_ctime)
+            except FileNotFoundError:
+                pass
+
+        # only the photos at or after the checkpoint have to be remembered
+        kept = set()
+        for path in emitted:
+            try:
+                if os.stat(path).st_ctime >= checkpoint:
+                    kept.add(path)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._checkpoint = checkpoint
+            self._emitted = kept | (self._emitted - set(emitted))
+            saved = self._emitted - {str(path) for path in self._pending}
+
+        temp_path = self.state_path.with_suffix('.tmp')
+        temp_path.write_text(json.dumps({'checkpoint': checkpoint, 'emitted': sorted(saved)}))
+        os.replace(temp_path, self.state_path)
@@ -0,0 +1,227 @@
+# Profile a running book, enabled with main.py --profile. Nothing here runs unless the profiler is started
+import cProfile
+import io
+import pstats
+import signal
+import sys
+import threading
+from collections import Counter
+from logging import getLogger
+from pathlib import Path
+from threading import Event, Lock, Thread, Timer
+from time import strftime
+from typing import Dict, Optional
+
+from constants import *
+
+logger = getLogger(__name__)
+
+PROFILE_MODES = ('cprofile', 'sample')
+
+
+class _StatsSnapshot:
+    """what pstats.Stats loads, so the stats of a running cProfile are read without disabling it
+    """
+    def __init__(self, profile: cProfile.Profile) -> None:
+        profile.snapshot_stats()
+        self.stats = profile.stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+class Profiler:
+    """Sample the stacks of every thread and, in cprofile mode, also trace the calls of every thread.
+       The results are written per thread with a collapsed-stack file for flame graphs
+       (flamegraph.pl or speedscope), when stopped or on SIGUSR1
+    """
+    def __init__(self, mode: str = 'sample', output_path: Path = profile_path,
+                 interval: float = PROFILE_SAMPLE_INTERVAL, seconds: Optional[float] = None,
+                 max_events: Optional[int] = None) -> None:
+        """
+        Args:
+            mode (str, optional): cprofile or sample
+            output_path (Path, optional): folder of the profiles
+            interval (float, optional): seconds between the samples of the stacks
+            seconds (Optional[float], optional): stop after this many seconds, None to profile until exit
+            max_events (Optional[int], optional): stop after this many events of the main loops, None for no limit
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f'unknown profile mode {mode}')
+        self.mode = mode
+        self.output_path = output_path
+        self.interval = interval
+        self.seconds = seconds
+        self.max_events = max_events
+        self.events = 0
+        self._stacks: Dict[str, Counter] = {}
+        self._profiles: Dict[str, cProfile.Profile] = {}
+        self._thread_names: Dict[int, str] = {}
+        self._lock = Lock()
+        self._stop = Event()
+
+    def start(self) -> None:
+        self.output_path.mkdir(parents=True, exist_ok=True)
+        # started first, so the sampler itself is not traced
+        Thread(target=self._sample, name='profiler', daemon=True).start()
+        if self.mode == 'cprofile':
+            # new threads start their own profile, the running threads attach themselves
+            threading.setprofile(self._start_thread_profile)
+            self.attach_current_thread()
+        if self.seconds is not None:
+            timer = Timer(self.seconds, self.stop)
+            timer.daemon = True
+            timer.start()
+        if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+            # dumped in a thread, the handler may interrupt the main thread while it holds the lock
+            signal.signal(signal.SIGUSR1, lambda signum, frame: Thread(target=self.dump, args=('hot',), name='profiler_dump', daemon=True).start())
+        logger.info(f'profiling with {self.mode} to {self.output_path}')
+
+    def _start_thread_profile(self, frame, event, arg) -> None:
+        # the first event of a new thread, replaced by the profile of the thread
+        sys.setprofile(None)
+        self.attach_current_thread()
+
+    def attach_current_thread(self, name: Optional[str] = None) -> None:
+        """name the current thread and trace its calls in cprofile mode,
+           for threads not started by threading e.g. a QThread
+
+        Args:
+            name (Optional[str], optional): name in the profiles, the thread name by default
+        """
+        name = name or threading.current_thread().name
+        with self._lock:
+            self._thread_names[threading.get_ident()] = name
+            if self.mode != 'cprofile' or self._stop.is_set() or name in self._profiles:
+                return
+            profile = cProfile.Profile()
+            self._profiles[name] = profile
+        try:
+            profile.enable()
+        except ValueError:
+            # since python 3.12 a profile traces every thread, the first one is enough
+            with self._lock:
+                del self._profiles[name]
+
+    def event(self) -> None:
+        """count an event of a main loop, the profiler stops after max_events
+        """
+        self.events += 1
+        if self.max_events is not None and self.events >= self.max_events:
+            self.stop()
+        if self._stop.is_set() and self.mode == 'cprofile':
+            # before python 3.12 a profile can only be disabled by its own thread
+            profile = self._profiles.get(self._thread_name(threading.get_ident()))
+            if profile is not None:
+                profile.disable()
+
+    def _thread_name(self, ident: int) -> str:
+        name = self._thread_names.get(ident)
+        if name is None:
+            for thread in threading.enumerate():
+                if thread.ident == ident:
+                    name = self._thread_names[ident] = thread.name
+                    break
+        return name or f'thread-{ident}'
+
+    def _sample(self) -> None:
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{Path(code.co_filename).stem}.{code.co_name}')
+                    frame = frame.f_back
+                name = self._thread_name(ident)
+                with self._lock:
+                    self._stacks.setdefault(name, Counter())[';'.join(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        """stop profiling and write the profiles, the process keeps running
+        """
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        threading.setprofile(None)
+        with self._lock:
+            profiles = list(self._profiles.values())
+        for profile in profiles:
+            # before python 3.12 only the profile of the calling thread is stopped here,
+            # the main loops stop theirs on their next event
+            profile.disable()
+        self.dump('final')
+        logger.info(f'profiling stopped after {self.events} events')
+
+    def dump(self, label: str) -> None:
+        """write the profiles so far, without stopping. Called on SIGUSR1
+
+        Args:
+            label (str): part of the file names, e.g. hot or final
+        """
+        stamp = f'{strftime("%Y%m%d-%H%M%S")}-{label}'
+        with self._lock:
+            stacks = {name: Counter(counter) for name, counter in self._stacks.items()}
+            profiles = dict(self._profiles)
+
+        with (self.output_path / f'{stamp}.collapsed').open('w') as file:
+            for name, counter in stacks.items():
+                for stack, count in counter.items():
+                    file.write(f'{name};{stack} {count}\n')
+
+        for name, profile in profiles.items():
+            safe_name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name)
+            stats = pstats.Stats(_StatsSnapshot(profile))
+            stats.dump_stats(self.output_path / f'{stamp}-{safe_name}.prof')
+            text = io.StringIO()
+            stats.stream = text
+            stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+            (self.output_path / f'{stamp}-{safe_name}.txt').write_text(text.getvalue())
+
+        # the hot paths are the stacks seen the most, by thread
+        for name, counter in stacks.items():
+            total = sum(counter.values())
+            for stack, count in counter.most_common(3):
+                logger.info(f'hot path of {name} ({count / total:.0%} of {total} samples): {stack.rsplit(";", 4)[-4:]}')
+        logger.info(f'profiles written to {self.output_path / stamp}*')
+
+
+_profiler: Optional[Profiler] = None
+
+
+def start(mode: str, seconds: Optional[float] = None, max_events: Optional[int] = None) -> Profiler:
+    """start profiling every thread of this process
+
+    Args:
+        mode (str): cprofile or sample
+        seconds (Optional[float], optional): stop after this many seconds
+        max_events (Optional[int], optional): stop after this many events of the main loops
+
+    Returns:
+        Profiler: the running profiler
+    """
+    global _profiler
+    _profiler = Profiler(mode, seconds=seconds, max_events=max_events)
+    _profiler.start()
+    return _profiler
+
+
+def stop() -> None:
+    if _profiler is not None:
+        _profiler.stop()
+
+
+def event() -> None:
+    """count an event of a main loop, does nothing when not profiling
+    """
+    if _profiler is not None:
+        _profiler.event()
+
+
+def attach_current_thread(name: Optional[str] = None) -> None:
+    """profile the current thread if it is not started by threading, does nothing when not profiling
+    """
+    if _profiler is not None:
+        _profiler.attach_current_thread(name)
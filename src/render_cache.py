@@ -0,0 +1,170 @@
+# Cache of rendered right pages keyed by a hash of everything that goes into the page
+import hashlib
+import json
+import os
+import shutil
+from collections import OrderedDict
+from logging import getLogger
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+import metrics
+from constants import *
+
+logger = getLogger(__name__)
+
+
+class RenderCache:
+    """Keep rendered pages on disk so identical inputs never go through chrome twice.
+       Entries are evicted by least recent use once the total size is over the budget.
+    """
+    def __init__(self, cache_path: Path = render_cache_path, max_bytes: int = RENDER_CACHE_MAX_BYTES) -> None:
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._entries: Optional[Dict[str, Tuple[Path, int]]] = None
+        self._total_bytes = 0
+        # least recently used first, a rewritten or deleted file leaves an entry that ages out
+        self._file_hashes: 'OrderedDict[Tuple[str, int, int], str]' = OrderedDict()
+        self._file_hashes_lock = Lock()
+
+    def _load_entries(self) -> Dict[str, Tuple[Path, int]]:
+        """scan the cache folder once, sorted from least to most recently used
+        """
+        if self._entries is None:
+            self.cache_path.mkdir(parents=True, exist_ok=True)
+            files = sorted(self.cache_path.glob('*.jpg'), key=lambda file: file.stat().st_mtime)
+            self._entries = {}
+            for file in files:
+                size = file.stat().st_size
+                self._entries[file.stem] = (file, size)
+                self._total_bytes += size
+        return self._entries
+
+    def file_hash(self, file_path: Optional[Path]) -> str:
+        """hash the bytes of a file, remembered by path, size and mtime so unchanged files are read once
+
+        Args:
+            file_path (Optional[Path]): path of a photo, can be None e.g. no profile photo
+
+        Returns:
+            str: hex digest of the file content, '' if there is no file
+        """
+        if file_path is None:
+            return ''
+        stat = file_path.stat()
+        file_id = (str(file_path), stat.st_size, stat.st_mtime_ns)
+        with self._file_hashes_lock:
+            digest = self._file_hashes.get(file_id)
+            if digest is not None:
+                self._file_hashes.move_to_end(file_id)
+                return digest
+        digest = hashlib.sha1(file_path.read_bytes()).hexdigest()
+        with self._file_hashes_lock:
+            self._file_hashes[file_id] = digest
+            while len(self._file_hashes) > RENDER_CACHE_MAX_FILE_HASHES:
+                self._file_hashes.popitem(last=False)
+        return digest
+
+    def make_key(self, template: str, data: Dict) -> str:
+        """make a cache key from the template id and the data rendered into it.
+           Values that are paths are replaced by the hash of the file content
+
+        Args:
+            template (str): name of the jinja template
+            data (Dict): data that will be rendered with the template
+
+        Returns:
+            str: the cache key
+        """
+        key_data = {'template': template}
+        for name, value in data.items():
+            if isinstance(value, Path):
+                value = self.file_hash(value)
+            key_data[name] = value
+        raw = json.dumps(key_data, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str, output_file: Path) -> Optional[Path]:
+        """copy the cached page to the output file if the key has been rendered before
+
+        Args:
+            key (str): cache key from make_key
+            output_file (Path): where the page should be
+
+        Returns:
+            Optional[Path]: the output file on a hit, None on a miss
+        """
+        with self._lock:
+            entries = self._load_entries()
+            entry = entries.pop(key, None)
+            if entry is None or not entry[0].exists():
+                if entry is not None:
+                    self._total_bytes -= entry[1]
+                metrics.inc('render_cache.misses')
+                metrics.inc('render_cache.lookups')
+                return None
+            # move to the most recently used end
+            entries[key] = entry
+            os.utime(entry[0])
+            # copied under the lock, so put cannot evict the file while it is copied
+            shutil.copyfile(entry[0], output_file)
+        metrics.inc('render_cache.hits')
+        metrics.inc('render_cache.lookups')
+        return output_file
+
+    def put(self, key: str, page_file: Path) -> None:
+        """store a freshly rendered page and evict old entries if over the budget
+
+        Args:
+            key (str): cache key from make_key
+            page_file (Path): the rendered page
+        """
+        if not page_file.exists():
+            logger.error(f'no rendered page to cache: {page_file}')
+            return
+
+        cached_file = self.cache_path / f'{key}.jpg'
+        with self._lock:
+            entries = self._load_entries()
+            temp_file = cached_file.with_suffix('.tmp')
+            shutil.copyfile(page_file, temp_file)
+            os.replace(temp_file, cached_file)
+            size = cached_file.stat().st_size
+            old_entry = entries.pop(key, None)
+            if old_entry is not None:
+                self._total_bytes -= old_entry[1]
+            entries[key] = (cached_file, size)
+            self._total_bytes += size
+            self._evict()
+            metrics.set_gauge('render_cache.bytes', self._total_bytes)
+
+    def _evict(self) -> None:
+        """remove the least recently used entries until the cache is within budget
+        """
+        entries = self._load_entries()
+        while self._total_bytes > self.max_bytes and len(entries) > 1:
+            key = next(iter(entries))
+            file, size = entries.pop(key)
+            file.unlink(missing_ok=True)
+            self._total_bytes -= size
+            metrics.inc('render_cache.evictions')
+            logger.debug(f'evicted {file.name} from render cache')
+
+    def hit_rate(self) -> float:
+        """get the hit rate of the cache since start
+
+        Returns:
+            float: hits / lookups
+        """
+        return metrics.ratio('render_cache.hits', 'render_cache.lookups')
+
+    def clear(self) -> None:
+        """delete all the cached pages
+        """
+        with self._lock:
+            for file in self.cache_path.glob('*.jpg'):
+                file.unlink(missing_ok=True)
+            self._entries = None
+            self._total_bytes = 0
@@ -0,0 +1,395 @@
+# Render pages once on a server and let many books download the finished frames
+import hashlib
+import json
+import os
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from logging import getLogger
+from pathlib import Path
+from threading import Lock, Thread
+from time import sleep, time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+import content
+import metrics
+import network
+from constants import *
+from memory import load_image
+
+logger = getLogger(__name__)
+
+
+def pack_frame(frame: Frame) -> bytes:
+    """convert a frame to what the screen draws, 8 bit gray within the screen size, encoded once
+
+    Args:
+        frame (Frame): a frame in memory or a path to a image
+
+    Returns:
+        bytes: the packed frame
+    """
+    img = frame if isinstance(frame, Image.Image) else load_image(frame)
+    img = img.convert('L')
+    img.thumbnail(EINK_SCREEN_SIZE)
+    buffer = BytesIO()
+    img.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def make_etag(data: bytes) -> str:
+    return f'"{hashlib.sha1(data).hexdigest()}"'
+
+
+class FrameManifest:
+    """The frames published by the server. Each new right page gets the next version,
+       so a book only asks for the pages after the last version it has. Only the frames
+       in the manifest are served, the pages are dropped from it with prune
+    """
+    def __init__(self, frames_path: Path = server_frames_path) -> None:
+        self.frames_path = frames_path
+        self.frames_path.mkdir(parents=True, exist_ok=True)
+        self.version = 0
+        self.pages: List[Dict] = []
+        self.left_pages: Dict[str, Dict] = {}
+        self._lock = Lock()
+        self._manifest_path = frames_path / 'manifest.json'
+        if self._manifest_path.exists():
+            # keep the versions after a restart, otherwise the books would miss pages
+            saved = json.loads(self._manifest_path.read_text())
+            self.version, self.pages, self.left_pages = saved['version'], saved['pages'], saved['left_pages']
+
+    def _save(self) -> None:
+        """save the manifest atomically, should be called with the lock held
+        """
+        data = json.dumps({'version': self.version, 'pages': self.pages, 'left_pages': self.left_pages})
+        temp_path = self._manifest_path.with_suffix('.tmp')
+        temp_path.write_text(data)
+        os.replace(temp_path, self._manifest_path)
+
+    def _write(self, frame_id: str, data: bytes) -> Dict:
+        temp_path = self.frames_path / f'.{frame_id}.tmp'
+        temp_path.write_bytes(data)
+        os.replace(temp_path, self.frames_path / frame_id)
+        return {'id': frame_id, 'etag': make_etag(data), 'size': len(data)}
+
+    def publish_page(self, frame: Frame) -> Dict:
+        """add a new right page
+
+        Args:
+            frame (Frame): the rendered page
+
+        Returns:
+            Dict: the manifest entry of the page
+        """
+        data = pack_frame(frame)
+        with self._lock:
+            version = self.version + 1
+            entry = self._write(f'page_{version}.jpg', data)
+            entry['version'] = version
+            entry['time'] = time()
+            self.pages.append(entry)
+            self.version = version
+            self._save()
+        metrics.inc('render_server.pages_published')
+        return entry
+
+    def publish_left_page(self, name: str, frame: Frame) -> Dict:
+        """replace a left page, e.g. left_home or left_notify
+
+        Args:
+            name (str): name of the left page
+            frame (Frame): the rendered page
+
+        Returns:
+            Dict: the manifest entry of the page
+        """
+        entry = self._write(f'{name}.jpg', pack_frame(frame))
+        with self._lock:
+            self.left_pages[name] = entry
+            self._save()
+        return entry
+
+    def delta(self, since: int) -> Dict:
+        """get the pages after a version, the pages are sorted by version so this is a binary search
+
+        Args:
+            since (int): the last version the book has
+
+        Returns:
+            Dict: the current version, the new pages and the left pages
+        """
+        with self._lock:
+            low, high = 0, len(self.pages)
+            while low < high:
+                middle = (low + high) // 2
+                if self.pages[middle]['version'] <= since:
+                    low = middle + 1
+                else:
+                    high = middle
+            return {'version': self.version, 'pages': self.pages[low:], 'left_pages': dict(self.left_pages)}
+
+    def prune(self, max_pages: int = RENDER_SERVER_MAX_PAGES, max_age: float = DAY_IN_SECONDS) -> int:
+        """drop the oldest pages past the max pages or the max age from the manifest and delete their frames.
+           The books that have not downloaded a dropped page skip it
+
+        Returns:
+            int: number of pages dropped
+        """
+        oldest = time() - max_age
+        with self._lock:
+            count = max(len(self.pages) - max_pages, 0)
+            while count < len(self.pages) and self.pages[count]['time'] < oldest:
+                count += 1
+            if count == 0:
+                return 0
+            dropped, self.pages = self.pages[:count], self.pages[count:]
+            self._save()
+        for entry in dropped:
+            (self.frames_path / entry['id']).unlink(missing_ok=True)
+        metrics.inc('render_server.pages_pruned', count)
+        return count
+
+    def get_protected_frames(self) -> List[Path]:
+        """the frames in the manifest, the retention never deletes them
+        """
+        with self._lock:
+            return [self.frames_path / entry['id'] for entry in self.pages + list(self.left_pages.values())]
+
+    def get_frame(self, frame_id: str) -> Optional[Tuple[str, bytes]]:
+        """get a frame in the manifest with its etag
+
+        Returns:
+            Optional[Tuple[str, bytes]]: etag and bytes of the frame, None if there is no such frame
+        """
+        with self._lock:
+            published = any(entry['id'] == frame_id for entry in self.pages + list(self.left_pages.values()))
+        frame_path = self.frames_path / frame_id
+        if not published or not frame_path.is_file():
+            return None
+        data = frame_path.read_bytes()
+        return make_etag(data), data
+
+
+class FrameRequestHandler(BaseHTTPRequestHandler):
+    """GET /manifest?since=<version> and GET /frames/<id>, both answer 304 when the If-None-Match etag matches
+    """
+    manifest: FrameManifest = None
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path == '/manifest':
+            since = int(parse_qs(url.query).get('since', ['0'])[0])
+            data = json.dumps(self.manifest.delta(since)).encode('utf-8')
+            self._send(make_etag(data), data, 'application/json')
+        elif url.path.startswith('/frames/'):
+            frame = self.manifest.get_frame(url.path[len('/frames/'):])
+            if frame is None:
+                self.send_error(404)
+                return
+            self._send(*frame, 'image/jpeg')
+        else:
+            self.send_error(404)
+
+    def _send(self, etag: str, data: bytes, content_type: str) -> None:
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            metrics.inc('render_server.not_modified')
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        metrics.inc('render_server.bytes_sent', len(data))
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format % args)
+
+
+class RenderServer:
+    """Scrape and render the pages centrally and serve the frames over http
+    """
+    def __init__(self, social_media_scraper, host: str = RENDER_SERVER_HOST, port: int = RENDER_SERVER_PORT,
+                 manifest: Optional[FrameManifest] = None) -> None:
+        self.social_media_scraper = social_media_scraper
+        self.manifest = manifest or FrameManifest()
+        handler = type('Handler', (FrameRequestHandler,), {'manifest': self.manifest})
+        self.http_server = ThreadingHTTPServer((host, port), handler)
+        self.logger = getLogger('RenderServer')
+
+    @property
+    def url(self) -> str:
+        host, port = self.http_server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> None:
+        """serve the frames in a background thread
+        """
+        Thread(target=self.http_server.serve_forever, name='render_server', daemon=True).start()
+        self.logger.info(f'serving frames on {self.url}')
+
+    def stop(self) -> None:
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+    def check_update(self) -> None:
+        """create pages for the updates from the followings and publish them
+        """
+        updates = self.social_media_scraper.get_new_photos_from_followings()
+        if len(updates) != 0:
+            # named after the version, the number of pages goes down when they are pruned
+            for page in content.iter_pages(updates, self.manifest.version):
+                self.manifest.publish_page(page)
+            self.manifest.publish_left_page('left_notify', content.create_page_left_notify())
+
+    def run(self, fetch: bool) -> None:
+        """main loop of the server, the same schedule as eink_main without the screens
+
+        Args:
+            fetch (bool): scrape the followings every hour
+        """
+        news = content.NewsClient()
+        fetch_time = 0
+        start_time = 0
+        while True:
+            if time() - start_time > 60:
+                self.manifest.publish_left_page('left_home', content.create_page_left_home(news))
+                start_time = time()
+
+            if fetch and time() - fetch_time > 60*60:
+                network.scrape_followings(self.social_media_scraper)
+                fetch_time = time()
+            self.check_update()
+            sleep(30)
+
+
+class RenderClient:
+    """Download the frames from a render server, only new pages and frames that changed are downloaded.
+       A page never changes once published, so the pages are only known by the version,
+       the etags are kept for the left pages
+    """
+    def __init__(self, base_url: str, state_path: Path = render_client_state_path, timeout: float = 10,
+                 pages_path: Path = saved_right_pages_path) -> None:
+        self.base_url = base_url.rstrip('/')
+        self.state_path = state_path
+        self.timeout = timeout
+        self.pages_path = pages_path
+        self.version = 0
+        self.etags: Dict[str, str] = {}
+        self._manifest_cache: Tuple[Optional[str], Optional[str], Optional[Dict]] = (None, None, None)
+        if state_path.exists():
+            state = json.loads(state_path.read_text())
+            self.version = state['version']
+            self.etags = state['etags']
+
+    def _save_state(self) -> None:
+        temp_path = self.state_path.with_suffix('.tmp')
+        temp_path.write_text(json.dumps({'version': self.version, 'etags': self.etags}))
+        os.replace(temp_path, self.state_path)
+
+    def _get(self, path: str, etag: Optional[str] = None) -> Tuple[Optional[str], Optional[bytes]]:
+        """conditional GET
+
+        Returns:
+            Tuple[Optional[str], Optional[bytes]]: etag and body of the response, body is None if not modified
+        """
+        request = urllib.request.Request(f'{self.base_url}{path}')
+        if etag is not None:
+            request.add_header('If-None-Match', etag)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                data = response.read()
+                metrics.inc('render_client.bytes_received', len(data))
+                return response.headers.get('ETag'), data
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                metrics.inc('render_client.not_modified')
+                return etag, None
+            raise
+
+    def _download(self, entry: Dict, file_path: Path) -> Optional[Path]:
+        """download a frame unless the local copy has the same etag
+        """
+        etag = self.etags.get(entry['id']) if file_path.exists() else None
+        if etag == entry['etag']:
+            return None
+        etag, data = self._get(f'/frames/{entry["id"]}', etag)
+        if data is None:
+            return None
+        self._write(file_path, data)
+        self.etags[entry['id']] = etag
+        return file_path
+
+    @staticmethod
+    def _write(file_path: Path, data: bytes) -> None:
+        temp_path = file_path.with_name(f'.{file_path.name}.tmp')
+        temp_path.write_bytes(data)
+        os.replace(temp_path, file_path)
+
+    def fetch_manifest(self) -> Dict:
+        """get the manifest after the last version, the cached one is used if the server answers not modified
+
+        Returns:
+            Dict: the current version, the new pages and the left pages
+        """
+        path = f'/manifest?since={self.version}'
+        cached_path, etag, manifest = self._manifest_cache
+        etag, data = self._get(path, etag if cached_path == path else None)
+        if data is not None:
+            manifest = json.loads(data)
+            self._manifest_cache = (path, etag, manifest)
+        return manifest
+
+    def fetch_new_pages(self, exist_num_pages: int) -> List[Path]:
+        """download the pages published after the last fetch, they are named like the pages rendered by the book,
+           so they are ordered and renamed with them when the book loads its pages
+
+        Args:
+            exist_num_pages (int): the number of pages the book has created, the new pages are named after it
+
+        Returns:
+            List[Path]: the new pages, in the order they were published
+        """
+        new_pages = []
+        for entry in self.fetch_manifest()['pages']:
+            try:
+                _, data = self._get(f'/frames/{entry["id"]}')
+            except urllib.error.HTTPError as e:
+                if e.code != 404:
+                    raise
+                # pruned by the server since the manifest was sent
+                logger.info(f'skip the page {entry["id"]}, it is not on the server anymore')
+                data = None
+            if data is not None:
+                page_path = self.pages_path / f'right_page_{exist_num_pages + len(new_pages) + 1}.jpg'
+                self._write(page_path, data)
+                new_pages.append(page_path)
+            self.version = entry['version']
+        self._save_state()
+        metrics.inc('render_client.pages_downloaded', len(new_pages))
+        return new_pages
+
+    def fetch_left_page(self, name: str, file_path: Path) -> Optional[Path]:
+        """download a left page if it changed since the last download
+
+        Args:
+            name (str): left_home or left_notify
+            file_path (Path): where the page is saved
+
+        Returns:
+            Optional[Path]: the downloaded page, None if it is not changed or not published
+        """
+        entry = self.fetch_manifest()['left_pages'].get(name)
+        if entry is None:
+            return None
+        page_path = self._download(entry, file_path)
+        self._save_state()
+        return page_path
@@ -0,0 +1,209 @@
+# Keep the media folders within their disk and age budgets
+import json
+import os
+from logging import getLogger
+from pathlib import Path
+from threading import Event, Lock, Thread
+from time import sleep, time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import following_index
+import metrics
+from constants import *
+
+logger = getLogger(__name__)
+
+
+class AgeLedger:
+    """Remember when each file was first seen, keyed by its inode so renaming a page does not renew its age
+    """
+    def __init__(self, ledger_path: Path = retention_ledger_path) -> None:
+        self.ledger_path = ledger_path
+        self._lock = Lock()
+        self._first_seen: Dict[str, float] = {}
+        if ledger_path.exists():
+            try:
+                self._first_seen = json.loads(ledger_path.read_text())
+            except (OSError, ValueError) as e:
+                logger.error(f'cannot load retention ledger: {e}')
+
+    @staticmethod
+    def _file_id(stat: os.stat_result) -> str:
+        return f'{stat.st_dev}:{stat.st_ino}'
+
+    def first_seen(self, file_path: Path, stat: Optional[os.stat_result] = None) -> float:
+        """get the time the file was first seen, record it now if it is new
+
+        Args:
+            file_path (Path): any file in the media folders
+            stat (Optional[os.stat_result], optional): stat of the file if it is already known
+
+        Returns:
+            float: timestamp of the first time the file was seen
+        """
+        stat = stat or file_path.stat()
+        file_id = self._file_id(stat)
+        with self._lock:
+            if file_id not in self._first_seen:
+                self._first_seen[file_id] = min(stat.st_mtime, time())
+            return self._first_seen[file_id]
+
+    def age(self, file_path: Path) -> float:
+        """get the age of a file in seconds
+        """
+        return time() - self.first_seen(file_path)
+
+    def forget(self, stat: os.stat_result) -> None:
+        """remove a deleted file from the ledger
+        """
+        with self._lock:
+            self._first_seen.pop(self._file_id(stat), None)
+
+    def prune(self, alive_stats: Iterable[os.stat_result]) -> None:
+        """drop the entries of files that are not alive anymore, so a reused inode starts fresh
+
+        Args:
+            alive_stats (Iterable[os.stat_result]): stats of all the files still on disk
+        """
+        alive = {self._file_id(stat) for stat in alive_stats}
+        with self._lock:
+            self._first_seen = {file_id: seen for file_id, seen in self._first_seen.items() if file_id in alive}
+
+    def save(self) -> None:
+        """write the ledger to disk atomically
+        """
+        with self._lock:
+            data = json.dumps(self._first_seen)
+        temp_path = self.ledger_path.with_suffix('.tmp')
+        temp_path.write_text(data)
+        os.replace(temp_path, self.ledger_path)
+
+
+age_ledger = AgeLedger()
+
+
+class RetentionService:
+    """A background service deleting the oldest files of each media folder once it is over its byte or age budget.
+       Files returned by the protected callback, e.g. the pages in the book, are never deleted
+    """
+    def __init__(self, protected: Callable[[], Iterable[Path]], budgets: List[RetentionBudget] = RETENTION_BUDGETS,
+                 interval: float = RETENTION_INTERVAL, ledger: AgeLedger = age_ledger,
+                 before_collect: Optional[Callable[[], object]] = None) -> None:
+        """
+        Args:
+            protected (Callable[[], Iterable[Path]]): the files that are never deleted
+            before_collect (Optional[Callable[[], object]], optional): called first on every collect,
+                e.g. to drop the expired pages from the book so they are not protected anymore
+        """
+        self.protected = protected
+        self.before_collect = before_collect
+        self.budgets = budgets
+        self.interval = interval
+        self.ledger = ledger
+        self._stop = Event()
+        self._thread = Thread(target=self._run, name='retention', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.collect()
+            except Exception as e:
+                logger.error(e)
+            self._stop.wait(self.interval)
+
+    def _protected_paths(self) -> Set[Path]:
+        return {Path(path).resolve() for path in self.protected() if path is not None}
+
+    def _select_victims(self, budget: RetentionBudget, protected: Set[Path]) -> Tuple[List[Tuple[Path, os.stat_result]], int]:
+        """find the files that have to be deleted to bring a folder within its budget, oldest first
+
+        Returns:
+            Tuple[List[Tuple[Path, os.stat_result]], int]: files to delete with their stat, total bytes of the folder
+        """
+        files = []
+        for file_path in budget.path.glob(budget.pattern):
+            try:
+                stat = file_path.stat()
+            except FileNotFoundError:
+                continue
+            if file_path.is_file() and file_path.name not in budget.exclude:
+                files.append((self.ledger.first_seen(file_path, stat), file_path, stat))
+        files.sort(key=lambda file: file[0])
+
+        total_bytes = sum(stat.st_size for _, _, stat in files)
+        remaining_bytes = total_bytes
+        now = time()
+        victims = []
+        for seen, file_path, stat in files:
+            if remaining_bytes <= budget.max_bytes and now - seen <= budget.max_age:
+                # the rest are newer and the folder is within budget
+                break
+            if file_path.resolve() in protected:
+                continue
+            victims.append((file_path, stat))
+            remaining_bytes -= stat.st_size
+        return victims, total_bytes
+
+    def remove_orphan_profile_photos(self, protected: Set[Path]) -> int:
+        """delete the profile photos of followings that have no photos left
+
+        Args:
+            protected (Set[Path]): the resolved protected files
+
+        Returns:
+            int: number of bytes reclaimed
+        """
+        reclaimed_bytes = 0
+        for profile_path in scraped_media_path.glob('*/profile_photo.jpg'):
+            has_photos = any(path != profile_path for path in profile_path.parent.glob('*.jpg'))
+            if not has_photos and profile_path.resolve() not in protected:
+                reclaimed_bytes += profile_path.stat().st_size
+                profile_path.unlink(missing_ok=True)
+                following_index.remove_file(profile_path)
+                metrics.inc('retention.files_deleted')
+        return reclaimed_bytes
+
+    def collect(self) -> int:
+        """delete files over the budgets in batches
+
+        Returns:
+            int: number of bytes reclaimed
+        """
+        if self.before_collect is not None:
+            self.before_collect()
+        reclaimed_bytes = 0
+        alive_stats = []
+        for budget in self.budgets:
+            if not budget.path.exists():
+                continue
+            victims, total_bytes = self._select_victims(budget, self._protected_paths())
+            metrics.set_gauge(f'retention.{budget.path.name}.bytes', total_bytes)
+
+            for start in range(0, len(victims), RETENTION_BATCH_SIZE):
+                # check the protected files again, the book may have changed between batches
+                protected = self._protected_paths()
+                for file_path, stat in victims[start:start + RETENTION_BATCH_SIZE]:
+                    if file_path.resolve() in protected:
+                        continue
+                    file_path.unlink(missing_ok=True)
+                    following_index.remove_file(file_path)
+                    self.ledger.forget(stat)
+                    reclaimed_bytes += stat.st_size
+                    metrics.inc('retention.files_deleted')
+                sleep(RETENTION_BATCH_PAUSE)
+
+            alive_stats.extend(path.stat() for path in budget.path.glob(budget.pattern) if path.is_file())
+
+        reclaimed_bytes += self.remove_orphan_profile_photos(self._protected_paths())
+        self.ledger.prune(alive_stats)
+        self.ledger.save()
+        metrics.inc('retention.reclaimed_bytes', reclaimed_bytes)
+        if reclaimed_bytes:
+            logger.info(f'reclaimed {reclaimed_bytes / 1024 / 1024:.1f} MB')
+        return reclaimed_bytes
@@ -0,0 +1,253 @@
+# Scrape in a supervised worker process, so the main loop keeps its clock and its updates while scraping
+import os
+import queue
+from itertools import count
+from logging import getLogger
+from multiprocessing import get_context
+from pathlib import Path
+from threading import Event, Lock, Thread
+from time import monotonic, time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import metrics
+import network
+from constants import *
+
+logger = getLogger(__name__)
+
+ScrapeResult = NamedTuple('ScrapeResult', [('outcome', str), ('seconds', float), ('photos', int), ('error', Optional[str])])
+
+
+class NewPhotoCounter:
+    """Count the photos downloaded since the start of a scrape, the progress of the scrape.
+       Only the folders of the followings changed since the last count are listed again
+    """
+    def __init__(self, since: float, media_path: Path = scraped_media_path) -> None:
+        self.since = since
+        self.media_path = media_path
+        self._counts: Dict[str, int] = {}
+        self._mtimes: Dict[str, int] = {}
+        self._last_count = 0.0
+        # counted by the heartbeat thread and at the end of the scrape
+        self._lock = Lock()
+
+    def _count_folder(self, folder: str) -> int:
+        total = 0
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                try:
+                    if entry.name.endswith('.jpg') and entry.stat().st_mtime >= self.since:
+                        total += 1
+                except OSError:
+                    pass
+        return total
+
+    def count(self) -> int:
+        """
+        Returns:
+            int: the photos downloaded since the start
+        """
+        with self._lock:
+            try:
+                with os.scandir(self.media_path) as entries:
+                    folders = [entry for entry in entries if entry.is_dir()]
+            except OSError:
+                return sum(self._counts.values())
+            count_time = time()
+            for folder in folders:
+                try:
+                    mtime = folder.stat().st_mtime_ns
+                    # a photo added to a folder changes its mtime, unless it is added within the same
+                    # clock tick as the last count, so the folders changed around the last count are listed again
+                    if self._mtimes.get(folder.path) != mtime or mtime / 1e9 >= self._last_count - 1:
+                        self._mtimes[folder.path] = mtime
+                        self._counts[folder.path] = self._count_folder(folder.path)
+                except OSError:
+                    pass
+            self._last_count = count_time
+            return sum(self._counts.values())
+
+
+def _report_progress(request_id: int, counter: NewPhotoCounter, events, stop: Event) -> None:
+    while not stop.wait(SCRAPE_HEARTBEAT_INTERVAL):
+        events.put(('progress', request_id, counter.count(), None))
+
+
+def _worker_main(scraper_factory: Callable, requests, events) -> None:
+    """main function of the scrape process, the scraper logs in once and scrapes on every request
+    """
+    scraper = scraper_factory()
+    while True:
+        request_id = requests.get()
+        if request_id is None:
+            break
+        counter = NewPhotoCounter(time())
+        stop = Event()
+        Thread(target=_report_progress, args=(request_id, counter, events, stop), daemon=True).start()
+        try:
+            scraper.scrape()
+            events.put(('finished', request_id, counter.count(), None))
+        except Exception as e:
+            events.put(('failed', request_id, counter.count(), str(e)))
+        finally:
+            stop.set()
+    if hasattr(scraper, 'logout'):
+        scraper.logout()
+
+
+class ScrapeSupervisor:
+    """Run the scrapes in a worker process and watch it. A scrape longer than the timeout, or without
+       progress events for the heartbeat timeout, kills the worker, which is started again on the next request.
+       Failures back off through the circuit breaker of the scraper. The results are taken by the main loop
+    """
+    def __init__(self, scraper_factory: Callable, timeout: float = SCRAPE_TIMEOUT,
+                 heartbeat_timeout: float = SCRAPE_HEARTBEAT_TIMEOUT) -> None:
+        """
+        Args:
+            scraper_factory (Callable): creates the scraper in the worker, e.g. a partial of SocialMediaScraper
+            timeout (float, optional): seconds a scrape may take
+            heartbeat_timeout (float, optional): seconds without a progress event before the worker is hung
+        """
+        self.scraper_factory = scraper_factory
+        self.timeout = timeout
+        self.heartbeat_timeout = heartbeat_timeout
+        self._context = get_context('spawn')
+        self._process = None
+        self._requests = None
+        self._events = None
+        self._request_ids = count(1)
+        self._running: Optional[int] = None
+        self._started_at = 0.0
+        self._last_event = 0.0
+        self._photos = 0
+        self._results: queue.SimpleQueue = queue.SimpleQueue()
+        self._lock = Lock()
+        self._breaker = network.get_breaker('scraper')
+
+    def start(self) -> None:
+        Thread(target=self._supervise, name='scrape_supervisor', daemon=True).start()
+
+    def _start_process(self) -> None:
+        # new queues for every worker, a killed worker can leave a queue broken
+        self._requests = self._context.Queue()
+        self._events = self._context.Queue()
+        self._process = self._context.Process(target=_worker_main, name='scrape_process',
+                                              args=(self.scraper_factory, self._requests, self._events), daemon=True)
+        self._process.start()
+        metrics.inc('scrape.worker_starts')
+
+    def is_running(self) -> bool:
+        with self._lock:
+            return self._running is not None
+
+    def request(self) -> bool:
+        """start a scrape unless one is running or the scraper is backing off after failures, returns at once
+
+        Returns:
+            bool: a scrape is started
+        """
+        with self._lock:
+            if self._running is not None:
+                metrics.inc('scrape.requests_ignored')
+                return False
+            if not self._breaker.acquire():
+                metrics.inc('network.scraper.short_circuited')
+                return False
+            if self._process is None or not self._process.is_alive():
+                self._start_process()
+            self._running = next(self._request_ids)
+            self._started_at = self._last_event = monotonic()
+            self._photos = 0
+            self._requests.put(self._running)
+        metrics.set_gauge('scrape.running', 1)
+        logger.info('scrape started in the worker')
+        return True
+
+    def take_results(self) -> List[ScrapeResult]:
+        """get the scrapes finished since the last call, without waiting
+        """
+        results = []
+        while True:
+            try:
+                results.append(self._results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def _supervise(self) -> None:
+        while True:
+            events = self._events
+            try:
+                if events is None:
+                    raise queue.Empty
+                kind, request_id, photos, error = events.get(timeout=1)
+            except (queue.Empty, OSError, EOFError):
+                self._check_worker()
+                continue
+
+            with self._lock:
+                if request_id != self._running:
+                    # from a scrape that was given up
+                    continue
+                self._last_event = monotonic()
+                self._photos = photos
+            metrics.set_gauge('scrape.photos', photos)
+            if kind == 'finished':
+                self._finish('ok')
+            elif kind == 'failed':
+                self._finish('failed', error)
+
+    def _check_worker(self) -> None:
+        with self._lock:
+            if self._running is None:
+                return
+            now = monotonic()
+            if not self._process.is_alive():
+                outcome = 'crashed'
+            elif now - self._started_at > self.timeout:
+                outcome = 'timeout'
+            elif now - self._last_event > self.heartbeat_timeout:
+                outcome = 'hung'
+            else:
+                return
+        if outcome != 'crashed':
+            self._kill()
+        reason = {'crashed': 'the scrape process exited', 'timeout': 'the scrape took too long',
+                  'hung': 'the scrape process stopped reporting its progress'}[outcome]
+        self._finish(outcome, f'{reason} after {now - self._started_at:.0f}s')
+
+    def _kill(self) -> None:
+        process = self._process
+        logger.warning('killing the scrape process')
+        process.terminate()
+        process.join(5)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        metrics.inc('scrape.worker_kills')
+
+    def _finish(self, outcome: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            seconds = monotonic() - self._started_at
+            result = ScrapeResult(outcome, seconds, self._photos, error)
+            self._running = None
+        self._breaker.release(outcome == 'ok')
+        metrics.inc(f'scrape.{outcome}')
+        metrics.observe('scrape.seconds', seconds)
+        metrics.set_gauge('scrape.running', 0)
+        if error is not None:
+            logger.error(f'scrape {outcome}: {error}')
+        logger.info(f'scrape {outcome} in {seconds:.0f}s with {result.photos} new photos')
+        self._results.put(result)
+
+    def stop(self) -> None:
+        """stop the worker, which logs the scraper out
+        """
+        process = self._process
+        if process is None:
+            return
+        if process.is_alive():
+            self._requests.put(None)
+            process.join(10)
+            if process.is_alive():
+                process.terminate()
+        self._process = None
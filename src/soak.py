@@ -0,0 +1,231 @@
+# Run the eink book loop for simulated weeks with fake devices and fail if a resource keeps growing:
+# python soak.py --days 14 --speed 1000, from a scratch folder with media/templates and the font, as it writes to media/
+import time as time_module  # isort:skip
+import threading  # isort:skip
+
+
+class VirtualClock:
+    """A simulated time for time() and sleep(). A sleep of the loop thread moves the time at once
+       and waits speed times shorter in real time, so the background threads still get to run.
+       Installed into the time module before the book modules import time and sleep from it
+    """
+    def __init__(self, speed: float = 1000.0) -> None:
+        self.speed = speed
+        self._now = time_module.time()
+        self._real_sleep = time_module.sleep
+        self._owner = threading.get_ident()
+
+    def time(self) -> float:
+        return self._now
+
+    def sleep(self, seconds: float) -> None:
+        self._real_sleep(seconds / self.speed)
+        if threading.get_ident() == self._owner:
+            self._now += seconds
+
+    def install(self) -> None:
+        time_module.time = self.time
+        time_module.sleep = self.sleep
+
+
+clock = VirtualClock()
+clock.install()
+
+import json  # noqa: E402
+import logging  # noqa: E402
+from argparse import ArgumentParser  # noqa: E402
+from logging import getLogger  # noqa: E402
+from pathlib import Path  # noqa: E402
+from statistics import median  # noqa: E402
+from typing import Dict, List, Optional  # noqa: E402
+
+from PIL import Image  # noqa: E402
+
+import memory  # noqa: E402
+from book import run_eink_loop  # noqa: E402
+from constants import *  # noqa: E402
+from content import create_page_left_notify  # noqa: E402
+from fake_devices import FakeNewsClient, FakeScraper, fake_create_pages  # noqa: E402
+from frame_store import frame_writer  # noqa: E402
+from retention import RetentionService  # noqa: E402
+from trace_replay import ReplayBook  # noqa: E402
+
+logger = getLogger(__name__)
+
+HOUR_IN_SECONDS = 60 * 60
+SOAK_READ_INTERVAL = 10 * 60
+# metric: (growth allowed on top of the tolerance, is a rate of a counter)
+SOAK_METRICS = {
+    'rss_mb': (8, False),
+    'open_fds': (4, False),
+    'threads': (2, False),
+    'budget_mb': (8, False),
+    'pages_in_book': (2, False),
+    'page_batches_queued': (2, False),
+    'frames_to_write': (2, False),
+    'disk_pages_mb': (1, False),
+    'disk_news_mb': (1, False),
+    'disk_followings_mb': (1, False),
+    'disk_cache_mb': (1, False),
+    'left_refreshes': (2, True),
+    'right_refreshes': (2, True),
+}
+
+
+class SoakScraper(FakeScraper):
+    """Download a few fake photos of the followings on every scrape
+    """
+    def __init__(self, photos_per_scrape: int = 3) -> None:
+        super().__init__()
+        self.photos_per_scrape = photos_per_scrape
+        self.photo_count = 0
+
+    def scrape(self) -> None:
+        super().scrape()
+        for _ in range(self.photos_per_scrape):
+            following = Following(f'following_{self.photo_count % 4}', 'friend')
+            photo_path = scraped_media_path / following.name / f'2021-01-01_00-00-00_UTC_{self.photo_count:08d}.jpg'
+            photo_path.parent.mkdir(parents=True, exist_ok=True)
+            Image.new('RGB', (640, 640), (0x80, 0x80, 0x80)).save(photo_path)
+            self.photo_count += 1
+            self.add_updates([Update(following, photo_path)])
+
+
+class SoakBook(ReplayBook):
+    """A book with fake displays and fake pages, but the left pages and the page streaming of the real book
+    """
+    def __init__(self) -> None:
+        super().__init__(fake_render=True)
+        self.stream_pages = True
+        self.fetch = True
+        self.social_media_scraper = SoakScraper()
+
+    def iter_pages(self, updates: List[Update]):
+        return iter(fake_create_pages(updates, self.get_current_book_len()))
+
+    def create_notify_page(self) -> Frame:
+        return create_page_left_notify()
+
+
+def folder_mb(path: Path) -> float:
+    total = 0
+    for file_path in path.rglob('*'):
+        try:
+            total += file_path.stat().st_size
+        except OSError:
+            pass
+    return total / 1024 / 1024
+
+
+def sample(book: SoakBook, start_time: float) -> Dict[str, float]:
+    """measure the resources of the process and the book
+    """
+    return {
+        'hour': (clock.time() - start_time) / HOUR_IN_SECONDS,
+        'rss_mb': memory.get_rss_bytes() / 1024 / 1024,
+        'open_fds': memory.count_open_files(),
+        'threads': threading.active_count(),
+        'budget_mb': memory.budget.total() / 1024 / 1024,
+        'pages_in_book': len(book.right_page_list),
+        'page_batches_queued': book._page_batches.qsize(),
+        'frames_to_write': frame_writer.pending(),
+        'disk_pages_mb': folder_mb(saved_pages_path),
+        'disk_news_mb': folder_mb(saved_news_image_path),
+        'disk_followings_mb': folder_mb(scraped_media_path),
+        'disk_cache_mb': folder_mb(cache_path),
+        'left_refreshes': book.left_display.refresh_count,
+        'right_refreshes': book.right_display.refresh_count,
+    }
+
+
+def find_growth(samples: List[Dict[str, float]], tolerance: float) -> Dict[str, List[float]]:
+    """find the metrics that keep growing: the median of every simulated day after the first
+       is at least the one of the day before, the last day is over the tolerance above the second day
+       and still above the day before, so a cache filling up to its budget is not growing
+
+    Args:
+        samples (List[Dict[str, float]]): hourly samples
+        tolerance (float): relative growth allowed, e.g. 0.1 for 10%
+
+    Returns:
+        Dict[str, List[float]]: the daily medians of the growing metrics
+    """
+    days: Dict[int, List[Dict[str, float]]] = {}
+    for previous, current in zip(samples, samples[1:]):
+        days.setdefault(int(current['hour'] // 24), []).append({
+            name: current[name] - previous[name] if is_rate else current[name]
+            for name, (_, is_rate) in SOAK_METRICS.items()})
+
+    # the first day is the warm up, e.g. the caches filling
+    daily = [days[day] for day in sorted(days)[1:] if len(days[day]) >= 12]
+    growing = {}
+    for name, (slack, _) in SOAK_METRICS.items():
+        medians = [median(hour[name] for hour in day) for day in daily]
+        if len(medians) < 2:
+            continue
+        never_decreasing = all(later >= earlier for earlier, later in zip(medians, medians[1:]))
+        still_growing = medians[-1] > medians[-2]
+        if never_decreasing and still_growing and medians[-1] > medians[0] * (1 + tolerance) + slack:
+            growing[name] = [round(value, 2) for value in medians]
+    return growing
+
+
+def soak(days: float, tolerance: float, output_path: Optional[Path] = None) -> Dict[str, List[float]]:
+    """run the book loop for the simulated days with retention every RETENTION_INTERVAL
+
+    Returns:
+        Dict[str, List[float]]: the daily medians of the metrics that keep growing
+    """
+    create_media_dirs()
+    start_time = clock.time()
+    end_time = start_time + days * 24 * HOUR_IN_SECONDS
+    book = SoakBook()
+    retention = RetentionService(book.get_protected_pages, before_collect=book.expire_pages)
+    samples: List[Dict[str, float]] = []
+    next_sample = start_time
+    next_retention = start_time
+    next_read = start_time
+
+    def should_stop() -> bool:
+        nonlocal next_sample, next_retention, next_read
+        now = clock.time()
+        if now >= next_read:
+            # someone reads a page every few minutes, without the navigator as it waits in real time
+            if book.has_next_page():
+                book.next_page()
+            next_read = now + SOAK_READ_INTERVAL
+        if now >= next_retention:
+            retention.collect()
+            next_retention = now + RETENTION_INTERVAL
+        if now >= next_sample:
+            samples.append(sample(book, start_time))
+            if output_path is not None:
+                with output_path.open('a') as file:
+                    file.write(json.dumps(samples[-1]) + '\n')
+            if len(samples) % 24 == 0:
+                logger.warning(f'day {len(samples) // 24}: ' + ', '.join(f'{name}={value:.1f}' for name, value in samples[-1].items()))
+            next_sample = now + HOUR_IN_SECONDS
+        return now >= end_time
+
+    run_eink_loop(book, news_factory=FakeNewsClient, should_stop=should_stop)
+    return find_growth(samples, tolerance)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--days', help='simulated days', type=float, default=14)
+    parser.add_argument('--speed', help='simulated seconds per real second while the loop sleeps', type=float, default=1000)
+    parser.add_argument('--tolerance', help='relative growth allowed between the second and the last day', type=float, default=0.1)
+    parser.add_argument('--output', help='append the hourly samples to this jsonl file', default=None)
+    args = parser.parse_args()
+    if args.speed < 1:
+        parser.error('--speed must be at least 1')
+
+    logging.basicConfig(level=logging.WARNING)
+    clock.speed = args.speed
+    growing = soak(args.days, args.tolerance, Path(args.output) if args.output else None)
+    for name, medians in growing.items():
+        print(f'GROWING {name}: daily medians {medians}')
+    if growing:
+        raise SystemExit(1)
+    print('no metric keeps growing')
@@ -0,0 +1,40 @@
+# Time the startup and run the slow initialization after the first frame is shown
+from concurrent.futures import Future, ThreadPoolExecutor
+from logging import getLogger
+from time import perf_counter
+from typing import Callable
+
+import metrics
+
+logger = getLogger(__name__)
+
+# imported first by main, so this is close to the start of the process
+process_start = perf_counter()
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='startup')
+
+
+def mark(stage: str) -> float:
+    """record the time from the start of the process to a stage of the startup
+
+    Args:
+        stage (str): name of the stage, e.g. imports or first_frame
+
+    Returns:
+        float: seconds since the start of the process
+    """
+    seconds = perf_counter() - process_start
+    metrics.set_gauge(f'startup.{stage}_seconds', seconds)
+    logger.info(f'startup {stage}: {seconds:.2f}s')
+    return seconds
+
+
+def run_in_background(function: Callable, *args) -> Future:
+    """run a slow initialization, e.g. creating the news client, without delaying the first frame
+
+    Args:
+        function (Callable): the function to run
+
+    Returns:
+        Future: the result of the function
+    """
+    return _executor.submit(function, *args)
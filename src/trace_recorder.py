@@ -0,0 +1,83 @@
+# Record the button events, scraper results and scheduler ticks of a running book, for trace_replay.py
+import json
+from logging import getLogger
+from pathlib import Path
+from threading import Lock
+from time import monotonic
+from typing import Dict, List, Optional
+
+from constants import *
+
+logger = getLogger(__name__)
+
+
+class TraceRecorder:
+    """Append one json line per event, with the seconds since the recording started
+    """
+    def __init__(self, trace_path: Path) -> None:
+        self.trace_path = trace_path
+        self._file = trace_path.open('a', encoding='utf-8')
+        self._start_time = monotonic()
+        self._lock = Lock()
+
+    def record(self, kind: str, **data) -> None:
+        line = json.dumps({'t': round(monotonic() - self._start_time, 4), 'kind': kind, 'data': data}, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+_recorder: Optional[TraceRecorder] = None
+
+
+def start_recording(trace_path: Path) -> None:
+    """record all the events of this process to the trace file
+
+    Args:
+        trace_path (Path): a jsonl file, appended if it exists
+    """
+    global _recorder
+    _recorder = TraceRecorder(trace_path)
+    logger.info(f'recording trace to {trace_path}')
+
+
+def stop_recording(state: Optional[Dict] = None) -> None:
+    """stop recording, the final state of the book is recorded for checking a replay
+
+    Args:
+        state (Optional[Dict], optional): the state of the book from Book.get_state
+    """
+    global _recorder
+    if _recorder is not None:
+        if state is not None:
+            _recorder.record('state', **state)
+        _recorder.close()
+        _recorder = None
+
+
+def record(kind: str, **data) -> None:
+    """record an event, does nothing when not recording
+
+    Args:
+        kind (str): button, updates, tick or state
+    """
+    if _recorder is not None:
+        _recorder.record(kind, **data)
+
+
+def record_updates(updates: List[Update]) -> None:
+    """record the updates returned by the scraper
+    """
+    if _recorder is not None and len(updates) != 0:
+        _recorder.record('updates', updates=[[update.following.name, update.following.relationship, str(update.path)]
+                                             for update in updates])
+
+
+def load_updates(data: List[List[str]]) -> List[Update]:
+    """convert the updates of a trace back to Update
+    """
+    return [Update(Following(name, relationship), Path(path)) for name, relationship, path in data]
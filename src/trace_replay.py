@@ -0,0 +1,175 @@
+# Replay a trace recorded with main.py --record against fake displays: python trace_replay.py <trace> [--fast]
+import json
+import logging
+from argparse import ArgumentParser
+from logging import getLogger
+from multiprocessing import Queue
+from pathlib import Path
+from time import monotonic, sleep
+from typing import Dict, Iterator, List, Optional
+
+from PIL import Image
+
+import content
+import trace_recorder
+from book import Book
+from constants import *
+from fake_devices import FakeDisplay, FakeScraper, fake_create_pages
+
+logger = getLogger(__name__)
+
+
+class ReplayBook(Book):
+    """A Book with fake displays and no GPIO, the events are given by the replay instead of the buttons
+    """
+    def __init__(self, fake_render: bool = False) -> None:
+        self.fake_render = fake_render
+        super().__init__(Queue(maxsize=1), demo=False, social_media_scraper=FakeScraper(), fetch=False)
+        # pages are created in the replay thread, so the final state does not depend on timing
+        self.stream_pages = False
+        self.add_left_home_page(Image.new('L', EINK_SCREEN_SIZE, 0xFF))
+
+    def set_display(self) -> None:
+        self.left_display = FakeDisplay(name='left')
+        self.right_display = FakeDisplay(name='right')
+
+    def set_gpio(self) -> None:
+        pass
+
+    def __del__(self):
+        pass
+
+    def iter_pages(self, updates: List[Update]) -> Iterator[Path]:
+        if self.fake_render:
+            return iter(fake_create_pages(updates, self.get_current_book_len()))
+        return super().iter_pages(updates)
+
+    def create_notify_page(self) -> Frame:
+        if self.fake_render:
+            return Image.new('L', EINK_SCREEN_SIZE, 0xFF)
+        return super().create_notify_page()
+
+
+def load_trace(trace_path: Path) -> List[Dict]:
+    with trace_path.open(encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def dispatch(book: ReplayBook, event: Dict) -> None:
+    """feed one event of the trace to the book, the same way eink_main and check_user_option handle it.
+       A short press moves the navigator to the recorded target, the presses in a row are shown with
+       one refresh like on the device. The other events wait for the navigators, so the replay
+       does not depend on the timing of their threads
+    """
+    kind, data = event['kind'], event['data']
+    if kind == 'button' and not data['long']:
+        if 'target' in data:
+            book.move_to(data['target'])
+        else:
+            # traces recorded before the targets were recorded
+            book.press(1 if data['button'] == 'right' else -1)
+        return
+
+    book.wait_for_navigation()
+    if kind == 'button':
+        if data['button'] == 'left':
+            book.toggle_overview()
+        # a long press of the right button only asks for scraping, which is replayed by the updates and ticks
+
+    elif kind == 'updates':
+        book.social_media_scraper.add_updates(trace_recorder.load_updates(data['updates']))
+        book.check_update()
+
+    elif kind == 'tick':
+        if data['name'] == 'fetch':
+            book.social_media_scraper.scrape()
+        elif data['name'] == 'minute':
+            content.left_page_data_time_update()
+            if book.get_current_showing_status():
+                book.show_notify_page()
+            else:
+                book.show_left_home_page()
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def replay(trace_path: Path, speed: Optional[float] = None, fake_render: bool = False) -> Dict:
+    """replay a trace and report the latency of each kind of event and any divergence of the final state
+
+    Args:
+        trace_path (Path): a trace recorded with main.py --record
+        speed (Optional[float], optional): 1 for real speed, 10 for ten times faster, None for as fast as possible
+        fake_render (bool, optional): create blank pages instead of rendering with chrome
+
+    Returns:
+        Dict: latencies by kind of event, the final state and the divergence from the recorded state
+    """
+    events = load_trace(trace_path)
+    content.left_page_data_time_update()
+    book = ReplayBook(fake_render=fake_render)
+
+    latencies: Dict[str, List[float]] = {}
+    expected_state = None
+    start_time = monotonic()
+    for event in events:
+        if event['kind'] == 'state':
+            expected_state = event['data']
+            continue
+        if speed is not None:
+            wait = event['t'] / speed - (monotonic() - start_time)
+            if wait > 0:
+                sleep(wait)
+
+        event_start = monotonic()
+        dispatch(book, event)
+        latencies.setdefault(event['kind'], []).append(monotonic() - event_start)
+
+    book.wait_for_navigation()
+    state = book.get_state()
+    divergence = {}
+    if expected_state is not None:
+        divergence = {key: {'expected': value, 'replayed': state.get(key)}
+                      for key, value in expected_state.items() if state.get(key) != value}
+
+    report = {
+        'latency': {kind: {'count': len(values),
+                           'mean_ms': 1000 * sum(values) / len(values),
+                           'p95_ms': 1000 * percentile(values, 0.95),
+                           'max_ms': 1000 * max(values)}
+                    for kind, values in latencies.items()},
+        'refreshes': {'left': book.left_display.refresh_count, 'right': book.right_display.refresh_count},
+        'state': state,
+        'divergence': divergence,
+    }
+    return report
+
+
+def print_report(report: Dict) -> None:
+    for kind, latency in report['latency'].items():
+        print(f'{kind:<10} n={latency["count"]:<6} mean={latency["mean_ms"]:8.1f} ms '
+              f'p95={latency["p95_ms"]:8.1f} ms max={latency["max_ms"]:8.1f} ms')
+    print(f'refreshes: {report["refreshes"]}')
+    print(f'final state: {report["state"]}')
+    if report['divergence']:
+        print(f'DIVERGED: {report["divergence"]}')
+    else:
+        print('final state matches the trace')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('trace', help='trace file recorded with main.py --record')
+    parser.add_argument('--speed', help='replay speed, 1 for real speed', type=float, default=1.0)
+    parser.add_argument('--fast', help='replay as fast as possible', action='store_true', default=False)
+    parser.add_argument('--fake-render', help='create blank pages instead of rendering with chrome', action='store_true', default=False)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    create_media_dirs()
+    report = replay(Path(args.trace), speed=None if args.fast else args.speed, fake_render=args.fake_render)
+    print_report(report)
+    if report['divergence']:
+        raise SystemExit(1)
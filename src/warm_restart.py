@@ -0,0 +1,195 @@
+# Snapshot what the book shows, so a restart resumes on the same page and notification
+# without refreshing the panels that still show the right frames
+import json
+import os
+from logging import getLogger
+from pathlib import Path
+from threading import Event, Thread
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from PIL import Image
+
+import content
+import metrics
+from constants import *
+from frame_store import frame_writer
+
+logger = getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+FIND_PAGE_WINDOW = 2  # pages on each side of the expected page whose key is checked when the file is not found
+
+
+def frame_key(frame: Optional[Frame]) -> Optional[str]:
+    """the key of a frame on a panel: the hash of the file it is drawn from, which is also what a restart draws.
+       A composed left page is known by the file it is saved to
+
+    Args:
+        frame (Optional[Frame]): a frame in memory or a path to a image
+
+    Returns:
+        Optional[str]: the key, None if the frame cannot be drawn again after a restart, e.g. the overview
+    """
+    if frame is None:
+        return None
+    path = frame
+    if isinstance(frame, Image.Image):
+        path = content.persisted_path_of(frame)
+        if path is None:
+            return None
+        frame_writer.flush()
+    try:
+        key = content.render_cache.file_hash(path)
+    except OSError:
+        return None
+    if isinstance(frame, Image.Image) and content.persisted_path_of(frame) != path:
+        # a newer frame was saved while hashing
+        return None
+    return key
+
+
+def file_id(frame: Optional[Frame]) -> Optional[str]:
+    """an id of a page file that is kept when the pages are renamed by their order, found without reading the file
+
+    Args:
+        frame (Optional[Frame]): a frame in memory or a path to a image
+
+    Returns:
+        Optional[str]: inode, mtime and size of the file, None for a frame in memory or a missing file
+    """
+    if not isinstance(frame, Path):
+        return None
+    try:
+        stat = frame.stat()
+    except OSError:
+        return None
+    return f'{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+
+def load_snapshot(snapshot_path: Path = book_snapshot_path) -> Optional[Dict]:
+    """read the snapshot of the last run
+
+    Returns:
+        Optional[Dict]: the snapshot, None if there is none or it cannot be read
+    """
+    try:
+        snapshot = json.loads(snapshot_path.read_text())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.error(f'cannot read the snapshot {snapshot_path}: {e}')
+        return None
+    if snapshot.get('format') != SNAPSHOT_FORMAT:
+        logger.info('the snapshot is from another version, not restored')
+        return None
+    return snapshot
+
+
+def write_snapshot(snapshot: Dict, snapshot_path: Path = book_snapshot_path) -> None:
+    """save a snapshot to a temporary file synced to disk and move it into place,
+       so a power cut leaves either the old or the new snapshot
+    """
+    snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = snapshot_path.with_name(f'.{snapshot_path.name}.tmp')
+    with temp_path.open('w') as file:
+        json.dump(snapshot, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, snapshot_path)
+    metrics.inc('warm_restart.snapshots')
+
+
+def find_current_page(pages: Sequence[Path], snapshot: Dict) -> int:
+    """find the page shown by the last run. The pages are renamed by their order when they are loaded
+       and the oldest ones expire, so it is found by the id of its file, which only needs a stat of each page.
+       Otherwise the key of the right panel is checked a few pages around the same distance from the last page,
+       each key reads the whole page
+
+    Args:
+        pages (Sequence[Path]): the pages loaded after the restart
+        snapshot (Dict): the snapshot of the last run
+
+    Returns:
+        int: index of the page, HOME_PAGE_NUM when there is no page
+    """
+    if len(pages) == 0:
+        return HOME_PAGE_NUM
+    expected = min(max(len(pages) - 1 - snapshot['pages_after_current'], HOME_PAGE_NUM), len(pages) - 1)
+    current_file = snapshot.get('current_file')
+    if current_file is not None:
+        for index, page in enumerate(pages):
+            if file_id(page) == current_file:
+                return index
+    right_key = snapshot['panels'].get('right')
+    if right_key is not None:
+        nearby = sorted(range(max(expected - FIND_PAGE_WINDOW, 0), min(expected + FIND_PAGE_WINDOW + 1, len(pages))),
+                        key=lambda index: abs(index - expected))
+        for index in nearby:
+            if frame_key(pages[index]) == right_key:
+                return index
+    return expected
+
+
+class SnapshotWriter:
+    """Check the state of the book in a background thread and write it when it changed,
+       the panels are kept as frames by the book and hashed here, away from the refreshes
+    """
+    def __init__(self, get_state: Callable[[], Dict], snapshot_path: Path = book_snapshot_path,
+                 interval: float = WARM_RESTART_SNAPSHOT_INTERVAL) -> None:
+        """
+        Args:
+            get_state (Callable[[], Dict]): the state of the book with the frame on each panel, e.g. Book.get_snapshot_state
+            snapshot_path (Path, optional): where the snapshot is written
+            interval (float, optional): seconds between the checks
+        """
+        self.get_state = get_state
+        self.snapshot_path = snapshot_path
+        self.interval = interval
+        self._last_snapshot: Optional[Dict] = None
+        self._keys: Dict[str, Tuple[Optional[Frame], Optional[str]]] = {}
+        self._stop = Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name='snapshot_writer', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.write_if_changed()
+            except OSError as e:
+                logger.error(f'cannot write the snapshot: {e}')
+
+    def _panel_key(self, panel: str, frame: Optional[Frame]) -> Optional[str]:
+        # a panel keeps its frame for long, it is only hashed when it changes
+        last_frame, key = self._keys.get(panel, (None, None))
+        if frame is None or frame is not last_frame:
+            key = frame_key(frame)
+            self._keys[panel] = (frame, key)
+        return key
+
+    def write_if_changed(self) -> bool:
+        """take the state of the book and write it if it is not the last snapshot
+
+        Returns:
+            bool: a snapshot is written
+        """
+        state = self.get_state()
+        snapshot = {'format': SNAPSHOT_FORMAT,
+                    'current_page': state['current_page'],
+                    'pages_after_current': max(state['num_pages'] - 1 - state['current_page'], 0),
+                    'num_pages': state['num_pages'],
+                    'page_list_version': state['page_list_version'],
+                    'showing_notification': state['showing_notification'],
+                    'panels': {panel: self._panel_key(panel, frame) for panel, frame in state['panels'].items()},
+                    'current_file': file_id(state.get('current_frame'))}
+        if snapshot == self._last_snapshot:
+            return False
+        write_snapshot(snapshot, self.snapshot_path)
+        self._last_snapshot = snapshot
+        return True
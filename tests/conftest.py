@@ -0,0 +1,5 @@
+# The modules of the book live flat in src/ and are imported by name, like main.py does
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
@@ -0,0 +1,173 @@
+# The circuit breakers of network.py against a local HTTP server that injects faults
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from threading import Thread
+from time import monotonic, sleep
+
+import pytest
+
+import network
+from network import CircuitBreaker, CircuitOpenError
+
+BACKOFF = 0.2
+_endpoints = count()
+
+
+class FaultServer(ThreadingHTTPServer):
+    """Answer every request with the current fault: ok, error or slow, and count the requests
+    """
+    daemon_threads = True
+
+    def __init__(self) -> None:
+        super().__init__(('127.0.0.1', 0), FaultHandler)
+        self.fault = 'ok'
+        self.delay = 1.0
+        self.hits = 0
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/'
+
+
+class FaultHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        self.server.hits += 1
+        if self.server.fault == 'slow':
+            sleep(self.server.delay)
+        status = 500 if self.server.fault == 'error' else 200
+        body = f'{self.server.fault} {self.server.hits}'.encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def server():
+    server = FaultServer()
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def endpoint():
+    """a new endpoint with a short backoff, so the tests wait for it in real time
+    """
+    name = f'test_{next(_endpoints)}'
+    network._breakers[name] = CircuitBreaker(name, failures_to_open=3, backoff=BACKOFF, max_backoff=4 * BACKOFF)
+    yield name
+    network._breakers.pop(name)
+
+
+def fetch(url: str) -> str:
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return response.read().decode()
+
+
+def fail_until_open(server: FaultServer, endpoint: str) -> None:
+    server.fault = 'error'
+    for _ in range(3):
+        with pytest.raises(OSError):
+            network.call(endpoint, fetch, server.url)
+
+
+def test_call_returns_the_result(server, endpoint):
+    assert network.call(endpoint, fetch, server.url) == 'ok 1'
+
+
+def test_timeout_holds_the_endpoint_until_the_late_call_returns(server, endpoint):
+    server.fault = 'slow'
+    start_time = monotonic()
+    with pytest.raises(TimeoutError):
+        network.call(endpoint, fetch, server.url, timeout=0.2)
+    assert monotonic() - start_time < server.delay
+
+    # the late call is still running, the endpoint is not called again
+    with pytest.raises(CircuitOpenError):
+        network.call(endpoint, fetch, server.url, timeout=0.2)
+    assert server.hits == 1
+
+    sleep(server.delay + 0.3)
+    server.fault = 'ok'
+    assert network.call(endpoint, fetch, server.url) == 'ok 2'
+
+
+def test_breaker_opens_after_failures_in_a_row(server, endpoint):
+    fail_until_open(server, endpoint)
+    with pytest.raises(CircuitOpenError):
+        network.call(endpoint, fetch, server.url)
+    assert server.hits == 3
+    assert network.get_breaker(endpoint).is_open()
+
+
+def test_backoff_doubles_when_the_trial_call_fails(server, endpoint):
+    breaker = network.get_breaker(endpoint)
+    fail_until_open(server, endpoint)
+    assert breaker.open_until - monotonic() == pytest.approx(BACKOFF, abs=0.1)
+
+    sleep(BACKOFF + 0.05)
+    # the single trial call fails and the circuit opens again for twice as long
+    with pytest.raises(OSError):
+        network.call(endpoint, fetch, server.url)
+    assert server.hits == 4
+    assert breaker.open_until - monotonic() == pytest.approx(2 * BACKOFF, abs=0.1)
+    with pytest.raises(CircuitOpenError):
+        network.call(endpoint, fetch, server.url)
+    assert server.hits == 4
+
+
+def test_last_result_is_used_while_the_endpoint_fails(server, endpoint):
+    assert network.call(endpoint, fetch, server.url, use_last_result=True) == 'ok 1'
+    server.fault = 'error'
+    # failed calls and calls while the circuit is open both fall back to the last result
+    for _ in range(5):
+        assert network.call(endpoint, fetch, server.url, use_last_result=True) == 'ok 1'
+    assert server.hits == 4
+
+
+def test_half_open_trial_call_closes_the_circuit(server, endpoint):
+    breaker = network.get_breaker(endpoint)
+    fail_until_open(server, endpoint)
+    server.fault = 'ok'
+    with pytest.raises(CircuitOpenError):
+        network.call(endpoint, fetch, server.url)
+
+    sleep(BACKOFF + 0.05)
+    assert network.call(endpoint, fetch, server.url) == 'ok 4'
+    assert not breaker.is_open()
+    assert breaker.failures == 0
+    assert network.call(endpoint, fetch, server.url) == 'ok 5'
+
+
+def test_failed_download_leaves_no_file(server, tmp_path):
+    file_path = tmp_path / 'photo.jpg'
+    server.fault = 'error'
+    with pytest.raises(OSError):
+        network.download_file(server.url, file_path)
+    assert list(tmp_path.iterdir()) == []
+
+    server.fault = 'ok'
+    assert network.download_file(server.url, file_path).read_text() == 'ok 2'
+
+
+def test_scrape_error_of_the_scraper_library_does_not_stop_the_loop(monkeypatch):
+    class FailingScraper:
+        calls = 0
+
+        def scrape(self) -> None:
+            FailingScraper.calls += 1
+            raise RuntimeError('login required')
+
+    monkeypatch.setitem(network._breakers, 'scraper',
+                        CircuitBreaker('scraper', failures_to_open=3, backoff=BACKOFF, max_backoff=4 * BACKOFF))
+    scraper = FailingScraper()
+    for _ in range(5):
+        assert network.scrape_followings(scraper, timeout=1) is False
+    # the breaker is open after the third failure
+    assert FailingScraper.calls == 3
@@ -0,0 +1,94 @@
+# A book downloading its pages from a render server on localhost
+import urllib.error
+import urllib.request
+
+import pytest
+from PIL import Image
+
+from render_server import FrameManifest, RenderClient, RenderServer
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = RenderServer(None, host='127.0.0.1', port=0, manifest=FrameManifest(tmp_path / 'frames'))
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(server, tmp_path):
+    pages_path = tmp_path / 'right_pages'
+    pages_path.mkdir()
+    return RenderClient(server.url, state_path=tmp_path / 'render_client.json', timeout=5, pages_path=pages_path)
+
+
+def publish_pages(server: RenderServer, count: int) -> None:
+    for shade in range(count):
+        server.manifest.publish_page(Image.new('L', (100, 100), shade * 40))
+
+
+def test_client_downloads_only_the_new_pages(server, client):
+    publish_pages(server, 2)
+    pages = client.fetch_new_pages(0)
+    assert [page.name for page in pages] == ['right_page_1.jpg', 'right_page_2.jpg']
+    assert all(page.stat().st_size > 0 for page in pages)
+
+    publish_pages(server, 1)
+    assert [page.name for page in client.fetch_new_pages(2)] == ['right_page_3.jpg']
+    assert client.fetch_new_pages(3) == []
+
+
+def test_client_resumes_from_its_version(server, client):
+    publish_pages(server, 2)
+    client.fetch_new_pages(0)
+    publish_pages(server, 1)
+
+    restarted = RenderClient(server.url, state_path=client.state_path, timeout=5, pages_path=client.pages_path)
+    assert [page.name for page in restarted.fetch_new_pages(2)] == ['right_page_3.jpg']
+
+
+def test_left_page_is_downloaded_when_it_changes(server, client, tmp_path):
+    left_home = tmp_path / 'left_home.jpg'
+    assert client.fetch_left_page('left_home', left_home) is None
+
+    server.manifest.publish_left_page('left_home', Image.new('L', (100, 100), 0))
+    assert client.fetch_left_page('left_home', left_home) == left_home
+    assert client.fetch_left_page('left_home', left_home) is None
+
+    server.manifest.publish_left_page('left_home', Image.new('L', (100, 100), 255))
+    assert client.fetch_left_page('left_home', left_home) == left_home
+
+
+@pytest.mark.parametrize('frame_id', ['manifest.json', 'page_9.jpg', '..%2Fframes%2Fpage_1.jpg'])
+def test_only_published_frames_are_served(server, frame_id):
+    publish_pages(server, 1)
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(f'{server.url}/frames/{frame_id}', timeout=5)
+    assert error.value.code == 404
+
+
+def test_prune_drops_the_oldest_pages(server, client):
+    publish_pages(server, 3)
+    assert server.manifest.prune(max_pages=2) == 1
+    assert not (server.manifest.frames_path / 'page_1.jpg').exists()
+    assert [entry['id'] for entry in server.manifest.delta(0)['pages']] == ['page_2.jpg', 'page_3.jpg']
+    assert server.manifest.prune(max_pages=2) == 0
+
+    assert server.manifest.prune(max_pages=2, max_age=-1) == 2
+    assert server.manifest.get_protected_frames() == []
+    assert server.manifest.version == 3
+
+
+def test_client_skips_the_pages_pruned_while_downloading(server, client, monkeypatch):
+    publish_pages(server, 3)
+    fetch_manifest = client.fetch_manifest
+
+    def fetch_then_prune():
+        manifest = fetch_manifest()
+        server.manifest.prune(max_pages=1)
+        return manifest
+
+    monkeypatch.setattr(client, 'fetch_manifest', fetch_then_prune)
+    assert [page.name for page in client.fetch_new_pages(0)] == ['right_page_1.jpg']
+    assert client.version == 3